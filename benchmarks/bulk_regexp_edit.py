@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compare BulkRegexpEditorStep with the approach it replaced, which ran a
+# separate RegexpEditorStep for every file and replacement, on a synthetic
+# tree shaped like the openstack-ansible roles.
+#
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ostrich import emitters  # noqa
+from ostrich import steps  # noqa
+
+
+REPLACEMENTS = [
+    ('(http|https|git)://github.com', 'http://mirror.example.com/github'),
+    ('(http|https|git)://git.openstack.org',
+     'http://mirror.example.com/openstack'),
+    ('https://mirror.rackspace.com', 'http://mirror.rackspace.com'),
+    (' +checksum:.*', ''),
+    ('https://rpc-repo.rackspace.com',
+     'http://cache.example.com/rpc-repo.rackspace.com'),
+    ]
+
+FILTER = '.*\.(ini|yml|sh)$'
+
+FILLER = [
+    '- name: Install distro packages',
+    '  apt:',
+    '    pkg: "{{ item }}"',
+    '    state: "{{ package_state }}"',
+    '  with_items: "{{ distro_packages }}"',
+    '  register: install_packages',
+    '  until: install_packages | success',
+    '  retries: 5',
+    '  delay: 2',
+    '  tags:',
+    '    - install-packages',
+    ]
+
+MATCHING = [
+    '  src: https://github.com/openstack/openstack-ansible-foo',
+    '  repo: https://git.openstack.org/openstack/nova',
+    '    checksum: "sha256:0123456789abcdef"',
+    '  url: https://rpc-repo.rackspace.com/pools/foo.tgz',
+    ]
+
+
+def build(path, count, matching):
+    """A tree of count files, some of which contain things to replace."""
+
+    rand = random.Random(42)
+    for i in range(count):
+        d = os.path.join(path, 'role-%03d' % (i // 100), 'tasks')
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+        lines = [rand.choice(FILLER) for _ in range(rand.randint(20, 200))]
+        if rand.random() < matching:
+            for line in rand.sample(MATCHING, 2):
+                lines.insert(rand.randint(0, len(lines)), line)
+
+        ext = rand.choice(['yml', 'yml', 'yml', 'ini', 'sh', 'py', 'j2'])
+        with open(os.path.join(d, 'file-%05d.%s' % (i, ext)), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def per_replacement(path):
+    """What BulkRegexpEditorStep used to do."""
+
+    silent = emitters.NoopEmitter('noop', None)
+    step = steps.BulkRegexpEditorStep('bench', path, FILTER, REPLACEMENTS)
+    for filename in step._paths():
+        for search, replace in REPLACEMENTS:
+            steps.RegexpEditorStep('bulk-edit', filename, search,
+                                   replace).run(silent, None)
+
+
+def single_pass(path, processes=1):
+    step = steps.BulkRegexpEditorStep('bench', path, FILTER, REPLACEMENTS,
+                                      bulk_edit_processes=processes)
+    step.run(emitters.NoopEmitter('noop', None), None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', default=20000, type=int,
+                        help='Number of files in the tree')
+    parser.add_argument('--matching', default=0.05, type=float,
+                        help='Fraction of files with something to replace')
+    parser.add_argument('--processes', default=4, type=int,
+                        help=('Also try editing with a pool of this many '
+                              'processes. This helps most on slow disks, '
+                              'and on a page cached tree mostly shows the '
+                              'overhead of the pool.'))
+    args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        template = os.path.join(tempdir, 'template')
+        build(template, args.files, args.matching)
+
+        print('%-20s %10s %10s' % ('approach', 'first (s)', 'again (s)'))
+        approaches = [('per replacement', per_replacement),
+                      ('single pass', single_pass)]
+        if args.processes > 1:
+            approaches.append(
+                ('%d processes' % args.processes,
+                 lambda p: single_pass(p, processes=args.processes)))
+
+        for name, func in approaches:
+            tree = os.path.join(tempdir, name.replace(' ', '-'))
+            shutil.copytree(template, tree)
+
+            # The second run is what a retried or resumed step sees
+            times = []
+            for _ in range(2):
+                start = time.time()
+                func(tree)
+                times.append(time.time() - start)
+            print('%-20s %10.2f %10.2f' % (name, times[0], times[1]))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
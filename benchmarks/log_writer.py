@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compare writing step logs with a gzip flush after every line, which is what
+# emitters used to do, against the batched LogWriter. Reports lines written
+# per second and the size of the resulting log.
+#
+
+import argparse
+import datetime
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ostrich import logwriter  # noqa
+
+
+def lines(count):
+    """Something which looks like verbose ansible output."""
+
+    for i in range(count):
+        yield ('%s ok: [aio1_nova_api_container-%08x] => (item=%d) => '
+               '{"changed": false, "item": %d, "msg": "All items completed"}'
+               '\n' % (datetime.datetime.now(), i * 7919, i % 50, i))
+
+
+def per_line_flush(path, count):
+    f = gzip.open(path, 'w')
+    for line in lines(count):
+        f.write(line)
+        f.flush()
+    f.close()
+
+
+def batched(path, count, background=False):
+    f = logwriter.LogWriter(path, background=background)
+    for line in lines(count):
+        f.write(line)
+    f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', default=200000, type=int,
+                        help='Number of lines to write')
+    args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        print('%-20s %14s %14s' % ('writer', 'lines/sec', 'bytes'))
+        for name, func in [
+                ('per-line flush', per_line_flush),
+                ('batched', batched),
+                ('batched background',
+                 lambda p, c: batched(p, c, background=True))]:
+            path = os.path.join(tempdir, '%s.gz' % name.replace(' ', '-'))
+            start = time.time()
+            func(path, args.lines)
+            elapsed = time.time() - start
+            print('%-20s %14.0f %14d'
+                  % (name, args.lines / elapsed, os.path.getsize(path)))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
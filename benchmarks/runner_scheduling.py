@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Measure the cost of scheduling large numbers of trivial steps. Scheduling
+# should be linear in steps plus dependencies, so the time per step should
+# stay flat as the number of steps grows.
+#
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ostrich import emitters  # noqa
+from ostrich import runner  # noqa
+from ostrich import steps  # noqa
+
+
+class DummyStep(steps.Step):
+    def _run(self, emit, screen):
+        return True
+
+
+class BenchmarkRunner(runner.Runner):
+    def _get_state_path(self):
+        return None
+
+    def _get_emitter_class(self, use_curses):
+        return emitters.NoopEmitter
+
+
+def build(count, width, reverse):
+    """A chain of groups, each group holding width independent steps.
+
+    With reverse, step names sort in the opposite order to the chain, which
+    is the worst case for a scheduler that scans pending steps by name.
+    """
+
+    chain = []
+    group = []
+    for i in range(count):
+        if reverse:
+            i = count - i
+        group.append(DummyStep('dummy-%08d' % i))
+        if len(group) == width:
+            chain.append(group)
+            group = []
+    if group:
+        chain.append(group)
+    return chain
+
+
+def run(count, width, workers, reverse):
+    r = BenchmarkRunner(None, max_workers=workers)
+
+    start = time.time()
+    r.load_dependancy_chain(build(count, width, reverse))
+    loaded = time.time()
+    r.resolve_steps(use_curses=False)
+    resolved = time.time()
+
+    assert len(r.steps) == 0
+    return loaded - start, resolved - loaded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', default='1000,5000,10000,50000',
+                        help='Comma separated list of step counts to try')
+    parser.add_argument('--width', default=1, type=int,
+                        help='Number of independent steps per group')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Maximum number of steps in flight')
+    parser.add_argument('--reverse', default=False, action='store_true',
+                        help='Name steps in the reverse of chain order')
+    args = parser.parse_args()
+
+    print('%10s %10s %10s %14s' % ('steps', 'load (s)', 'resolve (s)',
+                                   'us per step'))
+    for count in [int(c) for c in args.steps.split(',')]:
+        load, resolve = run(count, args.width, args.workers,
+                            args.reverse)
+        print('%10d %10.3f %10.3f %14.1f'
+              % (count, load, resolve, (load + resolve) * 1e6 / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# An ansible callback plugin which records when each task starts, and when
+# it finishes on each host. Records are appended as JSON lines to the file
+# named by OSTRICH_TIMING_PATH, which ostrich reads once the play is done.
+# Without OSTRICH_TIMING_PATH set the plugin does nothing.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'ostrich_timing'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self.playbook = None
+        self.play = None
+
+        self.f = None
+        path = os.environ.get('OSTRICH_TIMING_PATH')
+        if path:
+            self.f = open(path, 'a')
+
+    def _record(self, event, **fields):
+        if not self.f:
+            return
+
+        fields['event'] = event
+        fields['time'] = time.time()
+        self.f.write(json.dumps(fields, sort_keys=True) + '\n')
+        self.f.flush()
+
+    def _host_end(self, result, status):
+        task = result._task
+        self._record('host-end', host=result._host.get_name(),
+                     task=task.get_name(), uuid=task._uuid, status=status)
+
+    def v2_playbook_on_start(self, playbook):
+        self.playbook = os.path.basename(playbook._file_name)
+        self._record('playbook-start', playbook=self.playbook)
+
+    def v2_playbook_on_play_start(self, play):
+        self.play = play.get_name()
+        self._record('play-start', playbook=self.playbook, play=self.play)
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._record('task-start', playbook=self.playbook, play=self.play,
+                     task=task.get_name(), uuid=task._uuid)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._record('task-start', playbook=self.playbook, play=self.play,
+                     task=task.get_name(), uuid=task._uuid, handler=True)
+
+    def v2_runner_on_start(self, host, task):
+        # Only called by ansible 2.8 and later. Before that a host's time on
+        # a task is taken to start with the task.
+        self._record('host-start', host=host.get_name(),
+                     task=task.get_name(), uuid=task._uuid)
+
+    def v2_runner_on_ok(self, result):
+        self._host_end(result, 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._host_end(result, 'ignored' if ignore_errors else 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self._host_end(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._host_end(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        self._record('playbook-end', playbook=self.playbook)
+        if self.f:
+            self.f.close()
+            self.f = None
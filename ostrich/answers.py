@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Answers to questions given ahead of time, so that ostrich can run without
+# anyone at the keyboard. Answers come from a YAML or JSON file passed with
+# --answers, and from OSTRICH_ANSWER_<QUESTION> environment variables, with
+# dashes in the question's name as underscores. The environment wins.
+#
+
+import ipaddress
+import os
+import re
+
+import yaml
+
+
+ENVIRONMENT_PREFIX = 'OSTRICH_ANSWER_'
+
+URL_RE = re.compile('^[a-z][a-z0-9+.-]*://[^/\s]+')
+HOST_RE = re.compile('^[a-zA-Z0-9.-]+(:[0-9]+)?$')
+
+# The ironic steps use addresses up to 11 from either end of the block
+MIN_IRONIC_HOSTS = 23
+
+
+class InvalidAnswer(ValueError):
+    pass
+
+
+def _url(value):
+    if not URL_RE.match(value):
+        raise InvalidAnswer('%s is not a URL like git://mirror.example.com'
+                            % value)
+
+
+def _url_or_none(value):
+    if value != 'none':
+        _url(value)
+
+
+def _host_or_none(value):
+    if value != 'none' and not HOST_RE.match(value):
+        raise InvalidAnswer('%s is not a hostname, or "none"' % value)
+
+
+def _branch(value):
+    if not value or re.search('\s', value):
+        raise InvalidAnswer('%s is not a branch or commit' % value)
+
+
+def _choice(*choices):
+    def check(value):
+        if value not in choices:
+            raise InvalidAnswer('%s is not one of %s'
+                                % (value, ', '.join(choices)))
+    return check
+
+
+def _cidr(value):
+    try:
+        net = ipaddress.ip_network(u'%s' % value)
+    except ValueError as e:
+        raise InvalidAnswer('%s is not a CIDR range: %s' % (value, e))
+    if net.num_addresses - 2 < MIN_IRONIC_HOSTS:
+        raise InvalidAnswer('%s is too small, it needs at least %d addresses'
+                            % (value, MIN_IRONIC_HOSTS))
+
+
+# Every question, and how to check an answer to it
+SCHEMA = {
+    'git-mirror-github': _url,
+    'git-mirror-openstack': _url,
+    'osa-branch': _branch,
+    'http-proxy': _url_or_none,
+    'hypervisor': _choice('ironic', 'kvm'),
+    'local-cache': _host_or_none,
+    'enable-ceph': _choice('yes', 'no'),
+    'ansible-debug': _choice('yes', 'no'),
+    'trace-processes': _choice('yes', 'no'),
+    'ironic-ip-block': _cidr,
+    }
+
+
+def validate(name, value):
+    """Raise InvalidAnswer if value isn't an answer to question name."""
+
+    check = SCHEMA.get(name)
+    if not check:
+        raise InvalidAnswer('%s is not a question we ask' % name)
+    check(value)
+
+
+def _normalize(value):
+    # YAML turns yes and no into booleans
+    if value is True:
+        return 'yes'
+    if value is False:
+        return 'no'
+    return str(value).strip()
+
+
+def load(path):
+    """Load and validate answers from a YAML or JSON file."""
+
+    with open(path) as f:
+        try:
+            data = yaml.safe_load(f.read())
+        except yaml.YAMLError as e:
+            raise InvalidAnswer('%s is not YAML or JSON: %s' % (path, e))
+
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise InvalidAnswer('%s should map questions to answers' % path)
+
+    answers = {}
+    for name, value in data.items():
+        value = _normalize(value)
+        validate(name, value)
+        answers[name] = value
+    return answers
+
+
+def from_environment(environ=None):
+    """Load and validate answers from OSTRICH_ANSWER_* variables."""
+
+    if environ is None:
+        environ = os.environ
+
+    answers = {}
+    for name in SCHEMA:
+        variable = ENVIRONMENT_PREFIX + name.upper().replace('-', '_')
+        if variable in environ:
+            value = _normalize(environ[variable])
+            validate(name, value)
+            answers[name] = value
+    return answers
+
+
+class Answers(object):
+    """Answers given ahead of time, by question name."""
+
+    def __init__(self, answers_path=None, environ=None):
+        self.answers = {}
+        if answers_path:
+            self.answers.update(load(answers_path))
+        self.answers.update(from_environment(environ))
+
+    def get(self, name):
+        return self.answers.get(name)
+
+
+ANSWERS = None
+
+
+def get(name):
+    """Return the answer given ahead of time to a question, or None."""
+
+    global ANSWERS
+    if ANSWERS is None:
+        ANSWERS = Answers()
+    return ANSWERS.get(name)
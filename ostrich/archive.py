@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Archive copies of files by their content. Each distinct file is stored
+# once under ~/.ostrich/objects, named by its sha256, and each run has a
+# manifest mapping the names of the files it archived to their objects.
+# Only the newest manifests are kept, along with the objects they use.
+#
+
+import errno
+import fcntl
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+import utils
+
+
+# ioctl(2) request to share a file's extents with another, on filesystems
+# which support it
+FICLONE = 0x40049409
+
+_MANIFEST_LOCK = threading.Lock()
+
+# Objects this new are never pruned, as a run might be about to add them to
+# its manifest
+PRUNE_GRACE = 3600
+
+
+def _clone(src, dst):
+    """Copy src to dst, as a reflink where the filesystem allows it."""
+
+    with open(src, 'rb') as s:
+        with open(dst, 'wb') as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                return
+            except (IOError, OSError):
+                pass
+            shutil.copyfileobj(s, d, 1024 * 1024)
+
+
+class ObjectStore(object):
+    """Files stored once each, by the sha256 of their content.
+
+    Objects are read only. They are copied out of the store rather than
+    linked, so that editing a checkout can't change what was archived.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.expanduser('~/.ostrich/objects')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def object_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def add(self, path):
+        """Store a file's content if we don't have it, returning its digest.
+
+        The file is copied rather than linked, so that later changes to it
+        don't change what was archived.
+        """
+
+        digest = utils.file_digest(path)
+        obj = self.object_path(digest)
+        if os.path.exists(obj):
+            # So that it isn't pruned before it is in a manifest
+            os.utime(obj, None)
+            return digest
+
+        if not os.path.exists(os.path.dirname(obj)):
+            try:
+                os.makedirs(os.path.dirname(obj))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(obj),
+                                        prefix='.tmp.')
+        os.close(fd)
+        try:
+            _clone(path, tmp_path)
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.rename(tmp_path, obj)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return digest
+
+    def digests(self):
+        """Return (digest, mtime) for every object."""
+
+        objects = []
+        for prefix in os.listdir(self.path):
+            d = os.path.join(self.path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                if name.startswith('.'):
+                    continue
+                try:
+                    mtime = os.stat(os.path.join(d, name)).st_mtime
+                except OSError:
+                    continue
+                objects.append((prefix + name, mtime))
+        return objects
+
+    def remove(self, digest):
+        try:
+            os.unlink(self.object_path(digest))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def copy(self, digest, dest, mode):
+        """Copy an object to dest, as a reflink where the filesystem allows
+        it, with the given mode.
+        """
+
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        if not os.path.exists(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+
+        _clone(self.object_path(digest), dest)
+        os.chmod(dest, mode)
+
+
+class Manifest(object):
+    """The files archived by a run, as name -> {sha256, mode, path}.
+
+    Steps running at the same time may share a run's manifest, so entries
+    are merged into the file on disk as they are added.
+    """
+
+    def __init__(self, run_id, path=None, store=None):
+        self.run_id = run_id
+        self.path = path or os.path.expanduser(
+            '~/.ostrich/manifests/%s.json' % run_id)
+        self.store = store or ObjectStore()
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.loads(f.read())
+
+    def _save(self, added):
+        with _MANIFEST_LOCK:
+            entries = self.entries()
+            entries.update(added)
+
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(entries, indent=4, sort_keys=True))
+            os.rename(tmp_path, self.path)
+
+    def _entry(self, path):
+        return {
+            'sha256': self.store.add(path),
+            'mode': stat.S_IMODE(os.stat(path).st_mode),
+            'path': path
+            }
+
+    def archive(self, name, path):
+        """Archive a file under a name, returning its digest."""
+
+        entry = self._entry(path)
+        self._save({name: entry})
+        return entry['sha256']
+
+    def archive_tree(self, name, top):
+        """Archive every file under top, as name/<relative path>."""
+
+        added = {}
+        for root, _, files in os.walk(top):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if not os.path.isfile(path):
+                    continue
+                rel = os.path.relpath(path, top)
+                added['%s/%s' % (name, rel)] = self._entry(path)
+        self._save(added)
+        return added
+
+    def checkout(self, name, dest):
+        """Copy the files archived under name/ into dest."""
+
+        prefix = name + '/'
+        for entry_name, entry in self.entries().items():
+            if entry_name.startswith(prefix):
+                path = os.path.join(dest, entry_name[len(prefix):])
+                self.store.copy(entry['sha256'], path, entry['mode'])
+
+
+def prune(keep, path=None, store=None):
+    """Remove all but the newest keep manifests, and unused objects.
+
+    Run ids sort by start time, so the newest manifests are the last by
+    name. Returns the number of manifests and objects removed.
+    """
+
+    path = path or os.path.expanduser('~/.ostrich/manifests')
+    store = store or ObjectStore()
+    if not os.path.exists(path):
+        return 0, 0
+
+    manifests = sorted([name for name in os.listdir(path)
+                        if name.endswith('.json')])
+    removed = manifests[:max(0, len(manifests) - keep)]
+    for name in removed:
+        os.unlink(os.path.join(path, name))
+
+    used = set()
+    for name in manifests[len(removed):]:
+        try:
+            with open(os.path.join(path, name)) as f:
+                entries = json.loads(f.read())
+        except (IOError, ValueError):
+            # Leave everything alone rather than guess what it used
+            return len(removed), 0
+        used.update([entry['sha256'] for entry in entries.values()])
+
+    unused = 0
+    cutoff = time.time() - PRUNE_GRACE
+    for digest, mtime in store.digests():
+        if digest not in used and mtime < cutoff:
+            store.remove(digest)
+            unused += 1
+    return len(removed), unused
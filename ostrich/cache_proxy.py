@@ -0,0 +1,545 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A caching HTTP server for the things an install downloads over and over,
+# which can stand in for the "local cache" server. Requests for
+# /<host>/<path> are fetched from https://<host>/<path>, which is the layout
+# the URL rewriting steps expect. It is also a forward proxy for plain http
+# requests. Only the hosts an install downloads from are fetched from, so
+# that it can't be used to reach anything else. Downloads are stored by their
+# sha256, and the least recently used are removed when the cache grows past
+# its size limit. Entries older than max_age are revalidated upstream with a
+# conditional GET before they are served.
+#
+
+import argparse
+import base64
+import BaseHTTPServer
+import binascii
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import re
+import socket
+import SocketServer
+import tempfile
+import threading
+import time
+import urllib2
+import urlparse
+
+
+DEFAULT_PORT = 8642
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 3600
+
+# The hosts the install downloads from by way of the local cache
+ALLOWED_HOSTS = [
+    'bootstrap.pypa.io',
+    'git.openstack.org',
+    'images.linuxcontainers.org',
+    'rpc-repo.rackspace.com',
+    ]
+
+# Directories in the local cache layout which aren't named for their host
+ALIASES = {
+    'pip': 'bootstrap.pypa.io'
+    }
+
+CHUNK = 1024 * 1024
+UPSTREAM_TIMEOUT = 60
+
+RANGE_RE = re.compile('^bytes=([0-9]*)-([0-9]*)$')
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class ArtifactStore(object):
+    """Downloads stored by content, and an index of URLs to content.
+
+    Objects are named by their sha256. Each URL has an index entry naming
+    its object, so URLs with the same content share it. Serving an object
+    updates its mtime, which is what least recently used means here.
+    """
+
+    def __init__(self, path=None, max_bytes=None, max_age=None):
+        self.path = path or os.path.expanduser('~/.ostrich/proxy')
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+        self.max_age = DEFAULT_MAX_AGE if max_age is None else max_age
+        for d in ['objects', 'index']:
+            if not os.path.exists(os.path.join(self.path, d)):
+                os.makedirs(os.path.join(self.path, d))
+
+        self._lock = threading.Lock()
+        self._fetching = {}
+
+    def object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest)
+
+    def _index_path(self, url):
+        return os.path.join(self.path, 'index',
+                            hashlib.sha256(url).hexdigest() + '.json')
+
+    @contextlib.contextmanager
+    def fetching(self, url):
+        """Hold a lock per URL, so that each is only fetched once at a time."""
+
+        with self._lock:
+            lock = self._fetching.setdefault(url, [threading.Lock(), 0])
+            lock[1] += 1
+        try:
+            with lock[0]:
+                yield
+        finally:
+            with self._lock:
+                lock[1] -= 1
+                if not lock[1]:
+                    del self._fetching[url]
+
+    def lookup(self, url):
+        """Return the index entry for a URL, or None if it isn't cached."""
+
+        try:
+            with open(self._index_path(url)) as f:
+                entry = json.loads(f.read())
+            obj = self.object_path(entry['sha256'])
+            if os.path.getsize(obj) != entry['size']:
+                return None
+            os.utime(obj, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def stale(self, entry):
+        return time.time() - entry.get('fetched', 0) > self.max_age
+
+    def store(self, url, response, tee=None):
+        """Store a urllib2 response, returning its index entry.
+
+        The content must match the response's Content-Length, and any
+        sha256 the server sent with it. With tee set, the content is also
+        written there as it arrives, except for the last chunk, which is
+        only written once the content has been checked.
+        """
+
+        headers = response.info()
+        h = hashlib.sha256()
+        size = 0
+        pending = None
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.path,
+                                                         'objects'),
+                                        prefix='.tmp.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    d = response.read(CHUNK)
+                    if not d:
+                        break
+                    h.update(d)
+                    size += len(d)
+                    f.write(d)
+
+                    if pending:
+                        tee = _write(tee, pending)
+                    pending = d
+
+            digest = h.hexdigest()
+            length = headers.getheader('Content-Length')
+            if length is not None and int(length) != size:
+                raise ChecksumMismatch('%s was %d bytes, not %s'
+                                       % (url, size, length))
+            expected = _expected_sha256(headers)
+            if expected and expected != digest:
+                raise ChecksumMismatch('%s has sha256 %s, not %s'
+                                       % (url, digest, expected))
+
+            os.rename(tmp_path, self.object_path(digest))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        if pending:
+            _write(tee, pending)
+
+        entry = {
+            'url': url,
+            'sha256': digest,
+            'size': size,
+            'content_type': headers.getheader('Content-Type'),
+            'etag': headers.getheader('ETag'),
+            'last_modified': headers.getheader('Last-Modified'),
+            'fetched': time.time()
+            }
+        self._write_entry(entry)
+
+        self.evict()
+        return entry
+
+    def _write_entry(self, entry):
+        index_path = self._index_path(entry['url'])
+        with open(index_path + '.tmp', 'w') as f:
+            f.write(json.dumps(entry, indent=4, sort_keys=True))
+        os.rename(index_path + '.tmp', index_path)
+
+    def refresh(self, entry):
+        """Record that upstream says an entry is still current."""
+
+        entry = dict(entry)
+        entry['fetched'] = time.time()
+        self._write_entry(entry)
+        return entry
+
+    def _objects(self):
+        objects = []
+        for name in os.listdir(os.path.join(self.path, 'objects')):
+            if name.startswith('.'):
+                continue
+            try:
+                st = os.stat(self.object_path(name))
+            except OSError:
+                continue
+            objects.append((st.st_mtime, st.st_size, name))
+        return objects
+
+    def usage(self):
+        return sum([size for _, size, _ in self._objects()])
+
+    def evict(self):
+        """Remove the least recently used objects, down to max_bytes.
+
+        Index entries for removed objects are left, and are misses.
+        """
+
+        objects = sorted(self._objects())
+        used = sum([size for _, size, _ in objects])
+        for _, size, name in objects:
+            if used <= self.max_bytes:
+                break
+            try:
+                os.unlink(self.object_path(name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            used -= size
+
+    def verify(self):
+        """Remove objects whose content doesn't match their name."""
+
+        bad = []
+        for _, _, name in self._objects():
+            h = hashlib.sha256()
+            with open(self.object_path(name), 'rb') as f:
+                while True:
+                    d = f.read(CHUNK)
+                    if not d:
+                        break
+                    h.update(d)
+            if h.hexdigest() != name:
+                os.unlink(self.object_path(name))
+                bad.append(name)
+        return bad
+
+
+def _write(f, d):
+    """Write to a client, returning None once it has gone away."""
+
+    if f:
+        try:
+            f.write(d)
+        except (socket.error, IOError):
+            return None
+    return f
+
+
+def _expected_sha256(headers):
+    """The sha256 a response says its content has, as hex, or None."""
+
+    checksum = headers.getheader('X-Checksum-Sha256')
+    if checksum:
+        return checksum.strip().lower()
+
+    # RFC 3230, as in "Digest: SHA-256=<base64>"
+    for digest in (headers.getheader('Digest') or '').split(','):
+        algorithm, _, value = digest.strip().partition('=')
+        if algorithm.lower() == 'sha-256' and value:
+            try:
+                return binascii.hexlify(base64.b64decode(value))
+            except (TypeError, binascii.Error):
+                return None
+    return None
+
+
+def parse_range(header, size):
+    """Return (start, end) inclusive for a Range header, or None for all.
+
+    Raises ValueError for a range which can't be satisfied. Only single
+    byte ranges are supported, others are answered with everything.
+    """
+
+    if not header:
+        return None
+    m = RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+
+    if not m.group(1):
+        # The last n bytes
+        length = int(m.group(2))
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def upstream_url(path, allowed_hosts=None):
+    """The URL a request path is for, or None if it isn't allowed."""
+
+    if path.startswith('http://') or path.startswith('https://'):
+        url = path
+    else:
+        host, _, rest = path.lstrip('/').partition('/')
+        url = 'https://%s/%s' % (ALIASES.get(host, host), rest)
+
+    if allowed_hosts is None:
+        allowed_hosts = ALLOWED_HOSTS
+    if urlparse.urlparse(url).hostname not in allowed_hosts:
+        return None
+    return url
+
+
+class CacheProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'ostrich-cache-proxy'
+
+    def log_message(self, fmt, *args):
+        if self.server.access_log:
+            self.server.access_log.write('%s %s\n' % (self.address_string(),
+                                                      fmt % args))
+            self.server.access_log.flush()
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+    def _revalidate(self, url, entry):
+        """Ask upstream if an entry is current, returning the entry to use.
+
+        If upstream can't be reached, the entry we have is used.
+        """
+
+        request = urllib2.Request(url)
+        if entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+        if entry.get('last_modified'):
+            request.add_header('If-Modified-Since', entry['last_modified'])
+
+        store = self.server.store
+        try:
+            response = self.server.opener.open(request,
+                                               timeout=UPSTREAM_TIMEOUT)
+            return store.store(url, response)
+        except urllib2.HTTPError as e:
+            if e.code == 304:
+                return store.refresh(entry)
+            return entry
+        except (urllib2.URLError, socket.error, IOError, ChecksumMismatch):
+            return entry
+
+    def _stream(self, url, response):
+        """Send a response to the client while it is stored."""
+
+        headers = response.info()
+        self.send_response(200)
+        for header in ['Content-Length', 'Content-Type']:
+            if headers.getheader(header):
+                self.send_header(header, headers.getheader(header))
+        self.end_headers()
+
+        try:
+            self.server.store.store(url, response, tee=self.wfile)
+        except (socket.error, IOError, ChecksumMismatch) as e:
+            # The client is missing the last of the content, so it sees
+            # the download fail rather than get something corrupt
+            self.log_message('%s: %s', url, e)
+            self.close_connection = 1
+
+    def _serve(self, body):
+        url = upstream_url(self.path, self.server.allowed_hosts)
+        if not url:
+            self.send_error(403)
+            return
+
+        store = self.server.store
+        entry = store.lookup(url)
+        if entry and store.stale(entry):
+            with store.fetching(url):
+                entry = store.lookup(url)
+                if entry and store.stale(entry):
+                    entry = self._revalidate(url, entry)
+
+        if not entry:
+            with store.fetching(url):
+                entry = store.lookup(url)
+                if not entry:
+                    try:
+                        response = self.server.opener.open(
+                            url, timeout=UPSTREAM_TIMEOUT)
+                        if body and not self.headers.getheader('Range'):
+                            self._stream(url, response)
+                            return
+                        entry = store.store(url, response)
+                    except urllib2.HTTPError as e:
+                        self.send_error(e.code)
+                        return
+                    except (urllib2.URLError, socket.error, IOError,
+                            ChecksumMismatch) as e:
+                        self.send_error(502, str(e))
+                        return
+
+        size = entry['size']
+        try:
+            byte_range = parse_range(self.headers.getheader('Range'), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.end_headers()
+            return
+
+        if byte_range:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, size))
+        else:
+            start, end = 0, size - 1
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Content-Type',
+                         entry['content_type'] or 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"%s"' % entry['sha256'])
+        self.end_headers()
+        if not body:
+            return
+
+        with open(store.object_path(entry['sha256']), 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                d = f.read(min(CHUNK, remaining))
+                if not d:
+                    break
+                self.wfile.write(d)
+                remaining -= len(d)
+
+
+class CacheProxy(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, store, access_log=None, opener=None,
+                 allowed_hosts=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, CacheProxyHandler)
+        self.store = store
+        self.access_log = access_log
+        self.allowed_hosts = allowed_hosts or ALLOWED_HOSTS
+
+        # By default, upstream requests use any proxy in the environment
+        self.opener = opener or urllib2.build_opener()
+
+
+def start(port=DEFAULT_PORT, address='127.0.0.1', store=None,
+          allowed_hosts=None):
+    """Run a cache proxy on a thread of its own, returning the server."""
+
+    store = store or ArtifactStore()
+    server = CacheProxy((address, port), store,
+                        open(os.path.join(store.path, 'access.log'), 'a'),
+                        allowed_hosts=allowed_hosts)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def local_address():
+    """The address other machines, and containers, can reach us on."""
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # Nothing is sent, this just picks the interface with the route
+        s.connect(('192.0.2.1', 80))
+        return s.getsockname()[0]
+    except socket.error:
+        return socket.gethostbyname(socket.gethostname())
+    finally:
+        s.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='A caching HTTP server for ostrich installs')
+    parser.add_argument('--port', dest='port', default=DEFAULT_PORT, type=int,
+                        help='The port to listen on')
+    parser.add_argument('--address', dest='address', default='127.0.0.1',
+                        help=('The address to listen on. Containers need an '
+                              'address of the host they can reach'))
+    parser.add_argument('--allow-host', dest='allowed_hosts', default=[],
+                        action='append',
+                        help=('Another host which may be downloaded from, '
+                              'as well as %s' % ', '.join(ALLOWED_HOSTS)))
+    parser.add_argument('--max-age', dest='max_age', default=DEFAULT_MAX_AGE,
+                        type=int,
+                        help=('Seconds before a download is checked with '
+                              'upstream again'))
+    parser.add_argument('--path', dest='path', default=None,
+                        help='Where to keep the cache')
+    parser.add_argument('--max-size', dest='max_size', default=20, type=int,
+                        help='The largest the cache may grow to, in GB')
+    parser.add_argument('--verify', dest='verify', default=False,
+                        action='store_true',
+                        help=('Check the content of everything in the cache, '
+                              'remove anything corrupt, and exit'))
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.path, args.max_size * 1024 * 1024 * 1024,
+                          args.max_age)
+    if args.verify:
+        bad = store.verify()
+        print('Removed %d corrupt objects' % len(bad))
+        return
+
+    server = start(args.port, args.address, store,
+                   ALLOWED_HOSTS + args.allowed_hosts)
+    print('Serving a cache of %s on %s:%d'
+          % (store.path, args.address, args.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
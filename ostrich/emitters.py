@@ -12,12 +12,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import curses
 import datetime
-import gzip
 import os
 import sys
 import textwrap
+import threading
+import time
+
+import logwriter
+
+
+# Steps can run in parallel, so writes to the shared screen or stdout need
+# to be serialized.
+OUTPUT_LOCK = threading.RLock()
+
+# While a question is being asked, output from other steps is logged but
+# only drawn once it has been answered, so that the prompt stays put
+_ASKING = []
+_DEFERRED = []
+
+# How often keys are polled for while a question is being asked
+INPUT_POLL_INTERVAL = 0.05
+
+
+def _printable(line):
+    return ''.join([i if ord(i) < 128 else ' ' for i in line])
 
 
 class NoopEmitter(object):
@@ -29,10 +48,28 @@ class NoopEmitter(object):
     def clear(self):
         pass
 
-    def logger(self, logfile):
+    def logger(self, logfile, background=False, events=None, step=None):
         pass
 
+    def close(self):
+        if self.logfile:
+            self.logfile.close()
+            self.logfile = None
+
     def emit(self, s):
+        """Write to both the log and the screen."""
+        pass
+
+    def log(self, s):
+        """Write to the log only."""
+        pass
+
+    def display(self, s):
+        """Write to the screen only."""
+        pass
+
+    def event(self, event, **fields):
+        """Record a structured event in the run's event log."""
         pass
 
     def getstr(self, s):
@@ -40,27 +77,59 @@ class NoopEmitter(object):
 
 
 class LoggingEmitter(NoopEmitter):
-    def logger(self, logfile):
+    def logger(self, logfile, background=False, events=None, step=None):
         if self.logfile:
             self.logfile.close()
-        self.logfile = gzip.open(
-            os.path.expanduser('~/.%s/%s.gz'
-                               % (self.progname, logfile)), 'w')
+        self.logfile = logwriter.LogWriter(
+            os.path.expanduser('~/.%s/%s.gz' % (self.progname, logfile)),
+            background=background)
+        self.events = events
+        self.step = step
+
+    def event(self, event, **fields):
+        if getattr(self, 'events', None):
+            if self.step:
+                fields['step'] = self.step
+            self.events.write(event, **fields)
+
+    def _log_line(self, line):
+        if self.logfile:
+            self.logfile.write('%s %s\n' % (datetime.datetime.now(), line))
+
+    def log(self, s):
+        for line in s.split('\n'):
+            self._log_line(_printable(line))
 
 
 class Emitter(LoggingEmitter):
     def clear(self):
-        self.output.clear()
+        with OUTPUT_LOCK:
+            if not _ASKING:
+                self.output.clear()
 
     def emit(self, s):
+        with OUTPUT_LOCK:
+            self._emit_or_defer(s, True)
+
+    def display(self, s):
+        with OUTPUT_LOCK:
+            self._emit_or_defer(s, False)
+
+    def _emit_or_defer(self, s, log):
+        if _ASKING and _ASKING[0] is not self:
+            if log:
+                self.log(s)
+            _DEFERRED.append(s)
+            return
+        self._emit(s, log)
+
+    def _emit(self, s, log):
         height, width = self.output.getmaxyx()
 
         for line in s.split('\n'):
-            line = ''.join([i if ord(i) < 128 else ' ' for i in line])
-
-            if self.logfile:
-                self.logfile.write('%s %s\n' % (datetime.datetime.now(), line))
-                self.logfile.flush()
+            line = _printable(line)
+            if log:
+                self._log_line(line)
 
             for l in textwrap.wrap(line, width - 3):
                 if len(l) > 0:
@@ -78,29 +147,72 @@ class Emitter(LoggingEmitter):
         self.output.refresh()
 
     def getstr(self, s):
-        height, width = self.output.getmaxyx()
+        # Only imported here, so that ostrich can run without curses
+        import curses
+
+        with OUTPUT_LOCK:
+            height, width = self.output.getmaxyx()
+            self._emit(s, True)
+            _ASKING.append(self)
+            self.output.nodelay(True)
+
+        # curses isn't thread safe, so rather than block in getstr() with
+        # other steps drawing, keys are polled for with the lock held only
+        # for each poll
+        answer = ''
+        try:
+            while True:
+                with OUTPUT_LOCK:
+                    ch = self.output.getch()
+                    if ch in (10, 13, curses.KEY_ENTER):
+                        break
+                    elif ch in (8, 127, curses.KEY_BACKSPACE):
+                        answer = answer[:-1]
+                    elif 32 <= ch < 127:
+                        answer += chr(ch)
+
+                    if ch != -1:
+                        self.output.addstr(
+                            height - 2, len(s) + 2,
+                            (answer + ' ')[:max(0, width - len(s) - 4)])
+                        self.output.refresh()
+
+                if ch == -1:
+                    time.sleep(INPUT_POLL_INTERVAL)
+        finally:
+            with OUTPUT_LOCK:
+                self.output.nodelay(False)
+                _ASKING.remove(self)
+                deferred = list(_DEFERRED)
+                del _DEFERRED[:]
+                for d in deferred:
+                    self._emit(d, False)
 
-        self.emit(s)
-        curses.echo()
-        answer = self.output.getstr(height - 2, len(s) + 2)
-        curses.noecho()
         return answer
 
 
 class SimpleEmitter(LoggingEmitter):
     def clear(self):
-        sys.stdout.write('-----------------------------------------------\n')
+        with OUTPUT_LOCK:
+            sys.stdout.write(
+                '-----------------------------------------------\n')
 
     def emit(self, s):
-        for line in s.split('\n'):
-            line = ''.join([i if ord(i) < 128 else ' ' for i in line])
+        with OUTPUT_LOCK:
+            self._emit(s, True)
+
+    def display(self, s):
+        with OUTPUT_LOCK:
+            self._emit(s, False)
 
-            if self.logfile:
-                self.logfile.write('%s %s\n' % (datetime.datetime.now(), line))
-                self.logfile.flush()
+    def _emit(self, s, log):
+        for line in s.split('\n'):
+            line = _printable(line)
+            if log:
+                self._log_line(line)
 
             sys.stdout.write('%s\n' % line)
-            sys.stdout.flush()
+        sys.stdout.flush()
 
     def getstr(self, s):
         answer = raw_input(s)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+
+import utils
+
+
+class EventLog(object):
+    """A structured record of a run, one JSON object per line.
+
+    Every event has a name and a monotonic timestamp in seconds, "t". The
+    first event of a run, "run-start", also records the wall clock time for
+    that timestamp, so that the others can be placed in real time.
+    """
+
+    def __init__(self, path, run_id):
+        self.path = path
+        self.run_id = run_id
+        self._lock = threading.Lock()
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._f = open(path, 'a')
+
+        self.write('run-start', run=run_id, wall=time.time())
+
+    def write(self, event, **fields):
+        fields['event'] = event
+        fields['t'] = round(utils.monotonic(), 3)
+        line = json.dumps(fields, sort_keys=True, separators=(',', ':'))
+
+        with self._lock:
+            if self._f:
+                self._f.write(line + '\n')
+                self._f.flush()
+
+    def close(self):
+        with self._lock:
+            if self._f:
+                self._f.close()
+                self._f = None
+
+
+def read(path):
+    """Return the events in a log, skipping a truncated final line."""
+
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+    return events
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import gzip
+import threading
+import time
+import weakref
+
+
+# Buffered lines are handed to gzip once there is this much of them
+FLUSH_BYTES = 64 * 1024
+
+# ...or once this many seconds have passed, at which point gzip is also
+# flushed so that the log on disk can be read up to that point
+FLUSH_INTERVAL = 5.0
+
+
+_OPEN_WRITERS = weakref.WeakSet()
+
+
+@atexit.register
+def _close_all():
+    for writer in list(_OPEN_WRITERS):
+        writer.close()
+
+
+class LogWriter(object):
+    """Write to a gzip log in batches.
+
+    Flushing a gzip file after every line ends a deflate block each time,
+    which costs a write and most of the compression. Instead lines are
+    buffered, and only flushed on a size or time boundary, when flush() is
+    called, and on close. Open writers are closed at exit.
+
+    With background set, compression happens on a thread of its own, which
+    also flushes the log when it has been idle for FLUSH_INTERVAL.
+    """
+
+    def __init__(self, path, background=False, flush_bytes=None,
+                 flush_interval=None):
+        self.path = path
+        self.flush_bytes = flush_bytes or FLUSH_BYTES
+        self.flush_interval = flush_interval or FLUSH_INTERVAL
+
+        self._gz = gzip.open(path, 'w')
+        self._lock = threading.Condition(threading.Lock())
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.time()
+        self._closed = False
+
+        # Batches waiting for the compression thread, and counts of batches
+        # handed over and written so that flush() can wait for them
+        self._batches = []
+        self._handed = 0
+        self._written = 0
+
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._compress)
+            self._thread.daemon = True
+            self._thread.start()
+
+        _OPEN_WRITERS.add(self)
+
+    def write(self, s):
+        with self._lock:
+            if self._closed:
+                raise ValueError('write to closed log %s' % self.path)
+
+            self._buffer.append(s)
+            self._buffered += len(s)
+            if self._buffered >= self.flush_bytes:
+                self._hand_off(False)
+            elif time.time() - self._last_flush >= self.flush_interval:
+                self._hand_off(True)
+
+    def flush(self):
+        with self._lock:
+            if self._closed:
+                return
+
+            self._hand_off(True)
+            handed = self._handed
+            while self._thread and self._written < handed:
+                self._lock.wait(1)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            # No need to sync, closing the gzip file ends the stream
+            self._hand_off(False)
+            self._lock.notify_all()
+
+        if self._thread:
+            self._thread.join()
+        self._gz.close()
+        _OPEN_WRITERS.discard(self)
+
+    def _hand_off(self, sync):
+        # Called with the lock held
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if sync:
+            self._last_flush = time.time()
+
+        if self._thread:
+            self._batches.append((data, sync))
+            self._handed += 1
+            self._lock.notify_all()
+        else:
+            self._write_batch(data, sync)
+
+    def _write_batch(self, data, sync):
+        if data:
+            self._gz.write(data)
+        if sync:
+            self._gz.flush()
+
+    def _compress(self):
+        with self._lock:
+            while True:
+                if not self._batches:
+                    if self._closed:
+                        return
+
+                    self._lock.wait(self.flush_interval)
+                    if (self._buffer and time.time() - self._last_flush >=
+                            self.flush_interval):
+                        self._hand_off(True)
+                    continue
+
+                batches = self._batches
+                self._batches = []
+
+                # Compress without holding up writers
+                self._lock.release()
+                try:
+                    for data, sync in batches:
+                        self._write_batch(data, sync)
+                finally:
+                    self._lock.acquire()
+
+                self._written += len(batches)
+                self._lock.notify_all()
@@ -16,18 +16,23 @@
 #
 
 import argparse
-import copy
-import curses
 import importlib
 import os
 import re
 import sys
 
+import answers
+import archive
+import cache_proxy
 import runner
 import stage_loader
+import step_cache
 import steps
+import timings
 import utils
 
+from ostrich.stages import stage_91_install
+
 
 ARGS = None
 
@@ -38,67 +43,59 @@ def deploy(screen):
     if not ARGS.no_curses:
         screen.nodelay(False)
 
-    r = runner.Runner(screen)
+    cache = None
+    if ARGS.step_cache:
+        cache = step_cache.StepCache()
+
+    r = runner.Runner(screen, max_workers=ARGS.max_workers, step_cache=cache,
+                      background_logs=ARGS.background_logs,
+                      timings=timings.TimingStore())
+    r.kwargs['run_id'] = r.run_id
+    archive.prune(ARGS.archive_keep_runs)
+    if ARGS.cache_proxy:
+        # Containers need to reach it, but the bridges they use don't exist
+        # yet, so listen on the one address we tell them about
+        address = cache_proxy.local_address()
+        cache_proxy.start(
+            ARGS.cache_proxy_port, address,
+            store=cache_proxy.ArtifactStore(
+                max_bytes=ARGS.cache_proxy_size * 1024 * 1024 * 1024))
+
+        # The URL rewriting steps use the local cache answer
+        r.complete['local-cache'] = '%s:%d' % (address, ARGS.cache_proxy_port)
+    r.kwargs['parallel_plays'] = ARGS.parallel_plays
+    r.kwargs['bulk_edit_processes'] = ARGS.bulk_edit_processes
+    r.kwargs['git_reference'] = ARGS.git_reference or bool(ARGS.git_bundle)
+    r.kwargs['prefetch'] = ARGS.prefetch
+    r.kwargs['git_bundle'] = (os.path.abspath(ARGS.git_bundle)
+                              if ARGS.git_bundle else None)
 
     # Generic stage lookup tool. This allows deployers to add stages without
     # re-coding the underlying engine, and for new stages to be added without
     # a lot of plumbing.
-    for stage_pyname in stage_loader.discover_stages():
-        name = stage_pyname.replace('.py', '')
-        module = importlib.import_module('ostrich.stages.%s' % name)
-        r.load_dependancy_chain(module.get_steps(r))
+    manifest = None
+    if ARGS.stage_manifest:
+        manifest = stage_loader.StageManifest()
+
+    for name, module_name in stage_loader.discover_stage_modules():
+        if manifest and manifest.complete(name, module_name, r):
+            continue
+
+        module = importlib.import_module(module_name)
+        stage_steps = module.get_steps(r)
+        if manifest:
+            manifest.record(name, module_name, r, stage_steps)
+        r.load_dependancy_chain(stage_steps)
         r.resolve_steps(use_curses=(not ARGS.no_curses))
 
     # The last of the things
     r.kwargs['max_attempts'] = 3
     r.kwargs['cwd'] = '/opt/openstack-ansible/playbooks'
 
-    error_kwargs = copy.deepcopy(r.kwargs)
-    error_kwargs['max_attempts'] = 1
-    error_kwargs['cwd'] = None
-
-    nextsteps = []
-    playnames = [
-        ('openstack-hosts-setup', None),
-        ('security-hardening', None),
-        ('lxc-hosts-setup', None),
-        ('lxc-containers-create',
-         steps.SimpleCommandStep(
-                'lxc-containers-create-on-error',
-                './helpers/lxc-ifup',
-                **error_kwargs
-                )
-         ),
-        ('setup-infrastructure', None),
-        ('os-keystone-install', None),
-        ('os-glance-install', None),
-        ('os-cinder-install', None),
-        ('os-nova-install', None),
-        ('os-neutron-install', None),
-        ('os-heat-install', None),
-        ('os-horizon-install', None),
-        ('os-ceilometer-install', None),
-        ('os-aodh-install', None),
-        ('os-swift-install', None)
-    ]
-
-    if utils.is_ironic(r):
-        playnames.append(('os-ironic-install', None))
-
-    for play, on_failure in playnames:
-        r.kwargs['on_failure'] = on_failure
-        nextsteps.append(
-            steps.AnsibleTimingSimpleCommandStep(
-                play,
-                'openstack-ansible -vvv %s.yml' % play,
-                os.path.expanduser('~/.ostrich/timings-%s.json' % play),
-                **r.kwargs)
-        )
-    r.load_dependancy_chain(nextsteps)
+    r.load_dependancy_chain(stage_91_install.get_play_steps(r))
     r.resolve_steps(use_curses=(not ARGS.no_curses))
 
     r.kwargs['cwd'] = None
-    r.kwargs['on_failure'] = None
 
     #####################################################################
     # Release specific steps: Mitaka
@@ -173,6 +170,71 @@ def main():
     parser.add_argument('--no-curses', dest='no_curses',
                         default=False, action='store_true',
                         help='Do not use curses for the UI')
+    parser.add_argument('--max-workers', dest='max_workers',
+                        default=4, type=int,
+                        help=('The maximum number of independent steps to '
+                              'run at the same time'))
+    parser.add_argument('--parallel-plays', dest='parallel_plays',
+                        default=False, action='store_true',
+                        help=('Run OpenStack-Ansible plays which do not '
+                              'depend on each other at the same time'))
+    parser.add_argument('--bulk-edit-processes', dest='bulk_edit_processes',
+                        default=1, type=int,
+                        help=('The number of processes to edit files with '
+                              'when rewriting URLs across whole trees'))
+    parser.add_argument('--git-reference', dest='git_reference',
+                        default=False, action='store_true',
+                        help=('Clone openstack-ansible from a reference '
+                              'repository kept in ~/.ostrich/git, which is '
+                              'brought up to date with an incremental fetch'))
+    parser.add_argument('--git-bundle', dest='git_bundle', default=None,
+                        help=('A git bundle of openstack-ansible to seed the '
+                              'reference repository from, for hosts which '
+                              'cannot reach the git mirror. Implies '
+                              '--git-reference'))
+    parser.add_argument('--cache-proxy', dest='cache_proxy',
+                        default=False, action='store_true',
+                        help=('Run a caching HTTP server for the things the '
+                              'install downloads, kept in ~/.ostrich/proxy, '
+                              'and use it instead of the local cache '
+                              'answered earlier'))
+    parser.add_argument('--cache-proxy-port', dest='cache_proxy_port',
+                        default=cache_proxy.DEFAULT_PORT, type=int,
+                        help='The port the caching HTTP server listens on')
+    parser.add_argument('--cache-proxy-size', dest='cache_proxy_size',
+                        default=20, type=int,
+                        help=('The largest the caching HTTP server\'s cache '
+                              'may grow to, in GB'))
+    parser.add_argument('--prefetch', dest='prefetch',
+                        default=False, action='store_true',
+                        help=('Download packages, and with --git-reference '
+                              'fetch openstack-ansible, in the background '
+                              'while questions are being answered'))
+    parser.add_argument('--answers', dest='answers', default=None,
+                        help=('A YAML or JSON file of answers to questions, '
+                              'by question name. OSTRICH_ANSWER_<QUESTION> '
+                              'environment variables, with dashes as '
+                              'underscores, are used too and take '
+                              'precedence'))
+    parser.add_argument('--step-cache', dest='step_cache',
+                        default=False, action='store_true',
+                        help=('Skip steps whose inputs and outputs are '
+                              'unchanged since they last ran, even if they '
+                              'are not in the saved state'))
+    parser.add_argument('--archive-keep-runs', dest='archive_keep_runs',
+                        default=20, type=int,
+                        help=('The number of runs whose archived files, in '
+                              '~/.ostrich/objects, are kept'))
+    parser.add_argument('--stage-manifest', dest='stage_manifest',
+                        default=False, action='store_true',
+                        help=('Skip importing stages whose steps are all '
+                              'complete, using a manifest of the steps '
+                              'each stage returned last time'))
+    parser.add_argument('--background-log-compression',
+                        dest='background_logs',
+                        default=False, action='store_true',
+                        help=('Compress step logs on a thread of their own, '
+                              'instead of on the thread running the step'))
     ARGS, extras = parser.parse_known_args()
 
     # We really like persistent sessions
@@ -180,7 +242,14 @@ def main():
         if ('TMUX' not in os.environ) and ('STY' not in os.environ):
             sys.exit('Only run ostrich in a screen or tmux session please')
 
+    # Check answers given ahead of time before anything starts
+    try:
+        answers.ANSWERS = answers.Answers(ARGS.answers)
+    except (IOError, answers.InvalidAnswer) as e:
+        sys.exit('Bad answers: %s' % e)
+
     if ARGS.no_curses:
         deploy(None)
     else:
+        import curses
         curses.wrapper(deploy)
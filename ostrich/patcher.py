@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Apply unified diffs without running patch(1). Each hunk is reported as
+# applied, already applied or failed, and a patch is only written out if
+# every hunk in it either applies or is already there.
+#
+
+import os
+import re
+
+import utils
+
+
+APPLIED = 'applied'
+ALREADY_APPLIED = 'already applied'
+FAILED = 'failed'
+
+HUNK_RE = re.compile('^@@ -([0-9]+)(,([0-9]+))? \+([0-9]+)(,([0-9]+))? @@')
+TIMESTAMP_RE = re.compile('\s+[0-9]{4}-[0-9]{2}-[0-9]{2} '
+                          '[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?'
+                          '( [+-][0-9]{4})?$')
+
+
+class PatchError(Exception):
+    pass
+
+
+class Hunk(object):
+    def __init__(self, old_start, new_start):
+        self.old_start = old_start
+        self.new_start = new_start
+
+        # Lines include their line endings, so that a missing newline at the
+        # end of a file is part of what is matched
+        self.old = []
+        self.new = []
+
+    def __str__(self):
+        return '@@ -%d,%d +%d,%d @@' % (self.old_start, len(self.old),
+                                        self.new_start, len(self.new))
+
+
+class FilePatch(object):
+    def __init__(self, old_path, new_path):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+
+    def target(self, root='/', strip=1):
+        """The file this patch applies to, as patch -d root -p strip."""
+
+        parts = self.old_path.split('/')[strip:]
+        if not parts:
+            raise PatchError('Cannot strip %d components from %s'
+                             % (strip, self.old_path))
+        return os.path.join(root, *parts)
+
+
+def _path(line):
+    # Drop the timestamp diff puts after the path, which is usually
+    # separated by a tab but not always
+    path = line[4:].rstrip('\r\n').split('\t')[0]
+    return TIMESTAMP_RE.sub('', path).strip()
+
+
+def parse(text):
+    """Parse a unified diff into a list of FilePatch."""
+
+    patches = []
+    lines = text.splitlines(True)
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.startswith('--- ') or i + 1 >= len(lines) or \
+                not lines[i + 1].startswith('+++ '):
+            i += 1
+            continue
+
+        fp = FilePatch(_path(line), _path(lines[i + 1]))
+        if '/dev/null' in (fp.old_path, fp.new_path):
+            raise PatchError('Creating and deleting files is not supported, '
+                             'in the patch for %s' % fp.old_path)
+        patches.append(fp)
+        i += 2
+
+        while i < len(lines):
+            m = HUNK_RE.match(lines[i])
+            if not m:
+                break
+
+            hunk = Hunk(int(m.group(1)), int(m.group(4)))
+            old_len = int(m.group(3)) if m.group(3) is not None else 1
+            new_len = int(m.group(6)) if m.group(6) is not None else 1
+            fp.hunks.append(hunk)
+            i += 1
+
+            last = []
+            while ((len(hunk.old) < old_len or len(hunk.new) < new_len or
+                    (i < len(lines) and lines[i].startswith('\\')))
+                   and i < len(lines)):
+                line = lines[i]
+                i += 1
+
+                if line.startswith('\\'):
+                    # The previous line has no newline
+                    for side in last:
+                        side[-1] = side[-1].rstrip('\r\n')
+                    continue
+
+                op = line[:1]
+                body = line[1:]
+                if line in ('\n', '\r\n'):
+                    # Some editors strip the space from empty context lines
+                    op = ' '
+                    body = line
+
+                if op == ' ':
+                    last = [hunk.old, hunk.new]
+                elif op == '-':
+                    last = [hunk.old]
+                elif op == '+':
+                    last = [hunk.new]
+                else:
+                    raise PatchError('Malformed hunk %s in the patch for %s'
+                                     % (hunk, fp.old_path))
+                for side in last:
+                    side.append(body)
+
+            if len(hunk.old) != old_len or len(hunk.new) != new_len:
+                raise PatchError('Truncated hunk %s in the patch for %s'
+                                 % (hunk, fp.old_path))
+
+    return patches
+
+
+_CACHE = {}
+
+
+def load(path):
+    """Parse a patch file, only reading it again if it has changed."""
+
+    st = os.stat(path)
+    key = (st.st_mtime, st.st_size)
+    cached = _CACHE.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        patches = parse(f.read())
+    _CACHE[path] = (key, patches)
+    return patches
+
+
+def _matches(lines, at, want):
+    return at >= 0 and lines[at:at + len(want)] == want
+
+
+def _find(lines, expected, want):
+    """Find want in lines, starting at expected and working outwards."""
+
+    for offset in range(0, len(lines) + 1):
+        for at in (expected + offset, expected - offset):
+            if _matches(lines, at, want):
+                return at
+        if expected - offset < 0 and expected + offset > len(lines):
+            break
+    return None
+
+
+class HunkResult(object):
+    def __init__(self, hunk, state, offset=0):
+        self.hunk = hunk
+        self.state = state
+        self.offset = offset
+
+    def __str__(self):
+        s = '%s %s' % (self.hunk, self.state)
+        if self.offset:
+            s += ' (offset %d lines)' % self.offset
+        return s
+
+
+def apply_file(fp, content):
+    """Apply a file's hunks to its content.
+
+    Returns the new content and a HunkResult for each hunk. Hunks are first
+    looked for where they say they are, as the old text or the new text,
+    and then anywhere else in the file.
+    """
+
+    lines = content.splitlines(True)
+    results = []
+
+    # How many lines earlier hunks added, and how far from where they said
+    # they were the last hunk was found
+    delta = 0
+    drift = 0
+    for hunk in fp.hunks:
+        stated = max(hunk.old_start - 1, 0) + delta
+        if not hunk.old:
+            # A pure addition goes after the line it names
+            stated = hunk.old_start + delta
+        expected = stated + drift
+
+        # A hunk without context has no old text, which matches anywhere,
+        # so whether it is already applied has to be checked first
+        candidates = ((hunk.old, APPLIED), (hunk.new, ALREADY_APPLIED))
+        if not hunk.old:
+            candidates = tuple(reversed(candidates))
+
+        state = None
+        for want, found_state in candidates:
+            if _matches(lines, expected, want):
+                at = expected
+                state = found_state
+                break
+        else:
+            for want, found_state in ((hunk.old, APPLIED),
+                                      (hunk.new, ALREADY_APPLIED)):
+                at = _find(lines, expected, want)
+                if at is not None:
+                    state = found_state
+                    break
+
+        if state is None:
+            results.append(HunkResult(hunk, FAILED))
+            continue
+
+        drift = at - stated
+        results.append(HunkResult(hunk, state, drift))
+        if state == APPLIED:
+            lines[at:at + len(hunk.old)] = hunk.new
+
+        # Either way, the file now has the new text of the hunk
+        delta += len(hunk.new) - len(hunk.old)
+
+    return ''.join(lines), results
+
+
+def apply_patch(path, root='/', strip=1, dry_run=False):
+    """Apply a patch file, returning [(target, [HunkResult])].
+
+    Nothing is written unless every hunk of every file either applied or
+    was already applied, and each file is written at most once.
+    """
+
+    outcome = []
+    writes = []
+    for fp in load(path):
+        target = fp.target(root, strip)
+        if not os.path.exists(target):
+            outcome.append((target, [HunkResult(hunk, FAILED)
+                                     for hunk in fp.hunks]))
+            continue
+
+        with open(target, 'rb') as f:
+            content = f.read()
+        new_content, results = apply_file(fp, content)
+        outcome.append((target, results))
+        if new_content != content:
+            writes.append((target, new_content))
+
+    if not dry_run and not failed(outcome):
+        for target, new_content in writes:
+            utils.atomic_write(target, new_content)
+    return outcome
+
+
+def failed(outcome):
+    return [(target, result) for target, results in outcome
+            for result in results if result.state == FAILED]
+
+
+def already_applied(outcome):
+    return all([result.state == ALREADY_APPLIED
+                for _, results in outcome for result in results])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Run downloads which don't depend on any answers in the background, while
+# the questions are being answered. The steps which need them wait for them
+# to finish first, and then find their caches warm.
+#
+
+import os
+import subprocess
+import threading
+
+
+class Job(object):
+    def __init__(self, name, command, env=None, cwd=None):
+        self.name = name
+        self.command = command
+        self.env = env
+        self.cwd = cwd
+
+        self.exit_code = None
+        self.finished = threading.Event()
+
+
+class Prefetcher(object):
+    """Run prefetch jobs on threads of their own.
+
+    Each job's output goes to ~/.ostrich/prefetch-<name>.log. A job failing
+    isn't an error, the step which would have used it just does the work.
+    """
+
+    def __init__(self, logdir=None):
+        self.logdir = logdir or os.path.expanduser('~/.ostrich')
+        self.jobs = {}
+
+    def log_path(self, name):
+        return os.path.join(self.logdir, 'prefetch-%s.log' % name)
+
+    def start(self, job):
+        self.jobs[job.name] = job
+        t = threading.Thread(target=self._run, args=(job,))
+        t.daemon = True
+        t.start()
+
+    def _run(self, job):
+        env = dict(os.environ)
+        env.update(job.env or {})
+        try:
+            with open(self.log_path(job.name), 'w') as log:
+                job.exit_code = subprocess.call(
+                    job.command, shell=True, cwd=job.cwd, env=env,
+                    stdin=open(os.devnull), stdout=log, stderr=log,
+                    close_fds=True)
+        except (IOError, OSError):
+            job.exit_code = -1
+        finally:
+            job.finished.set()
+
+    def wait(self, name):
+        """Wait for a job, returning its exit code, or None if not started."""
+
+        job = self.jobs.get(name)
+        if not job:
+            return None
+
+        # Waiting with a timeout lets KeyboardInterrupt through
+        while not job.finished.wait(1):
+            pass
+        return job.exit_code
+
+
+PREFETCHER = Prefetcher()
@@ -11,18 +11,33 @@
 # limitations under the License.
 
 
-import curses
 import datetime
+import heapq
 import json
 import os
+import Queue
 import sys
+import threading
+
+import six
 
 import emitters
+import events
+import utils
+
+
+# The journal is folded into a new state snapshot after this many records
+JOURNAL_COMPACTION_RECORDS = 100
 
 
 class Runner(object):
-    def __init__(self, screen):
+    def __init__(self, screen, max_workers=1, step_cache=None,
+                 background_logs=False, timings=None):
         self.screen = screen
+        self.max_workers = max(1, max_workers)
+        self.step_cache = step_cache
+        self.background_logs = background_logs
+        self.timings = timings
 
         self.steps = {}
 
@@ -33,20 +48,77 @@ class Runner(object):
 
         self._on_error = None
 
-        if os.path.exists(self._get_state_path()):
-            with open(self._get_state_path(), 'r') as f:
+        self._journal = None
+        self._journal_records = 0
+
+        self.run_id = utils.run_id()
+        self.events = None
+
+        state_path = self._get_state_path()
+        if state_path and os.path.exists(state_path):
+            with open(state_path, 'r') as f:
                 state = json.loads(f.read())
                 self.complete = state.get('complete', {})
                 self.counter = state.get('counter', 0)
                 self.kwargs = state.get('kwargs', {})
                 self.tested = state.get('tested', {})
 
+        self._replay_journal()
+        self._journaled_kwargs = json.dumps(self.kwargs, sort_keys=True)
+        self._journaled_tested = json.dumps(self.tested, sort_keys=True)
+
     def _get_state_path(self):
         if not os.path.exists(os.path.expanduser('~/.ostrich')):
             os.mkdir(os.path.expanduser('~/.ostrich'))
 
         return os.path.expanduser('~/.ostrich/state.json')
 
+    def _get_journal_path(self):
+        state_path = self._get_state_path()
+        if not state_path:
+            return None
+        return os.path.splitext(state_path)[0] + '.journal'
+
+    def _get_events_path(self):
+        state_path = self._get_state_path()
+        if not state_path:
+            return None
+        return os.path.join(os.path.dirname(state_path), 'events',
+                            '%s.jsonl' % self.run_id)
+
+    def _get_event_log(self):
+        if not self.events:
+            events_path = self._get_events_path()
+            if events_path:
+                self.events = events.EventLog(events_path, self.run_id)
+        return self.events
+
+    def _replay_journal(self):
+        """Apply step records appended since the last state snapshot."""
+
+        journal_path = self._get_journal_path()
+        if not journal_path or not os.path.exists(journal_path):
+            return
+
+        with open(journal_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash part way through an append leaves a truncated
+                    # final record, which is ignored
+                    break
+
+                if record.get('outcome'):
+                    self.complete[record['step']] = record['outcome']
+                self.counter = record.get('counter', self.counter)
+                if 'kwargs' in record:
+                    self.kwargs = record['kwargs']
+                if 'tested' in record:
+                    self.tested = record['tested']
+
+        self._compact_state()
+
     def load_step(self, step):
         if step.name in self.complete:
             print('You cannot load a new step with the same name as an '
@@ -59,21 +131,233 @@ class Runner(object):
         self.steps[step.name] = step
 
     def load_dependancy_chain(self, steps, depends=None):
+        """Load a list of steps, each depending on the one before it.
+
+        An entry in the list may itself be a list of steps. The steps in
+        such a group all depend on the entry before the group, and are free
+        to run in parallel with each other. The entry after the group depends
+        on every step in the group. Steps which already declare their own
+        dependencies are left alone.
+        """
+
         depend = depends
-        for step in steps:
-            step.depends = depend
-            depend = step.name
-            self.load_step(step)
-
-    def _ordered_step_names(self):
-        if self._on_error:
-            self.steps[self._on_error.name] = self._on_error
-            yield self._on_error.name
-        for key in sorted(self.steps.keys()):
-            yield key
+        for group in utils.step_groups(steps):
+            for step in group:
+                if step.depends is None:
+                    step.depends = depend
+                self.load_step(step)
+
+            names = [step.name for step in group]
+            if len(names) == 1:
+                depend = names[0]
+            elif names:
+                depend = names
+
+    def _index_steps(self):
+        """Build the reverse dependency index and the initial ready queue.
+
+        Each pending step records how many of its dependencies are yet to
+        complete, and each dependency records the steps waiting on it. A
+        completed step then only needs to visit its own dependents, so
+        scheduling is linear in the number of steps plus dependencies.
+        """
+
+        self._dependents = {}
+        self._unmet = {}
+        self._ready = []
+
+        for step_name, step in self.steps.items():
+            unmet = 0
+            for depend in set(step.dependencies()):
+                if not self.complete.get(depend, False):
+                    unmet += 1
+                    self._dependents.setdefault(depend, []).append(step_name)
+
+            self._unmet[step_name] = unmet
+            if unmet == 0:
+                self._ready.append(step_name)
+
+        # Ready steps are run in name order, as they always have been
+        heapq.heapify(self._ready)
+
+    def _mark_complete(self, step_name):
+        for dependent in self._dependents.pop(step_name, []):
+            self._unmet[dependent] -= 1
+            if self._unmet[dependent] == 0:
+                heapq.heappush(self._ready, dependent)
+
+    def _resources_busy(self, step, running):
+        for step_name in running:
+            for resource in self.steps[step_name].resources:
+                if resource in step.resources:
+                    return True
+        return False
+
+    def _compact_state(self):
+        """Write a snapshot of the state, and empty the journal.
+
+        The snapshot is written to a temporary file and renamed into place,
+        so a crash leaves either the old or the new snapshot. Replaying a
+        journal over a snapshot which already includes it is harmless.
+        """
+
+        state_path = self._get_state_path()
+        if not state_path:
+            return
+
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({
+                        'complete': self.complete,
+                        'counter': self.counter,
+                        'kwargs': self.kwargs,
+                        'tested': self.tested,
+                        },
+                               indent=4, sort_keys=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, state_path)
+
+        journal_path = self._get_journal_path()
+        if os.path.exists(journal_path):
+            os.unlink(journal_path)
+
+        self._journal_records = 0
+        self._journaled_kwargs = json.dumps(self.kwargs, sort_keys=True)
+        self._journaled_tested = json.dumps(self.tested, sort_keys=True)
+
+    def _write_state(self, step_name, outcome):
+        """Append a record of a step run to the journal.
+
+        Each record is small and fsync'd, so the cost of persisting a step
+        does not grow with the number of steps already complete. kwargs and
+        tested are only included when they have changed.
+        """
+
+        journal_path = self._get_journal_path()
+        if not journal_path:
+            return
+
+        record = {
+            'step': step_name,
+            'outcome': outcome,
+            'counter': self.counter
+            }
+
+        kwargs = json.dumps(self.kwargs, sort_keys=True)
+        if kwargs != self._journaled_kwargs:
+            record['kwargs'] = self.kwargs
+            self._journaled_kwargs = kwargs
+
+        tested = json.dumps(self.tested, sort_keys=True)
+        if tested != self._journaled_tested:
+            record['tested'] = self.tested
+            self._journaled_tested = tested
+
+        if not self._journal:
+            self._journal = open(journal_path, 'a')
+        self._journal.write(json.dumps(record, sort_keys=True) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+        self._journal_records += 1
+        if self._journal_records >= JOURNAL_COMPACTION_RECORDS:
+            self._compact_state()
+
+    def _execute(self, step, emitter):
+        key = None
+        if self.step_cache:
+            key = self.step_cache.key(step)
+            outcome = self.step_cache.lookup(key)
+            if outcome:
+                emitter.emit('Inputs and outputs of %s are unchanged since '
+                             'it last ran, using the cached outcome'
+                             % step.name)
+                emitter.event('step-cached')
+                return outcome
+
+        outcome = step.run(emitter, self.screen)
+        if outcome and key:
+            self.step_cache.record(key, step, outcome)
+        return outcome
+
+    def _run_step(self, step_name, step, emitter, results):
+        try:
+            outcome = self._execute(step, emitter)
+            results.put((step_name, outcome, None))
+        except BaseException:
+            results.put((step_name, None, sys.exc_info()))
+
+    def _next_result(self, results):
+        # A blocking get() without a timeout cannot be interrupted by
+        # control-c under python 2
+        while True:
+            try:
+                return results.get(True, 1)
+            except Queue.Empty:
+                pass
+
+    def _osa_sha(self):
+        return self.tested.get(self.complete.get('osa-branch'))
+
+    def _record_timing(self, step, wall, outcome):
+        if not self.timings:
+            return
+
+        sha = self._osa_sha()
+        playbooks = step.playbook_timings()
+        play = step.name if playbooks else None
+        self.timings.record(self.run_id, sha, step.name, wall, outcome,
+                            play=play)
+        for playbook, seconds in playbooks:
+            self.timings.record(self.run_id, sha, step.name, seconds,
+                                outcome, play=play, playbook=playbook)
+
+    def _eta(self, estimates, started):
+        """Estimate the seconds left, if every step ran one at a time.
+
+        Only the steps loaded for this resolve_steps() call are counted,
+        which is one stage, as later stages' steps aren't known yet.
+        """
+
+        now = utils.monotonic()
+        remaining = 0
+        for step_name in self.steps:
+            estimate = estimates.get(step_name, 0)
+            if step_name in started:
+                estimate = max(0, estimate - (now - started[step_name]))
+            remaining += estimate
+        return remaining
+
+    def _update_progress(self, progress, estimates, started):
+        message = ('%s %d steps to run, running %s'
+                   % (datetime.datetime.now(), len(self.steps),
+                      ', '.join(sorted(started))))
+        if estimates:
+            eta = self._eta(estimates, started)
+            message += (', about %dm%02ds left in this stage'
+                        % (eta // 60, eta % 60))
+
+        with emitters.OUTPUT_LOCK:
+            progress.clear()
+            progress.addstr(1, 3, message)
+            progress.border()
+            progress.refresh()
+
+    def _get_emitter_class(self, use_curses):
+        if use_curses:
+            return emitters.Emitter
+        return emitters.SimpleEmitter
 
     def resolve_steps(self, use_curses=True):
         if use_curses:
+            # Only imported here, so that ostrich can run without curses
+            import curses
+
             # Setup curses windows for the steps view
             height, width = self.screen.getmaxyx()
             progress = curses.newwin(3, width, 0, 0)
@@ -84,68 +368,121 @@ class Runner(object):
             output.scrollok(True)
             output.border()
             output.refresh()
-            emitter = emitters.Emitter('ostrich', output)
         else:
             output = None
-            emitter = emitters.SimpleEmitter('ostrich', output)
+        emitter_class = self._get_emitter_class(use_curses)
 
         for step_name in self.complete:
             if step_name in self.steps:
                 del self.steps[step_name]
 
-        run = [True]
-        complete = []
+        # Steps are handed to worker threads as their dependencies are
+        # satisfied, with at most max_workers steps in flight at once. Each
+        # running step gets its own emitter, and therefore its own log file.
+        running = {}
+        started = {}
+        results = Queue.Queue()
+        event_log = self._get_event_log()
+
+        estimates = {}
+        if self.timings and use_curses:
+            estimates = self.timings.estimates(self._osa_sha())
 
-        while len(run) > 0:
-            run = []
-            complete = []
+        self._index_steps()
+
+        while True:
+            blocked = []
+            while len(running) < self.max_workers:
+                # Nothing else starts until a failing step's error handler
+                # has been run.
+                if self._on_error:
+                    if self._on_error.name in running:
+                        break
+                    step_name = self._on_error.name
+                    self.steps[step_name] = self._on_error
+                elif self._ready:
+                    step_name = heapq.heappop(self._ready)
+                else:
+                    break
 
-            for step_name in self._ordered_step_names():
                 step = self.steps[step_name]
+                if self._resources_busy(step, running):
+                    if step is self._on_error:
+                        break
+                    blocked.append(step_name)
+                    continue
 
-                runnable = False
-                if not step.depends:
-                    runnable = True
+                logfile = '%06d-%s' % (self.counter, step_name)
+                emitter = emitter_class('ostrich', output)
+                # The screen is shared, so only clear it when nothing else
+                # is writing to it
+                if not running:
+                    emitter.clear()
+                emitter.logger(logfile, background=self.background_logs,
+                               events=event_log, step=step_name)
+                self.counter += 1
+                running[step_name] = emitter
+                started[step_name] = utils.monotonic()
+                emitter.event('step-start', attempt=step.attempts + 1,
+                              log=logfile)
 
-                if self.complete.get(step.depends, False):
-                    runnable = True
+                if use_curses:
+                    self._update_progress(progress, estimates, started)
 
-                if runnable:
-                    if use_curses:
-                        progress.clear()
-                        progress.addstr(1, 3, '%s %d steps to run, running %s'
-                                        % (datetime.datetime.now(),
-                                           len(self.steps),
-                                           step_name))
-                        progress.border()
-                        progress.refresh()
+                if self.max_workers == 1:
+                    results.put(
+                        (step_name, self._execute(step, emitter), None))
+                else:
+                    t = threading.Thread(
+                        target=self._run_step,
+                        args=(step_name, step, emitter, results))
+                    t.daemon = True
+                    t.start()
 
-                    run.append(step_name)
-                    emitter.clear()
-                    emitter.logger('%06d-%s' % (self.counter, step_name))
-                    outcome = step.run(emitter, self.screen)
-                    self.counter += 1
-
-                    if self._get_state_path():
-                        with open(self._get_state_path(), 'w') as f:
-                            f.write(json.dumps({
-                                        'complete': self.complete,
-                                        'counter': self.counter,
-                                        'kwargs': self.kwargs,
-                                        'tested': self.tested,
-                                        },
-                                               indent=4, sort_keys=True))
-
-                    if outcome:
-                        self._on_error = None
-                        self.complete[step_name] = outcome
-                        complete.append(step_name)
-                    elif step.on_failure:
-                        self._on_error = step.on_failure
-                        break
+            for step_name in blocked:
+                heapq.heappush(self._ready, step_name)
 
-            for step_name in complete:
+            if not running:
+                break
+
+            step_name, outcome, exc_info = self._next_result(results)
+            step = self.steps[step_name]
+            emitter = running.pop(step_name)
+            elapsed = round(utils.monotonic() - started.pop(step_name), 3)
+            emitter.event('step-end', outcome=bool(outcome),
+                          error=repr(exc_info[1]) if exc_info else None,
+                          attempt=step.attempts, elapsed=elapsed)
+            emitter.close()
+            self._record_timing(step, elapsed, outcome)
+
+            if exc_info:
+                # Let everything else in flight finish before giving up
+                while running:
+                    finished, _, _ = self._next_result(results)
+                    running.pop(finished).close()
+                # With the worker's traceback, not this one
+                six.reraise(*exc_info)
+
+            if outcome:
+                if step is self._on_error:
+                    self._on_error = None
+                self.complete[step_name] = outcome
                 del self.steps[step_name]
+                self._mark_complete(step_name)
+            else:
+                # Failed steps are retried. An error handler is retried
+                # from self._on_error rather than the ready queue.
+                if step is not self._on_error:
+                    heapq.heappush(self._ready, step_name)
+                if step.on_failure:
+                    self._on_error = step.on_failure
+                emitter.event('step-retry', attempt=step.attempts,
+                              on_failure=(step.on_failure.name
+                                          if step.on_failure else None))
+
+            self._write_state(step_name, outcome)
+            if use_curses:
+                self._update_progress(progress, estimates, started)
 
         if len(self.steps) > 0:
             s = []
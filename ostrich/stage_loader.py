@@ -11,7 +11,30 @@
 # limitations under the License.
 
 
+import hashlib
+import importlib
+import json
 import os
+import pkgutil
+
+try:
+    import pkg_resources
+except ImportError:
+    pkg_resources = None
+
+import answers
+import utils
+
+
+# Packages can add stages by naming a module in this entry point group. The
+# entry point's name orders it among the built in stages, so a stage named
+# stage_45_site_config runs after stage_40_enable_proxies.
+ENTRY_POINT_GROUP = 'ostrich.stages'
+
+# kwargs which change which steps a stage returns. Other kwargs only change
+# how steps run, and are in the saved state anyway.
+MANIFEST_KWARGS = ['git_bundle', 'git_reference', 'parallel_plays',
+                   'prefetch']
 
 
 def discover_stages():
@@ -23,3 +46,104 @@ def discover_stages():
             stages.append(ent)
 
     return sorted(stages)
+
+
+def discover_stage_modules():
+    """Return (name, module name) for each stage, in order.
+
+    These are the built in stages and any from the ostrich.stages entry
+    point group. A stage from an entry point with the same name as a built
+    in stage is ignored.
+    """
+
+    stages = {}
+    if pkg_resources:
+        for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            stages[ep.name] = ep.module_name
+    for stage_pyname in discover_stages():
+        name = stage_pyname.replace('.py', '')
+        stages[name] = 'ostrich.stages.%s' % name
+
+    return sorted(stages.items())
+
+
+def discover_patches(r):
+    """Return the names of the patches the stages will apply, in order.
+
+    Stages which apply patches say which through get_patches(r), so that
+    they can be checked before any of them run.
+    """
+
+    patches = []
+    for _, module_name in discover_stage_modules():
+        module = importlib.import_module(module_name)
+        if hasattr(module, 'get_patches'):
+            patches.extend(module.get_patches(r))
+
+    return patches
+
+
+def _stage_source(module_name):
+    """The path to a stage's source, found without importing the stage."""
+
+    loader = pkgutil.find_loader(module_name)
+    if not loader:
+        return None
+    path = loader.get_filename()
+    if path.endswith('.pyc') and os.path.exists(path[:-1]):
+        path = path[:-1]
+    return path
+
+
+class StageManifest(object):
+    """Remember the steps each stage returned, and what it was given.
+
+    A stage whose source, answers and step changing kwargs are the same as
+    when it was last imported, and whose steps are all complete, can be
+    skipped without importing it or building its steps again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.expanduser(
+            '~/.ostrich/stage-manifest.json')
+        self.stages = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                try:
+                    self.stages = json.loads(f.read())
+                except ValueError:
+                    self.stages = {}
+
+    def inputs(self, module_name, r):
+        source = _stage_source(module_name)
+        return hashlib.sha256(json.dumps({
+                    'module': module_name,
+                    'source': source and utils.file_digest(source),
+                    'answers': dict([(name, r.complete.get(name))
+                                     for name in answers.SCHEMA]),
+                    'kwargs': dict([(name, r.kwargs.get(name))
+                                    for name in MANIFEST_KWARGS])
+                    }, sort_keys=True)).hexdigest()
+
+    def complete(self, name, module_name, r):
+        """Is every step the stage returned last time complete?"""
+
+        entry = self.stages.get(name)
+        if not entry or entry['inputs'] != self.inputs(module_name, r):
+            return False
+        for step_name in entry['steps']:
+            if step_name not in r.complete:
+                return False
+        return True
+
+    def record(self, name, module_name, r, steps):
+        self.stages[name] = {
+            'inputs': self.inputs(module_name, r),
+            'steps': [step.name for group in utils.step_groups(steps)
+                      for step in group]
+            }
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(self.stages, indent=4, sort_keys=True))
+        os.rename(tmp_path, self.path)
@@ -10,28 +10,126 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import ctypes
+import errno
+import fcntl
+import os
 import psutil
-import time
+import select
 
 from ostrich import steps
 
 
+# apt takes the frontend lock before the dpkg lock, on releases which have
+# it. Waiting for both to be free waits for any apt or dpkg run to end.
+DPKG_LOCKS = ['/var/lib/dpkg/lock-frontend', '/var/lib/dpkg/lock']
+
+# pidfd_open(2) has the same number on all of the architectures we run on
+NR_PIDFD_OPEN = 434
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _syscall = _libc.syscall
+except (OSError, AttributeError):
+    _syscall = None
+
+
+def pidfd_open(pid):
+    """Return a file descriptor which polls readable when pid exits.
+
+    Returns None where the kernel doesn't support pidfds.
+    """
+
+    if not _syscall:
+        return None
+    fd = _syscall(NR_PIDFD_OPEN, pid, 0)
+    if fd < 0:
+        return None
+    return fd
+
+
+def find_apt_daily():
+    """Return the apt.systemd.daily processes which are running now."""
+
+    found = []
+    for process in psutil.process_iter():
+        try:
+            cmdline = ' '.join(process.cmdline())
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        if cmdline.find('apt.systemd.daily') != -1:
+            found.append(process)
+    return found
+
+
+def wait_for_exit(processes):
+    """Block until all of processes have exited."""
+
+    fallback = []
+    poller = select.poll()
+    fds = []
+    for process in processes:
+        fd = pidfd_open(process.pid)
+        if fd is None:
+            fallback.append(process)
+        else:
+            poller.register(fd, select.POLLIN)
+            fds.append(fd)
+
+    try:
+        while fds:
+            for fd, _ in poller.poll():
+                poller.unregister(fd)
+                os.close(fd)
+                fds.remove(fd)
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+    if fallback:
+        psutil.wait_procs(fallback)
+
+
+def wait_for_lock(path):
+    """Block until nothing holds a dpkg lock, without keeping it.
+
+    Returns False if the lock can't be checked, for example because it
+    doesn't exist.
+    """
+
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.EACCES, errno.EPERM):
+            return False
+        raise
+
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+    return True
+
+
 class AptDailyStep(steps.Step):
-    """Wait for apt-daily to not be running."""
+    """Wait for apt-daily to not be running.
+
+    The apt-daily processes are found once, and then waited for without
+    polling. Anything else using dpkg is then waited for by its locks.
+    """
 
     def _run(self, emit, screen):
-        found_apt_daily = True
-        while found_apt_daily:
-            emit.emit('Waiting for daily apt run to end')
-
-            found_apt_daily = False
-            for process in psutil.process_iter():
-                cmdline = ' '.join(process.cmdline())
-                if cmdline.find('apt.systemd.daily') != -1:
-                    found_apt_daily = True
-
-            if found_apt_daily:
-                time.sleep(10)
+        processes = find_apt_daily()
+        if processes:
+            emit.emit('Waiting for daily apt run to end (pids %s)'
+                      % ', '.join([str(p.pid) for p in processes]))
+            wait_for_exit(processes)
+
+        for path in DPKG_LOCKS:
+            if os.path.exists(path):
+                emit.emit('Waiting for %s to be free' % path)
+                wait_for_lock(path)
 
         return True
 
@@ -0,0 +1,69 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from ostrich import prefetch
+from ostrich import steps
+from ostrich.stages import stage_20_apt
+from ostrich.stages import stage_30_clone_osa
+
+
+def _git_fetch(r):
+    """Return a command to update the reference repository, or None."""
+
+    fetch = ('git -C %(reference)s fetch --prune %(remote)s '
+             '\'+refs/heads/*:refs/heads/*\' \'+refs/tags/*:refs/tags/*\'')
+    reference = stage_30_clone_osa.REFERENCE_REPO
+
+    if 'git-mirror-openstack' in r.complete:
+        # Answered on an earlier run
+        remote = stage_30_clone_osa.osa_remote(r)
+        return ('mkdir -p %(parent)s && '
+                '(test -d %(reference)s || git init --bare %(reference)s) && '
+                + fetch) % {'parent': os.path.dirname(reference),
+                            'reference': reference,
+                            'remote': remote}
+
+    if os.path.exists(reference):
+        # The mirror used last time is recorded in the reference repository
+        return fetch % {'reference': reference,
+                        'remote': ('"$(git -C %s config ostrich.remote)"'
+                                   % reference)}
+
+    return None
+
+
+def get_steps(r):
+    """Start downloads which don't depend on the answers to questions."""
+
+    if not r.kwargs.get('prefetch'):
+        return []
+
+    jobs = []
+    if 'apt-useful' not in r.complete:
+        jobs.append(prefetch.Job(
+            'apt',
+            ('apt-get update && '
+             'apt-get dist-upgrade -y --download-only && '
+             'apt-get install -y --download-only %s'
+             % stage_20_apt.USEFUL_PACKAGES),
+            env={'DEBIAN_FRONTEND': 'noninteractive'}))
+
+    if r.kwargs.get('git_reference') and 'git-clone-osa' not in r.complete:
+        command = _git_fetch(r)
+        if command:
+            jobs.append(prefetch.Job('git', command))
+
+    if not jobs:
+        return []
+    return [steps.PrefetchStartStep('prefetch-start', jobs, **r.kwargs)]
@@ -23,7 +23,7 @@ def get_steps(r):
             'kwargs-trace-processes',
             r,
             {
-                'trace_processes': r.complete['trace-processes']
+                'trace_processes': r.complete['trace-processes'] == 'yes'
             },
             **r.kwargs
             )
@@ -13,11 +13,19 @@
 from ostrich import steps
 
 
+# Packages we install before anything else
+USEFUL_PACKAGES = 'screen ack-grep git expect lxc'
+
+
 def get_steps(r):
     """Prepare apt."""
 
     nextsteps = []
 
+    if r.kwargs.get('prefetch'):
+        nextsteps.append(
+            steps.PrefetchWaitStep('prefetch-wait-apt', 'apt', **r.kwargs))
+
     nextsteps.append(
         steps.SimpleCommandStep(
             'apt-update',
@@ -40,7 +48,7 @@ def get_steps(r):
     nextsteps.append(
         steps.SimpleCommandStep(
             'apt-useful',
-            'apt-get install -y screen ack-grep git expect lxc',
+            'apt-get install -y %s' % USEFUL_PACKAGES,
             **r.kwargs
             )
         ),
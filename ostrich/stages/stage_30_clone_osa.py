@@ -10,10 +10,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 from ostrich import steps
 from ostrich import utils
 
 
+# Our ansible callback plugins, ahead of where openstack-ansible keeps its own
+CALLBACK_PLUGINS = ':'.join([
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 'ansible_plugins/callback'),
+    '/etc/ansible/roles/plugins/callback'])
+
+
+# Kept between runs by --git-reference
+REFERENCE_REPO = os.path.expanduser('~/.ostrich/git/openstack-ansible.git')
+
+
+def osa_remote(r):
+    return ('%s/openstack/openstack-ansible'
+            % r.complete['git-mirror-openstack'])
+
+
 def _ansible_debug(r):
     if r.complete['ansible-debug'] == 'yes':
         return '1'
@@ -24,12 +42,27 @@ def get_steps(r):
     """Clone OSA."""
 
     nextsteps = []
+
+    if r.kwargs.get('prefetch'):
+        nextsteps.append(
+            steps.PrefetchWaitStep('prefetch-wait-git', 'git', **r.kwargs))
+
+    remote = osa_remote(r)
+    if r.kwargs.get('git_reference'):
+        # Only fetch what changed since the last run into a reference
+        # repository, and clone from that
+        command = ('./helpers/git-reference-clone %s %s /opt/openstack-ansible'
+                   % (remote, REFERENCE_REPO))
+        if r.kwargs.get('git_bundle'):
+            command += ' %s' % r.kwargs['git_bundle']
+    else:
+        command = 'git clone %s /opt/openstack-ansible' % remote
+
     nextsteps.append(
         steps.SimpleCommandStep(
             'git-clone-osa',
-            ('git clone %s/openstack/openstack-ansible '
-             '/opt/openstack-ansible'
-             % r.complete['git-mirror-openstack']),
+            command,
+            cache_outputs=['/opt/openstack-ansible/.git/config'],
             **r.kwargs
             )
         )
@@ -42,7 +75,10 @@ def get_steps(r):
                 'env': {
                     'ANSIBLE_ROLE_FETCH_MODE': 'git-clone',
                     'ANSIBLE_DEBUG': _ansible_debug(r),
-                    'ANSIBLE_KEEP_REMOTE_FILES': '1'
+                    'ANSIBLE_KEEP_REMOTE_FILES': '1',
+                    'ANSIBLE_CALLBACK_PLUGINS': CALLBACK_PLUGINS,
+                    'ANSIBLE_CALLBACK_WHITELIST': 'ostrich_timing',
+                    'ANSIBLE_CALLBACKS_ENABLED': 'ostrich_timing'
                 }
             },
             **r.kwargs
@@ -16,6 +16,14 @@ from ostrich import steps
 from ostrich import utils
 
 
+def get_patches(r):
+    """Return the patches applied by this stage."""
+
+    if utils.is_ironic(r) and r.complete['osa-branch'] == 'stable/mitaka':
+        return ['ironic-aio-mitaka']
+    return []
+
+
 def get_steps(r):
     """Do all the configuration we do before bootstrapping."""
 
@@ -26,7 +34,9 @@ def get_steps(r):
     p = urlparse.urlparse(r.complete['git-mirror-openstack'])
     mirror_host_openstack = p.netloc.split(':')[0]
 
-    nextsteps.append(
+    # The key scans are independent of each other, so run them as a group
+    keyscans = []
+    keyscans.append(
         steps.SimpleCommandStep(
             'git-mirror-host-keys',
             ('ssh-keyscan -H %s >> /etc/ssh/ssh_known_hosts'
@@ -35,18 +45,20 @@ def get_steps(r):
         )
 
     if mirror_host_github != mirror_host_openstack:
-        nextsteps.append(
+        keyscans.append(
             steps.SimpleCommandStep(
                 'git-mirror-host-keys-github',
                 ('ssh-keyscan -H %s >> /etc/ssh/ssh_known_hosts'
                  % mirror_host_github),
                 **r.kwargs)
             )
+    nextsteps.append(keyscans)
+
+    for patch in get_patches(r):
+        nextsteps.append(steps.PatchStep(patch, **r.kwargs))
 
     if utils.is_ironic(r):
-        if r.complete['osa-branch'] == 'stable/mitaka':
-            nextsteps.append(steps.PatchStep('ironic-aio-mitaka', **r.kwargs))
-        else:
+        if r.complete['osa-branch'] != 'stable/mitaka':
             nextsteps.append(
                 steps.YamlAddElementStep(
                     'enable-ironic-aio-scenario',
@@ -91,23 +103,34 @@ def get_steps(r):
                 **r.kwargs)
             )
 
+    # With a local cache, container images and the upper constraints are
+    # fetched through it, as http://<local cache>/<host>/<path>
+    cache = r.complete['local-cache']
+    if cache != 'none':
+        lxc_download = 'http://%s/' % cache
+        git_openstack = 'http://%s/git.openstack.org' % cache
+    else:
+        lxc_download = 'http://'
+        git_openstack = 'https://git.openstack.org'
+
     nextsteps.append(
         steps.RegexpEditorStep(
             'lxc-cachable-downloads',
             '/usr/share/lxc/templates/lxc-download',
             'wget_wrapper -T 30 -q https?://',
-            'wget_wrapper -T 30 -q --no-hsts http://',
+            'wget_wrapper -T 30 -q --no-hsts %s' % lxc_download,
             **r.kwargs)
         )
 
     nextsteps.append(
         steps.SimpleCommandStep(
             'archive-upper-constraints',
-            ('curl https://git.openstack.org/cgit/openstack/requirements/'
+            ('curl %s/cgit/openstack/requirements/'
              'plain/upper-constraints.txt?id='
              '$(awk \'/requirements_git_install_branch:/ {print $2}\' '
              '/opt/openstack-ansible/playbooks/defaults/repo_packages/'
-             'openstack_services.yml) -o ~/.ostrich/upper-contraints.txt'),
+             'openstack_services.yml) -o ~/.ostrich/upper-contraints.txt'
+             % git_openstack),
             **r.kwargs)
         )
 
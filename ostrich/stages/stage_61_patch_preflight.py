@@ -0,0 +1,32 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+from ostrich import stage_loader
+from ostrich import steps
+
+
+def get_steps(r):
+    """Check the patches we will apply, now that the roles are installed."""
+
+    kwargs = copy.copy(r.kwargs)
+    kwargs['max_attempts'] = 1
+    kwargs['failing_step_delay'] = 0
+
+    return [
+        steps.PatchPreflightStep(
+            'patch-preflight-roles',
+            stage_loader.discover_patches(r),
+            require_targets=True,
+            **kwargs)
+        ]
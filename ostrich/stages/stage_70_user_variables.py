@@ -14,6 +14,36 @@ from ostrich import steps
 from ostrich import utils
 
 
+def get_patches(r):
+    """Return the patches applied by this stage."""
+
+    patches = []
+
+    # Make updates non-interactive
+    if r.complete['osa-branch'] == 'stable/mitaka':
+        patches.append('lxc-hosts-ucf-non-interactive')
+        patches.append('cinder-constraints-mitaka')
+    elif r.complete['osa-branch'] == 'stable/newton':
+        patches.append('lxc-hosts-ucf-non-interactive-newton')
+    else:
+        patches.append('lxc-hosts-ucf-non-interactive-ocata')
+
+    # Patch ceph role to work
+    if r.complete['enable-ceph'] == 'yes':
+        if r.complete['osa-branch'] in ['stable/mitaka',
+                                        'stable/newton']:
+            # This isn't implemented for these releases
+            pass
+        else:
+            patches.append('ceph-global-pg_num')
+
+    # Turn on agent logging in ironic
+    if utils.is_ironic(r):
+        patches.append('ironic-agent-logs')
+
+    return patches
+
+
 def get_steps(r):
     """Configure user variables with all our special things."""
 
@@ -74,29 +104,6 @@ def get_steps(r):
             **r.kwargs)
         )
 
-    # Make updates non-interactive
-    if r.complete['osa-branch'] == 'stable/mitaka':
-        nextsteps.append(steps.PatchStep(
-            'lxc-hosts-ucf-non-interactive', **r.kwargs))
-        nextsteps.append(steps.PatchStep(
-            'cinder-constraints-mitaka', **r.kwargs))
-    elif r.complete['osa-branch'] == 'stable/newton':
-        nextsteps.append(steps.PatchStep(
-            'lxc-hosts-ucf-non-interactive-newton', **r.kwargs))
-    else:
-        nextsteps.append(steps.PatchStep(
-            'lxc-hosts-ucf-non-interactive-ocata', **r.kwargs))
-
-    # Patch ceph role to work
-    if r.complete['enable-ceph'] == 'yes':
-        if r.complete['osa-branch'] in ['stable/mitaka',
-                                        'stable/newton']:
-            # This isn't implemented for these releases
-            pass
-        else:
-            nextsteps.append(steps.PatchStep(
-                'ceph-global-pg_num', **r.kwargs))
-
     # Release specific steps: Mitaka
     if r.complete['osa-branch'] == 'stable/mitaka' and utils.is_ironic(r):
         nextsteps.append(
@@ -107,9 +114,10 @@ def get_steps(r):
                 **r.kwargs)
             )
 
-    # Turn on agent logging in ironic
-    if utils.is_ironic(r):
-        nextsteps.append(steps.PatchStep(
-                'ironic-agent-logs', **r.kwargs))
+    # Each of these patches touches a different file, so they are applied
+    # as a parallel group
+    patches = [steps.PatchStep(patch, **r.kwargs)
+               for patch in get_patches(r)]
+    nextsteps.append(patches)
 
     return nextsteps
@@ -14,6 +14,17 @@ from ostrich import steps
 from ostrich import utils
 
 
+def get_patches(r):
+    """Return the patches applied by this stage."""
+
+    if not utils.is_ironic(r):
+        return []
+
+    if r.complete['osa-branch'] in ['stable/mitaka', 'stable/newton']:
+        return ['ironic-vip-address']
+    return ['ironic-vip-address-ocata']
+
+
 def get_steps(r):
     """Configure all the special things for ironic networking."""
 
@@ -22,72 +33,36 @@ def get_steps(r):
     if not utils.is_ironic(r):
         return []
 
-    nextsteps.append(
-        steps.YamlAddElementStep(
-            'add-provider-network',
-            '/etc/openstack_deploy/openstack_user_config.yml',
-            ['global_overrides', 'provider_networks'],
-            {'network':
-                 {'group_binds': ['neutron_linuxbridge_agent',
-                                  'ironic_conductor_container',
-                                  'ironic_api_container'],
-                  'container_bridge': 'br-ironic',
-                  'container_type': 'veth',
-                  'container_interface': 'eth12',
-                  'type': 'flat',
-                  'net_name': 'ironic',
-                  'ip_from_q': 'ironic'
-                  }
-            },
-            **r.kwargs)
-        )
-
-    nextsteps.append(
-        steps.YamlDeleteElementStep(
-            'delete-provider-network',
-            '/etc/openstack_deploy/openstack_user_config.yml',
-            ['global_overrides', 'provider_networks'],
-            2,
-            **r.kwargs)
-        )
-
     net, hosts = utils.expand_ironic_netblock(r)
 
+    # All of the changes to openstack_user_config.yml are made at once
     nextsteps.append(
-        steps.YamlUpdateElementStep(
-            'configure-external-lb-ip',
-            '/etc/openstack_deploy/openstack_user_config.yml',
-            ['global_overrides'],
-            'external_lb_vip_address',
-            str(hosts[4]),
-            **r.kwargs)
-        )
-
-    nextsteps.append(
-        steps.YamlUpdateDictionaryStep(
-            'add-network-cidr',
+        steps.YamlTransactionStep(
+            'configure-ironic-networks',
             '/etc/openstack_deploy/openstack_user_config.yml',
-            ['cidr_networks'],
-            {'ironic': str(net)},
+            [
+                ('add', ['global_overrides', 'provider_networks'],
+                 {'network': {
+                     'group_binds': ['neutron_linuxbridge_agent',
+                                     'ironic_conductor_container',
+                                     'ironic_api_container'],
+                     'container_bridge': 'br-ironic',
+                     'container_type': 'veth',
+                     'container_interface': 'eth12',
+                     'type': 'flat',
+                     'net_name': 'ironic',
+                     'ip_from_q': 'ironic'
+                 }}),
+                ('delete', ['global_overrides', 'provider_networks'], 2),
+                ('update', ['global_overrides'], 'external_lb_vip_address',
+                 str(hosts[4])),
+                ('merge', ['cidr_networks'], {'ironic': str(net)}),
+                ('add', ['used_ips'], '%s,%s' % (hosts[0], hosts[10])),
+                ('add', ['used_ips'], '%s,%s' % (hosts[-10], hosts[-1])),
+            ],
             **r.kwargs)
         )
 
-    nextsteps.append(
-        steps.YamlAddElementStep(
-            'reserve-netblock-start',
-            '/etc/openstack_deploy/openstack_user_config.yml',
-            ['used_ips'],
-            '%s,%s' % (hosts[0], hosts[10]),
-            **r.kwargs)
-        )
-    nextsteps.append(
-        steps.YamlAddElementStep(
-            'reserve-netblock-end',
-            '/etc/openstack_deploy/openstack_user_config.yml',
-            ['used_ips'],
-            '%s,%s' % (hosts[-10], hosts[-1]),
-            **r.kwargs)
-        )
     nextsteps.append(
         steps.SimpleCommandStep(
             'add-ironic-bridge',
@@ -113,9 +88,7 @@ def get_steps(r):
             **r.kwargs)
         )
 
-    if r.complete['osa-branch'] in ['stable/mitaka', 'stable/newton']:
-        nextsteps.append(steps.PatchStep('ironic-vip-address', **r.kwargs))
-    else:
-        nextsteps.append(steps.PatchStep('ironic-vip-address-ocata', **r.kwargs))
+    for patch in get_patches(r):
+        nextsteps.append(steps.PatchStep(patch, **r.kwargs))
 
     return nextsteps
@@ -14,6 +14,20 @@ from ostrich import steps
 from ostrich import utils
 
 
+def get_patches(r):
+    """Return the patches applied by this stage."""
+
+    if not utils.is_ironic(r):
+        return []
+
+    patches = ['ironic-tftp-address']
+    if r.complete['osa-branch'] == 'stable/mitaka':
+        patches.append('ironic-pxe-options')
+    else:
+        patches.append('ironic-pxe-options-newton')
+    return patches
+
+
 def get_steps(r):
     """Final tweaks to configuration before we run the playbooks."""
 
@@ -58,13 +72,7 @@ def get_steps(r):
                 **r.kwargs)
             )
 
-    if utils.is_ironic(r):
-        nextsteps.append(steps.PatchStep('ironic-tftp-address', **r.kwargs))
-
-        if r.complete['osa-branch'] == 'stable/mitaka':
-            nextsteps.append(steps.PatchStep('ironic-pxe-options', **r.kwargs))
-        else:
-            nextsteps.append(steps.PatchStep('ironic-pxe-options-newton',
-                                             **r.kwargs))
+    for patch in get_patches(r):
+        nextsteps.append(steps.PatchStep(patch, **r.kwargs))
 
     return nextsteps
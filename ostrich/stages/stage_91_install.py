@@ -17,40 +17,115 @@ from ostrich import steps
 from ostrich import utils
 
 
-def get_steps(r):
-    """The actual steps."""
+# The plays in the order they run one at a time, along with the plays each
+# one needs to have completed when plays are run in parallel.
+PLAYS = [
+    ('openstack-hosts-setup', []),
+    ('security-hardening', ['openstack-hosts-setup']),
+    ('lxc-hosts-setup', ['security-hardening']),
+    ('lxc-containers-create', ['lxc-hosts-setup']),
+    ('setup-infrastructure', ['lxc-containers-create']),
+    ('os-keystone-install', ['setup-infrastructure']),
+    ('os-glance-install', ['os-keystone-install']),
+    ('os-cinder-install', ['os-glance-install']),
+    ('os-nova-install', ['os-cinder-install']),
+    ('os-neutron-install', ['os-nova-install']),
+    ('os-heat-install', ['os-keystone-install']),
+    ('os-horizon-install', ['os-keystone-install']),
+    ('os-ceilometer-install', ['os-keystone-install']),
+    ('os-aodh-install', ['os-keystone-install']),
+    ('os-swift-install', ['os-keystone-install']),
+]
+
+IRONIC_PLAY = ('os-ironic-install',
+               ['os-neutron-install', 'os-swift-install'])
+
+# Plays which configure services on the host itself, and not just inside
+# their own containers. These would fight over apt and service restarts, so
+# only one of them runs at a time.
+HOST_PLAYS = [
+    'os-cinder-install',
+    'os-nova-install',
+    'os-neutron-install',
+    'os-ceilometer-install',
+    'os-swift-install',
+    'os-ironic-install',
+]
+
+# openstack-ansible regenerates and rewrites its inventory on every run, so
+# plays run in parallel share one generated before any of them start.
+INVENTORY_DIR = os.path.expanduser('~/.ostrich/inventory')
 
-    nextsteps = []
-    playnames = [
-        'openstack-hosts-setup',
-        'security-hardening',
-        'lxc-hosts-setup',
-        'lxc-containers-create',
-        'setup-infrastructure',
-        'os-keystone-install',
-        'os-glance-install',
-        'os-cinder-install',
-        'os-nova-install',
-        'os-neutron-install',
-        'os-heat-install',
-        'os-horizon-install',
-        'os-ceilometer-install',
-        'os-aodh-install',
-        'os-swift-install',
-    ]
 
+def get_play_steps(r):
+    """Return a step for each play, chained or in parallel as configured.
+
+    In parallel, the plays are preceded by a step which generates the
+    inventory they all use.
+    """
+
+    parallel = r.kwargs.get('parallel_plays', False)
+
+    error_kwargs = copy.deepcopy(r.kwargs)
+    error_kwargs['max_attempts'] = 1
+    error_kwargs['cwd'] = None
+    on_failure = {
+        'lxc-containers-create': steps.SimpleCommandStep(
+            'lxc-containers-create-on-error',
+            './helpers/lxc-ifup',
+            **error_kwargs)
+        }
+
+    plays = list(PLAYS)
     if utils.is_ironic(r):
-        playnames.append('os-ironic-install')
+        plays.append(IRONIC_PLAY)
+
+    nextsteps = []
+    if parallel:
+        inventory_kwargs = copy.copy(r.kwargs)
+        inventory_kwargs['cwd'] = None
+        nextsteps.append(
+            steps.SimpleCommandStep(
+                'static-inventory',
+                './helpers/osa-static-inventory %s' % INVENTORY_DIR,
+                **inventory_kwargs)
+            )
+
+    for play, depends in plays:
+        kwargs = copy.copy(r.kwargs)
+        kwargs['on_failure'] = on_failure.get(play)
+
+        if parallel:
+            # Each play gets its own ansible log, as they are interleaved
+            kwargs['env'] = copy.copy(r.kwargs.get('env', {}))
+            kwargs['env']['ANSIBLE_LOG_PATH'] = os.path.expanduser(
+                '~/.ostrich/ansible-%s.log' % play)
+            kwargs['env']['ANSIBLE_INVENTORY'] = os.path.join(
+                INVENTORY_DIR, 'inventory')
+            kwargs['depends'] = depends or ['static-inventory']
+            if play in HOST_PLAYS:
+                kwargs['resources'] = ['host']
 
-    for play in playnames:
         nextsteps.append(
             steps.AnsibleTimingSimpleCommandStep(
                 play,
                 'openstack-ansible -vvv %s.yml' % play,
                 os.path.expanduser('~/.ostrich/timings-%s.json' % play),
-                **r.kwargs)
+                **kwargs)
         )
 
+    return nextsteps
+
+
+def get_steps(r):
+    """The actual steps."""
+
+    nextsteps = get_play_steps(r)
+
+    kwargs = copy.copy(r.kwargs)
+    if r.kwargs.get('parallel_plays', False):
+        kwargs['depends'] = [step.name for step in nextsteps]
+
     nextsteps.append(
         steps.KwargsStep(
             'kwargs-return-to-ostrich-dir',
@@ -58,7 +133,7 @@ def get_steps(r):
             {
                 'cwd': None
             },
-            **r.kwargs
+            **kwargs
             )
         )
 
@@ -33,23 +33,20 @@ def get_steps(r):
             )
 
     # Debug output that might be helpful, not scripts are running from
-    # ostrich directory
-    nextsteps.append(
+    # ostrich directory. These don't depend on each other, so run them as a
+    # parallel group.
+    nextsteps.append([
         steps.SimpleCommandStep('lxc-details',
                                 './helpers/lxc-details',
-                                **r.kwargs)
-        )
-    nextsteps.append(
+                                **r.kwargs),
         steps.SimpleCommandStep('pip-ruin-everything',
                                 ('pip install python-openstackclient '
                                  'python-ironicclient'),
-                                **r.kwargs)
-        )
-    nextsteps.append(
+                                **r.kwargs),
         steps.SimpleCommandStep('os-cmd-bootstrap',
                                 './helpers/os-cmd-bootstrap',
                                 **r.kwargs)
-        )
+        ])
 
     # Remove our HTTP proxy settings because the interfere with talking to
     # OpenStack
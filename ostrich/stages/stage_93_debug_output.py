@@ -22,7 +22,19 @@ def get_steps(r):
 
     nextsteps = []
 
+    # openstack-details used to copy this, keep it where people look for it
     nextsteps.append(
+        steps.ArchiveStep(
+            'archive-openstack-deploy',
+            '/etc/openstack_deploy',
+            'openstack_deploy',
+            checkout=os.path.expanduser('~/.ostrich/openstack_deploy'),
+            **r.kwargs)
+        )
+
+    # The details helpers only read state, so they can run in parallel
+    details = []
+    details.append(
         steps.SimpleCommandStep(
                'openstack-details',
                './helpers/openstack-details %s' % r.complete['osa-branch'],
@@ -30,14 +42,16 @@ def get_steps(r):
         )
 
     if utils.is_ironic(r):
-        nextsteps.append(
+        details.append(
             steps.SimpleCommandStep(
                    'openstack-details-ironic',
                    ('./helpers/openstack-details-ironic %s'
                     % r.complete['osa-branch']),
                    **r.kwargs)
             )
+    nextsteps.append(details)
 
+    if utils.is_ironic(r):
         net, hosts = utils.expand_ironic_netblock(r)
         nextsteps.append(
             steps.SimpleCommandStep(
@@ -0,0 +1,86 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import json
+import os
+
+import utils
+
+
+class StepCache(object):
+    """Remember step outcomes by a hash of the step's inputs.
+
+    A step whose inputs hash to a key we have seen before, and whose recorded
+    outputs are unchanged on disk, is considered complete without running.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.expanduser('~/.ostrich/cache')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def key(self, step):
+        inputs = step.cache_inputs()
+        if inputs is None or not step.cache_outputs():
+            return None
+
+        return hashlib.sha256(json.dumps({
+                    'class': step.__class__.__name__,
+                    'name': step.name,
+                    'inputs': inputs
+                    }, sort_keys=True)).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, '%s.json' % key)
+
+    def lookup(self, key):
+        """Return the cached outcome for a key, or None on a miss."""
+
+        if not key or not os.path.exists(self._entry_path(key)):
+            return None
+
+        with open(self._entry_path(key)) as f:
+            try:
+                entry = json.loads(f.read())
+            except ValueError:
+                return None
+
+        # Without outputs there is nothing to show the step's work is
+        # still there
+        if not entry.get('outputs'):
+            return None
+
+        for path, digest in entry['outputs'].items():
+            if utils.file_digest(path) != digest:
+                return None
+        return entry['outcome']
+
+    def record(self, key, step, outcome):
+        if not key:
+            return
+
+        outputs = {}
+        for path in step.cache_outputs():
+            outputs[path] = utils.file_digest(path)
+        if not outputs:
+            return
+
+        tmp_path = self._entry_path(key) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({
+                        'step': step.name,
+                        'outcome': outcome,
+                        'outputs': outputs
+                        }, indent=4, sort_keys=True))
+        os.rename(tmp_path, self._entry_path(key))
@@ -12,21 +12,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
+import difflib
 import fcntl
 import json
+import multiprocessing
+import multiprocessing.pool
 import os
 import psutil
+import Queue
 import re
 import select
 import shutil
+import sre_constants
+import sre_parse
+import stat
 import subprocess
 import sys
+import threading
 import time
-import yaml
 
-import emitters
+import answers
+import archive
+import patcher
+import prefetch
 import utils
+import yaml_editor
 
 
 def _handle_path_in_cwd(path, cwd):
@@ -37,6 +47,129 @@ def _handle_path_in_cwd(path, cwd):
     return os.path.join(cwd, path)
 
 
+# Chunks of output which may wait between the reader and the consumer
+OUTPUT_QUEUE_DEPTH = 100
+
+# How much of a backlog of output is drawn on the screen
+DISPLAY_TAIL_LINES = 50
+
+
+def _queue_get(q):
+    # A blocking get() without a timeout cannot be interrupted by control-c
+    # under python 2
+    while True:
+        try:
+            return q.get(True, 1)
+        except Queue.Empty:
+            pass
+
+
+def _queue_put(q, item):
+    # As for _queue_get, but waiting for room in the queue
+    while True:
+        try:
+            return q.put(item, True, 1)
+        except Queue.Full:
+            pass
+
+
+def _wait_for_exit(obj, fd):
+    obj.wait()
+    os.write(fd, '.')
+    os.close(fd)
+
+
+class ProcessTracer(threading.Thread):
+    """Report processes started and ended underneath a parent process.
+
+    Events are (state, pid, command line) tuples, where state is "started"
+    or "ended". The process tree is scanned on this thread no more than once
+    per interval, however much output the command produces. Each batch of
+    events is announced by a byte on wakeup_fd, so callers can wait on it
+    alongside other file descriptors.
+    """
+
+    def __init__(self, pid, interval):
+        super(ProcessTracer, self).__init__()
+        self.daemon = True
+        self.pid = pid
+        self.interval = interval
+
+        self.wakeup_fd, self._wakeup_w = os.pipe()
+        for fd in [self.wakeup_fd, self._wakeup_w]:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        self._events = Queue.Queue()
+        self._finished = threading.Event()
+
+    def run(self):
+        procs = {}
+        try:
+            parent = psutil.Process(self.pid)
+        except psutil.NoSuchProcess:
+            return
+
+        while True:
+            finishing = self._finished.is_set()
+
+            try:
+                children = parent.children(recursive=True)
+            except psutil.NoSuchProcess:
+                children = []
+
+            seen = set()
+            for child in children:
+                seen.add(child.pid)
+                if child.pid not in procs:
+                    try:
+                        procs[child.pid] = ' '.join(child.cmdline())
+                    except psutil.NoSuchProcess:
+                        continue
+                    self._events.put(('started', child.pid, procs[child.pid]))
+
+            for pid in list(procs):
+                if pid not in seen:
+                    self._events.put(('ended', pid, procs.pop(pid)))
+
+            if not self._events.empty():
+                try:
+                    os.write(self._wakeup_w, '.')
+                except OSError:
+                    # The pipe is full, so the reader is already awake
+                    pass
+
+            if finishing:
+                return
+            self._finished.wait(self.interval)
+
+    def events(self):
+        try:
+            os.read(self.wakeup_fd, 10000)
+        except OSError:
+            pass
+
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except Queue.Empty:
+                return events
+
+    def stop(self):
+        """Stop scanning, and return any events not yet collected.
+
+        One last scan is made first, to catch processes which just exited.
+        """
+
+        self._finished.set()
+        self.join()
+        events = self.events()
+        os.close(self._wakeup_w)
+        os.close(self.wakeup_fd)
+        return events
+
+
 class Step(object):
     def __init__(self, name, **kwargs):
         self.name = name
@@ -48,9 +181,40 @@ class Step(object):
         self.failing_step_delay = kwargs.get('failing_step_delay', 30)
         self.on_failure = kwargs.get('on_failure')
 
+        # Steps which share a resource never run at the same time
+        self.resources = kwargs.get('resources', [])
+
     def __str__(self):
         return 'step %s, depends on %s' % (self.name, self.depends)
 
+    def dependencies(self):
+        """Return the names of the steps this step waits for, as a list."""
+
+        if not self.depends:
+            return []
+        if isinstance(self.depends, (list, tuple)):
+            return list(self.depends)
+        return [self.depends]
+
+    def cache_inputs(self):
+        """Return everything the outcome of this step depends on.
+
+        Steps which return None are never cached, and always run. Nor are
+        steps without cache_outputs(), as a hit couldn't be checked.
+        """
+
+        return None
+
+    def cache_outputs(self):
+        """Return the paths this step changes, checked on a cache hit."""
+
+        return self.kwargs.get('cache_outputs', [])
+
+    def playbook_timings(self):
+        """Return (playbook, seconds) for playbooks run by the last attempt."""
+
+        return []
+
     def run(self, emit, screen):
         if self.attempts > 0:
             emit.emit('... not our first attempt, sleeping for %s seconds'
@@ -87,16 +251,140 @@ class SimpleCommandStep(Step):
         self.command = command
         self.cwd = kwargs.get('cwd')
         self.trace_processes = kwargs.get('trace_processes', False)
+        self.trace_interval = kwargs.get('trace_interval', 1)
 
-        self.env = os.environ
+        # Take a copy, so that steps running in parallel don't share (and
+        # change) the environment of the ostrich process
+        self.env = dict(os.environ)
         self.env.update(kwargs.get('env'))
 
         self.acceptable_exit_codes = kwargs.get(
             'acceptable_exit_codes', [0])
 
-    def _output_analysis(self, d):
+    def cache_inputs(self):
+        # Most commands change things we can't check, so only those which
+        # say what they change with cache_outputs are cached
+        if not self.kwargs.get('cache_outputs'):
+            return None
+
+        return {
+            'command': self.command,
+            'cwd': self.cwd,
+            'env': self.kwargs.get('env')
+            }
+
+    def _output_analysis(self, emit, d):
         pass
 
+    def _drain(self, obj, items):
+        """Read output from the child until it exits.
+
+        When the consumer is behind and the queue is full, we wait for it
+        rather than reading more, so the child waits on its pipe instead of
+        its output piling up in memory.
+        """
+
+        # A thread waits for the child to exit and then writes to a pipe, so
+        # that the exit shows up in the same select() as the output.
+        exit_r, exit_w = os.pipe()
+        waiter = threading.Thread(target=_wait_for_exit,
+                                  args=(obj, exit_w))
+        waiter.daemon = True
+        waiter.start()
+
+        tracer = None
+        events = [exit_r]
+        if self.trace_processes:
+            tracer = ProcessTracer(obj.pid, self.trace_interval)
+            tracer.start()
+            events.append(tracer.wakeup_fd)
+
+        outputs = [obj.stdout.fileno(), obj.stderr.fileno()]
+        exited = False
+        while outputs:
+            # Block until something happens. Once the child has exited we
+            # only drain what is already buffered, as a daemonized grandchild
+            # can hold our pipes open forever.
+            timeout = 0 if exited else None
+            readable, _, _ = select.select(outputs + events, [], [], timeout)
+            if not readable:
+                break
+
+            for fd in readable:
+                if fd == exit_r:
+                    exited = True
+                    events.remove(exit_r)
+
+                elif tracer and fd == tracer.wakeup_fd:
+                    for event in tracer.events():
+                        _queue_put(items, ('event', event))
+
+                else:
+                    d = os.read(fd, 10000)
+                    if not d:
+                        outputs.remove(fd)
+                        continue
+                    _queue_put(items, ('output', d))
+
+        if tracer:
+            for event in tracer.stop():
+                _queue_put(items, ('event', event))
+
+        waiter.join()
+        os.close(exit_r)
+        obj.stdout.close()
+        obj.stderr.close()
+
+        _queue_put(items, ('done', None))
+
+    def _consume(self, emit, items):
+        """Log and display output handed over by _drain.
+
+        Every line is logged. When the reader is ahead of us, everything
+        waiting in the queue is taken at once and only the tail of it is
+        drawn on the screen.
+        """
+
+        while True:
+            batch = [_queue_get(items)]
+            while True:
+                try:
+                    batch.append(items.get_nowait())
+                except Queue.Empty:
+                    break
+
+            output = []
+            for kind, d in batch:
+                if kind == 'done':
+                    if output:
+                        self._display_tail(emit, output)
+                    return
+
+                if kind == 'event':
+                    state, pid, cmdline = d
+                    emit.event('process-%s' % state, pid=pid, cmdline=cmdline)
+                    d = '*** process %s *** %d -> %s' % d
+                    emit.log(d)
+                    output.append(d)
+                elif d:
+                    self._output_analysis(emit, d)
+                    emit.log(d)
+                    output.append(d)
+
+            if output:
+                self._display_tail(emit, output)
+
+    def _display_tail(self, emit, output):
+        # A batch may be a backlog of many chunks
+        lines = '\n'.join(output).split('\n')
+        if len(lines) <= DISPLAY_TAIL_LINES:
+            emit.display('\n'.join(output))
+            return
+
+        emit.display('... %d lines of output not shown here, but they are '
+                     'in the log' % (len(lines) - DISPLAY_TAIL_LINES))
+        emit.display('\n'.join(lines[-DISPLAY_TAIL_LINES:]))
+
     def _run(self, emit, screen):
         emit.emit('# %s\n' % self.command)
 
@@ -107,8 +395,6 @@ class SimpleCommandStep(Step):
                                shell=True,
                                cwd=self.cwd,
                                env=self.env)
-        proc = psutil.Process(obj.pid)
-        procs = {}
 
         flags = fcntl.fcntl(obj.stdout, fcntl.F_GETFL)
         fcntl.fcntl(obj.stdout, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -117,110 +403,381 @@ class SimpleCommandStep(Step):
         fcntl.fcntl(obj.stderr, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
         obj.stdin.close()
-        while obj.poll() is None:
-            readable, _, _ = select.select([obj.stderr, obj.stdout], [], [], 1)
-            for f in readable:
-                d = os.read(f.fileno(), 10000)
-                self._output_analysis(d)
-                emit.emit(d)
-
-            seen = []
-            for child in proc.children(recursive=True):
-                try:
-                    seen.append(child.pid)
-                    if child.pid not in procs:
-                        procs[child.pid] = ' '.join(child.cmdline())
-                        if self.trace_processes:
-                            emit.emit('*** process started *** %d -> %s'
-                                      % (child.pid, procs[child.pid]))
-                except psutil.NoSuchProcess:
-                    pass
 
-            ended = []
-            for pid in procs:
-                if pid not in seen:
-                    if self.trace_processes:
-                        emit.emit('*** process ended *** %d -> %s'
-                              % (pid, procs.get(child.pid, '???')))
-                    ended.append(pid)
+        # Output is drained from the pipes on a thread of its own, and handed
+        # over through a bounded queue. Logging and drawing the screen happen
+        # here, and can't stall the child by letting its pipes fill up.
+        items = Queue.Queue(OUTPUT_QUEUE_DEPTH)
+        reader = threading.Thread(target=self._drain, args=(obj, items))
+        reader.daemon = True
+        reader.start()
 
-            for pid in ended:
-                del procs[pid]
+        self._consume(emit, items)
+        reader.join()
 
         emit.emit('... process complete')
         returncode = obj.returncode
         emit.emit('... exit code %d' % returncode)
+        emit.event('exit', code=returncode,
+                   acceptable=returncode in self.acceptable_exit_codes)
         return returncode in self.acceptable_exit_codes
 
 
 EXECUTION_RE = re.compile('^\[Executing "(.*)" playbook\]$')
 RUN_TIME_RE = re.compile('^Run Time = ([0-9]+) seconds$')
+PLAY_RE = re.compile('^PLAY \[(.*)\] \**$')
+TASK_RE = re.compile('^TASK \[(.*)\] \**$')
+
+# How many of the slowest tasks in a play are listed once it has run
+SLOWEST_TASKS = 10
+
+
+def task_timings(records):
+    """Turn records from the ostrich_timing callback into task timings.
+
+    There is one timing per task per host, in the order they finished.
+    """
+
+    starts = {}
+    timings = []
+    for record in records:
+        if record['event'] == 'task-start':
+            starts[record['uuid']] = record
+        elif record['event'] == 'host-start':
+            starts[(record['uuid'], record['host'])] = record
+        elif record['event'] == 'host-end':
+            task = starts.get(record['uuid'], {})
+            start = starts.get((record['uuid'], record['host']), task)
+            if 'time' not in start:
+                continue
+
+            timings.append({
+                'playbook': task.get('playbook'),
+                'play': task.get('play'),
+                'task': record['task'],
+                'host': record['host'],
+                'status': record['status'],
+                'start': start['time'],
+                'end': record['time'],
+                'duration': round(record['time'] - start['time'], 3)
+                })
+    return timings
 
 
 class AnsibleTimingSimpleCommandStep(SimpleCommandStep):
+    """Run openstack-ansible, and keep timings for plays and tasks.
+
+    Play timings are parsed from the output and kept in timings_path. Task
+    timings come from the ostrich_timing callback plugin, and are kept next
+    to them in task-<name of timings_path>.
+    """
+
     def __init__(self, name, command, timings_path, **kwargs):
         super(AnsibleTimingSimpleCommandStep, self).__init__(
             name, command, **kwargs)
         self.playbook = None
+        self._partial = ''
 
         self.timings = []
         self.timings_path = timings_path
         if os.path.exists(self.timings_path):
             with open(self.timings_path, 'r') as f:
                 self.timings = json.loads(f.read())
-
-    def _output_analysis(self, d):
-        for line in d.split('\n'):
-            m = EXECUTION_RE.match(line)
-            if m:
-                self.playbook = m.group(1)
-
-            m = RUN_TIME_RE.match(line)
-            if m and self.playbook:
-                self.timings.append((self.playbook, m.group(1)))
+        self._attempt_start = len(self.timings)
+
+        self.task_timings_path = os.path.join(
+            os.path.dirname(timings_path),
+            'task-%s' % os.path.basename(timings_path))
+        self.callback_path = '%s.jsonl' % os.path.splitext(
+            self.task_timings_path)[0]
+        self.env['OSTRICH_TIMING_PATH'] = self.callback_path
+
+    def cache_inputs(self):
+        # A play changes the state of containers, which we can't check
+        return None
+
+    def _output_analysis(self, emit, d):
+        # Reads don't end on line boundaries, so hold on to a partial last
+        # line until the rest of it arrives
+        lines = (self._partial + d).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line_analysis(emit, line)
+
+    def _line_analysis(self, emit, line):
+        m = EXECUTION_RE.match(line)
+        if m:
+            self.playbook = m.group(1)
+            emit.event('ansible-playbook', playbook=self.playbook)
+
+        m = RUN_TIME_RE.match(line)
+        if m and self.playbook:
+            self.timings.append((self.playbook, m.group(1)))
+
+        m = PLAY_RE.match(line)
+        if m:
+            emit.event('ansible-play', playbook=self.playbook,
+                       play=m.group(1))
+
+        m = TASK_RE.match(line)
+        if m:
+            emit.event('ansible-task', playbook=self.playbook,
+                       task=m.group(1))
+
+    def _record_task_timings(self, emit):
+        if not os.path.exists(self.callback_path):
+            return
+
+        records = []
+        with open(self.callback_path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # ansible was killed part way through a record
+                    break
+
+        timings = task_timings(records)
+        previous = []
+        if os.path.exists(self.task_timings_path):
+            with open(self.task_timings_path) as f:
+                previous = json.loads(f.read())
+        with open(self.task_timings_path, 'w') as f:
+            f.write(json.dumps(previous + timings, indent=4))
+
+        emit.emit('... slowest tasks:')
+        for t in sorted(timings, key=lambda t: t['duration'],
+                        reverse=True)[:SLOWEST_TASKS]:
+            emit.emit('    %8.1fs %s on %s' % (t['duration'], t['task'],
+                                               t['host']))
+
+    def playbook_timings(self):
+        return [(playbook, int(seconds)) for playbook, seconds
+                in self.timings[self._attempt_start:]]
 
     def _run(self, emit, screen):
+        self._partial = ''
+        self._attempt_start = len(self.timings)
+        if os.path.exists(self.callback_path):
+            os.unlink(self.callback_path)
+
         res = super(AnsibleTimingSimpleCommandStep, self)._run(emit, screen)
+        if self._partial:
+            self._line_analysis(emit, self._partial)
+            self._partial = ''
 
         with open(self.timings_path, 'w') as f:
             f.write(json.dumps(self.timings, indent=4))
+        self._record_task_timings(emit)
 
         return res
 
 
-class PatchStep(SimpleCommandStep):
+PATCH_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'patches')
+
+
+def _patch_path(name):
+    return os.path.join(PATCH_DIR, name)
+
+
+def _dry_run_patch(name):
+    try:
+        return name, patcher.apply_patch(_patch_path(name), dry_run=True), None
+    except (IOError, OSError, patcher.PatchError) as e:
+        return name, None, e
+
+
+class PatchStep(Step):
+    """Apply one of the patches in patches/, as patch -d / -p 1 would.
+
+    Hunks which are already applied are reported as such rather than
+    failing, and nothing is changed unless every hunk either applies or is
+    already applied.
+    """
+
     def __init__(self, name, **kwargs):
-        self.local_kwargs = copy.copy(kwargs)
-        self.local_kwargs['cwd'] = __file__.replace('/ostrich/steps.py', '')
-        self.local_kwargs['acceptable_exit_codes'] = [0, 1]
+        super(PatchStep, self).__init__(name, **kwargs)
+        self.patch_path = _patch_path(name)
+        self.run_id = kwargs.get('run_id') or utils.run_id()
 
-        self.archive_path = os.path.expanduser('~/.ostrich')
+        self.files = [fp.target() for fp in patcher.load(self.patch_path)]
 
-        self.files = []
-        with open(os.path.join(self.local_kwargs['cwd'],
-                               'patches/%s' % name)) as f:
-            for line in f.readlines():
-                if line.startswith('--- '):
-                     self.files.append(line.split()[1])
+    def cache_inputs(self):
+        return {
+            'patch': utils.file_digest(self.patch_path)
+            }
 
-        super(PatchStep, self).__init__(
-            name,
-            'patch -d / -p 1 --verbose < patches/%s' % name,
-            **self.local_kwargs)
+    def cache_outputs(self):
+        return self.files
 
     def _archive_files(self, stage):
+        manifest = archive.Manifest(self.run_id)
         for f in self.files:
-            arc_path = os.path.join(self.archive_path,
-                                    '%s-%s-%s'
-                                    % (self.name, f.replace('/', '_'), stage))
-            if not os.path.exists(arc_path):
-                shutil.copyfile(f, arc_path)
+            if os.path.exists(f):
+                manifest.archive('patches/%s/%s%s' % (self.name, stage, f), f)
+
+    def dry_run(self):
+        """Return [(path, [HunkResult])] without changing anything."""
+
+        return patcher.apply_patch(self.patch_path, dry_run=True)
 
     def _run(self, emit, screen):
         self._archive_files('before')
-        res = super(PatchStep, self)._run(emit, screen)
+        outcome = patcher.apply_patch(self.patch_path)
+        for path, results in outcome:
+            emit.emit('%s:' % path)
+            for result in results:
+                emit.emit('    %s' % result)
+                emit.event('patch-hunk', patch=self.name, path=path,
+                           hunk=str(result.hunk), state=result.state,
+                           offset=result.offset)
+
+        failed = patcher.failed(outcome)
+        if failed:
+            emit.emit('... %d hunks failed, nothing was changed'
+                      % len(failed))
+            return False
+
         self._archive_files('after')
-        return res
+        if patcher.already_applied(outcome):
+            return 'Already applied'
+        return True
+
+
+class PatchPreflightStep(Step):
+    """Check that patches will apply, before any of them are applied.
+
+    Every patch is tried as a dry run, in parallel, and all of the patches
+    which won't apply are reported together. Patches to files which don't
+    exist yet are reported as deferred, unless require_targets is set.
+    """
+
+    def __init__(self, name, patches, require_targets=False, **kwargs):
+        super(PatchPreflightStep, self).__init__(name, **kwargs)
+        self.patches = patches
+        self.require_targets = require_targets
+
+    def _run(self, emit, screen):
+        if not self.patches:
+            return 'No patches to check'
+
+        pool = multiprocessing.pool.ThreadPool(len(self.patches))
+        try:
+            results = pool.map(_dry_run_patch, self.patches)
+        finally:
+            pool.close()
+            pool.join()
+
+        failures = []
+        for name, outcome, error in results:
+            if error:
+                emit.emit('%s: %s' % (name, error))
+                failures.append(name)
+                continue
+
+            missing = [path for path, _ in outcome
+                       if not os.path.exists(path)]
+            failed = [(path, result)
+                      for path, result in patcher.failed(outcome)
+                      if path not in missing]
+            if missing and not self.require_targets:
+                emit.emit('%s: deferred, %s does not exist yet'
+                          % (name, ', '.join(missing)))
+            elif missing:
+                emit.emit('%s: %s does not exist'
+                          % (name, ', '.join(missing)))
+
+            for path, result in failed:
+                emit.emit('%s: %s %s' % (name, path, result))
+
+            if failed or (missing and self.require_targets):
+                failures.append(name)
+            elif not missing:
+                emit.emit('%s: %s' % (name,
+                                      'already applied'
+                                      if patcher.already_applied(outcome)
+                                      else 'applies'))
+
+        if failures:
+            emit.emit('%d of %d patches will not apply: %s'
+                      % (len(failures), len(self.patches),
+                         ', '.join(failures)))
+            return False
+        return True
+
+
+class ArchiveStep(Step):
+    """Archive a file or a tree into this run's manifest.
+
+    With checkout set, the archived files are also copied there, for
+    people looking for them.
+    """
+
+    def __init__(self, name, path, archive_name, checkout=None, **kwargs):
+        super(ArchiveStep, self).__init__(name, **kwargs)
+        self.path = _handle_path_in_cwd(path, kwargs.get('cwd'))
+        self.archive_name = archive_name
+        self.checkout = checkout
+        self.run_id = kwargs.get('run_id') or utils.run_id()
+
+    def _run(self, emit, screen):
+        if not os.path.exists(self.path):
+            emit.emit('%s does not exist' % self.path)
+            return False
+
+        manifest = archive.Manifest(self.run_id)
+        if os.path.isdir(self.path):
+            count = len(manifest.archive_tree(self.archive_name, self.path))
+            if self.checkout:
+                manifest.checkout(self.archive_name, self.checkout)
+        else:
+            digest = manifest.archive(self.archive_name, self.path)
+            count = 1
+            if self.checkout:
+                manifest.store.copy(digest, self.checkout,
+                                    stat.S_IMODE(os.stat(self.path).st_mode))
+
+        emit.emit('Archived %d files from %s in %s'
+                  % (count, self.path, manifest.path))
+        return True
+
+
+class PrefetchStartStep(Step):
+    """Start prefetch jobs, and carry on without waiting for them."""
+
+    def __init__(self, name, jobs, **kwargs):
+        super(PrefetchStartStep, self).__init__(name, **kwargs)
+        self.jobs = jobs
+
+    def _run(self, emit, screen):
+        for job in self.jobs:
+            emit.emit('Prefetching %s in the background, logging to %s'
+                      % (job.name, prefetch.PREFETCHER.log_path(job.name)))
+            prefetch.PREFETCHER.start(job)
+        return True
+
+
+class PrefetchWaitStep(Step):
+    """Wait for a prefetch job to finish, if it was started."""
+
+    def __init__(self, name, job, **kwargs):
+        super(PrefetchWaitStep, self).__init__(name, **kwargs)
+        self.job = job
+
+    def _run(self, emit, screen):
+        exit_code = prefetch.PREFETCHER.wait(self.job)
+        if exit_code is None:
+            emit.emit('Nothing was prefetched for %s' % self.job)
+        elif exit_code != 0:
+            emit.emit('Prefetching %s failed with exit code %d, see %s'
+                      % (self.job, exit_code,
+                         prefetch.PREFETCHER.log_path(self.job)))
+        else:
+            emit.emit('Prefetched %s' % self.job)
+
+        # The steps after us do the work if we didn't
+        return True
 
 
 class QuestionStep(Step):
@@ -233,8 +790,27 @@ class QuestionStep(Step):
     def _run(self, emit, screen):
         emit.emit('%s' % self.title)
         emit.emit('%s\n' % ('=' * len(self.title)))
+
+        answer = answers.get(self.name)
+        if answer is not None:
+            emit.emit('Answered ahead of time: %s' % answer)
+            return answer
+
+        if not sys.stdin.isatty():
+            emit.emit('%s was not answered ahead of time, and there is no '
+                      'terminal to ask on' % self.name)
+            sys.exit(1)
+
         emit.emit('%s\n' % self.help)
-        return emit.getstr('>> ')
+        while True:
+            answer = emit.getstr('>> ')
+            if self.name not in answers.SCHEMA:
+                return answer
+            try:
+                answers.validate(self.name, answer)
+                return answer
+            except answers.InvalidAnswer as e:
+                emit.emit('%s, please try again' % e)
 
 
 class RegexpEditorStep(Step):
@@ -244,6 +820,16 @@ class RegexpEditorStep(Step):
         self.search = search
         self.replace = replace
 
+    def cache_inputs(self):
+        return {
+            'path': self.path,
+            'search': self.search,
+            'replace': self.replace
+            }
+
+    def cache_outputs(self):
+        return [self.path]
+
     def _run(self, emit, screen):
         output = []
         changes = 0
@@ -270,32 +856,166 @@ class RegexpEditorStep(Step):
         return 'Changed %d lines' % changes
 
 
+def required_literal(pattern):
+    """Return a string which any match of pattern must contain, or None.
+
+    This is the longest run of plain characters at the top level of the
+    pattern, so it is only worth having for patterns with some.
+    """
+
+    parsed = sre_parse.parse(pattern)
+    if parsed.pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return None
+
+    best = ''
+    run = ''
+    for op, arg in parsed:
+        if op == sre_constants.LITERAL:
+            run += chr(arg)
+            if len(run) > len(best):
+                best = run
+        else:
+            run = ''
+    return best or None
+
+
+# Replacements compiled in this process, by the replacements they came from
+_COMPILED_REPLACEMENTS = {}
+
+
+def _compile_replacements(replacements):
+    key = tuple(replacements)
+    if key not in _COMPILED_REPLACEMENTS:
+        _COMPILED_REPLACEMENTS[key] = [
+            (re.compile(search), replace, required_literal(search))
+            for search, replace in replacements]
+    return _COMPILED_REPLACEMENTS[key]
+
+
+def _edit_file(path, patterns):
+    """Apply compiled replacements to a file, returning lines changed."""
+
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    patterns = [p for p in patterns if not p[2] or p[2] in content]
+    if not patterns:
+        return 0
+
+    output = []
+    changes = 0
+    for line in content.splitlines(True):
+        # Edits never touch the line ending
+        body = line.rstrip('\r\n')
+        ending = line[len(body):]
+
+        newbody = body
+        for search, replace, literal in patterns:
+            if not literal or literal in newbody:
+                newbody = search.sub(replace, newbody)
+
+        if newbody != body:
+            changes += 1
+        output.append(newbody + ending)
+
+    if changes:
+        utils.atomic_write(path, ''.join(output))
+    return changes
+
+
+def _edit_files(work):
+    """Edit a chunk of files, returning (path, lines changed, error) each.
+
+    This is run in pool worker processes, so takes everything it needs as
+    one picklable argument.
+    """
+
+    paths, replacements = work
+    patterns = _compile_replacements(replacements)
+
+    results = []
+    for path in paths:
+        try:
+            results.append((path, _edit_file(path, patterns), None))
+        except (IOError, OSError) as e:
+            results.append((path, 0, str(e)))
+    return results
+
+
+# Files handed to a pool worker at a time
+BULK_EDIT_CHUNK = 64
+
+
 class BulkRegexpEditorStep(Step):
+    """Apply a list of regexp replacements to every line of many files.
+
+    Each file is read once, and only written if it changed, by atomically
+    replacing it. Files which don't contain the literal text a replacement
+    requires are skipped without running any regexps over them.
+
+    With bulk_edit_processes above one, chunks of files are edited by a pool
+    of processes while the tree is still being walked.
+    """
+
     def __init__(self, name, path, file_filter, replacements, **kwargs):
         super(BulkRegexpEditorStep, self).__init__(name, **kwargs)
         self.path = _handle_path_in_cwd(path, kwargs.get('cwd'))
         self.file_filter = re.compile(file_filter)
         self.replacements = replacements
+        self.processes = kwargs.get('bulk_edit_processes') or 1
 
-    def _run(self, emit, screen):
-        silent_emitter = emitters.NoopEmitter('noop', None)
-        changes = 0
-
+    def _paths(self):
         for root, _, files in os.walk(self.path):
             for filename in files:
-                m = self.file_filter.match(filename)
-                if not m:
-                    continue
+                if self.file_filter.match(filename):
+                    yield os.path.join(root, filename)
+
+    def _work(self):
+        chunk = []
+        for path in self._paths():
+            chunk.append(path)
+            if len(chunk) == BULK_EDIT_CHUNK:
+                yield (chunk, self.replacements)
+                chunk = []
+        if chunk:
+            yield (chunk, self.replacements)
+
+    def _results(self):
+        if self.processes == 1:
+            for work in self._work():
+                yield _edit_files(work)
+            return
+
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            for results in pool.imap_unordered(_edit_files, self._work()):
+                yield results
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
 
-                path = os.path.join(root, filename)
-                for (search, replace) in self.replacements:
-                    s = RegexpEditorStep('bulk-edit', path, search, replace)
-                    result = s.run(silent_emitter, None)
-                    emit.emit('%s -> %s' % (path, result))
-                    if result != 'Changed 0 lines':
-                        changes += 1
+    def _run(self, emit, screen):
+        files = 0
+        changes = 0
+        errors = 0
+
+        for results in self._results():
+            for path, changed, error in results:
+                if error:
+                    emit.emit('%s -> Failed: %s' % (path, error))
+                    errors += 1
+                elif changed:
+                    emit.emit('%s -> Changed %d lines' % (path, changed))
+                    files += 1
+                    changes += changed
+
+        if errors:
+            emit.emit('Failed to edit %d files' % errors)
+            return False
 
-        return changes
+        # Always true, having nothing left to change is not a failure
+        return 'Changed %d lines in %d files' % (changes, files)
 
 
 class FileAppendStep(Step):
@@ -341,112 +1061,69 @@ class CopyFileStep(Step):
         return True
 
 
-class YamlAddElementStep(Step):
-    def __init__(self, name, path, target_element_path, data, **kwargs):
-        super(YamlAddElementStep, self).__init__(name, **kwargs)
+class YamlTransactionStep(Step):
+    """Apply an ordered list of operations to a YAML document.
+
+    The document is loaded once, and written once if the operations changed
+    it. Only the parts of the file the operations touch are rewritten, so
+    comments and the order of keys are kept. See yaml_editor for the
+    operations.
+    """
+
+    def __init__(self, name, path, operations, **kwargs):
+        super(YamlTransactionStep, self).__init__(name, **kwargs)
         self.path = _handle_path_in_cwd(path, kwargs.get('cwd'))
-        self.target_element_path = target_element_path
-        self.data = data
+        self.operations = operations
 
     def _run(self, emit, screen):
         with open(self.path) as f:
-            y = yaml.load(f.read())
-
-        sub = y
-
-        for key in self.target_element_path:
-            print key
-            sub = sub[key]
-
-        sub.append(self.data)
-
-        emit.emit('YAML after changes:')
-        emit.emit(yaml.dump(y))
+            before = f.read()
+
+        after, in_place = yaml_editor.edit(before, self.operations)
+        if after == before:
+            emit.emit('%s is unchanged' % self.path)
+            return True
+
+        if not in_place:
+            emit.emit('Could not edit %s in place, rewriting all of it'
+                      % self.path)
+        emit.emit(''.join(difflib.unified_diff(
+            before.splitlines(True), after.splitlines(True),
+            self.path, self.path)))
+        utils.atomic_write(self.path, after)
+        return True
 
-        with open(self.path, 'w') as f:
-            f.write(yaml.dump(y, default_flow_style=False))
 
-        return True
+class YamlAddElementStep(YamlTransactionStep):
+    def __init__(self, name, path, target_element_path, data, **kwargs):
+        super(YamlAddElementStep, self).__init__(
+            name, path, [('add', target_element_path, data)], **kwargs)
+        self.target_element_path = target_element_path
+        self.data = data
 
 
-class YamlUpdateElementStep(Step):
+class YamlUpdateElementStep(YamlTransactionStep):
     def __init__(self, name, path, target_element_path, target_key, data,
                  **kwargs):
-        super(YamlUpdateElementStep, self).__init__(name, **kwargs)
-        self.path = _handle_path_in_cwd(path, kwargs.get('cwd'))
+        super(YamlUpdateElementStep, self).__init__(
+            name, path,
+            [('update', target_element_path, target_key, data)], **kwargs)
         self.target_element_path = target_element_path
         self.target_key = target_key
         self.data = data
 
-    def _run(self, emit, screen):
-        with open(self.path) as f:
-            y = yaml.load(f.read())
-
-        sub = y
-
-        for key in self.target_element_path:
-            sub = sub[key]
-
-        sub[self.target_key] = self.data
-
-        emit.emit('YAML after changes:')
-        emit.emit(yaml.dump(y))
-
-        with open(self.path, 'w') as f:
-            f.write(yaml.dump(y, default_flow_style=False))
-
-        return True
-
 
-class YamlDeleteElementStep(Step):
+class YamlDeleteElementStep(YamlTransactionStep):
     def __init__(self, name, path, target_element_path, index, **kwargs):
-        super(YamlDeleteElementStep, self).__init__(name, **kwargs)
-        self.path = _handle_path_in_cwd(path, kwargs.get('cwd'))
+        super(YamlDeleteElementStep, self).__init__(
+            name, path, [('delete', target_element_path, index)], **kwargs)
         self.target_element_path = target_element_path
         self.index = index
 
-    def _run(self, emit, screen):
-        with open(self.path) as f:
-            y = yaml.load(f.read())
-
-        sub = y
-
-        for key in self.target_element_path:
-            sub = sub[key]
-
-        del sub[self.index]
-
-        emit.emit('YAML after changes:')
-        emit.emit(yaml.dump(y))
-
-        with open(self.path, 'w') as f:
-            f.write(yaml.dump(y, default_flow_style=False))
-
-        return True
-
 
-class YamlUpdateDictionaryStep(Step):
+class YamlUpdateDictionaryStep(YamlTransactionStep):
     def __init__(self, name, path, target_element_path, data, **kwargs):
-        super(YamlUpdateDictionaryStep, self).__init__(name, **kwargs)
-        self.path = _handle_path_in_cwd(path, kwargs.get('cwd'))
+        super(YamlUpdateDictionaryStep, self).__init__(
+            name, path, [('merge', target_element_path, data)], **kwargs)
         self.target_element_path = target_element_path
         self.data = data
-
-    def _run(self, emit, screen):
-        with open(self.path) as f:
-            y = yaml.load(f.read())
-
-        sub = y
-
-        for key in self.target_element_path:
-            sub = sub[key]
-
-        sub.update(self.data)
-
-        emit.emit('YAML after changes:')
-        emit.emit(yaml.dump(y))
-
-        with open(self.path, 'w') as f:
-            f.write(yaml.dump(y, default_flow_style=False))
-
-        return True
@@ -0,0 +1,106 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import mock
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from oslotest import base
+
+from ostrich import answers
+from ostrich import steps
+from ostrich.tests.unit import test_steps_command
+
+
+class AnswersTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(AnswersTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_load_yaml(self):
+        path = self._write('answers.yml', '\n'.join([
+            'hypervisor: ironic',
+            'ironic-ip-block: 192.168.52.0/24',
+            'enable-ceph: yes',
+            'local-cache: none',
+            '']))
+        self.assertEqual({'hypervisor': 'ironic',
+                          'ironic-ip-block': '192.168.52.0/24',
+                          'enable-ceph': 'yes',
+                          'local-cache': 'none'},
+                         answers.load(path))
+
+    def test_load_json(self):
+        path = self._write('answers.json', json.dumps(
+            {'git-mirror-openstack': 'git://git.openstack.org',
+             'osa-branch': 'stable/newton'}))
+        self.assertEqual('stable/newton', answers.load(path)['osa-branch'])
+
+    def test_invalid(self):
+        for content in ['hypervisor: xen',
+                        'ironic-ip-block: 192.168.52.0/33',
+                        'ironic-ip-block: 192.168.52.0/29',
+                        'git-mirror-github: github.com',
+                        'local-cache: http://cache.example.com/',
+                        'hypervsior: kvm',
+                        '- a list']:
+            self.assertRaises(answers.InvalidAnswer, answers.load,
+                              self._write('answers.yml', content))
+
+    def test_environment_wins(self):
+        path = self._write('answers.yml', 'hypervisor: kvm\n')
+        a = answers.Answers(path, {'OSTRICH_ANSWER_HYPERVISOR': 'ironic',
+                                   'OSTRICH_ANSWER_ENABLE_CEPH': 'no'})
+        self.assertEqual('ironic', a.get('hypervisor'))
+        self.assertEqual('no', a.get('enable-ceph'))
+        self.assertIsNone(a.get('osa-branch'))
+
+        self.assertRaises(answers.InvalidAnswer, answers.Answers, None,
+                          {'OSTRICH_ANSWER_TRACE_PROCESSES': 'maybe'})
+
+    def test_question_step(self):
+        emit = test_steps_command.RecordingEmitter('tests', None)
+        emit.getstr = mock.Mock(side_effect=['xen', 'kvm'])
+        s = steps.QuestionStep('hypervisor', 'Title', 'Help', 'Prompt')
+
+        with mock.patch.object(answers, 'ANSWERS',
+                               answers.Answers(None, {})):
+            # Invalid answers are asked again
+            with mock.patch.object(steps, 'sys') as fake_sys:
+                fake_sys.stdin.isatty.return_value = True
+                self.assertEqual('kvm', s._run(emit, None))
+            self.assertEqual(2, emit.getstr.call_count)
+
+        with mock.patch.object(answers, 'ANSWERS', answers.Answers(
+                None, {'OSTRICH_ANSWER_HYPERVISOR': 'ironic'})):
+            self.assertEqual('ironic', s._run(emit, None))
+            self.assertEqual(2, emit.getstr.call_count)
+
+    def test_curses_is_not_imported(self):
+        out = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys\n'
+             'from ostrich import emitters, runner, steps\n'
+             'print("curses" in sys.modules)\n'],
+            cwd=os.path.join(os.path.dirname(__file__), '../../..'))
+        self.assertEqual('False', out.strip())
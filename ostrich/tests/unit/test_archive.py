@@ -0,0 +1,122 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+
+from oslotest import base
+
+from ostrich import archive
+
+
+class ArchiveTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+        self.store = archive.ObjectStore(os.path.join(self.tempdir, 'objects'))
+        self.tree = os.path.join(self.tempdir, 'tree')
+        os.makedirs(os.path.join(self.tree, 'conf.d'))
+        for name, content in [('a.yml', 'same\n'),
+                              ('conf.d/b.yml', 'same\n'),
+                              ('conf.d/c.yml', 'different\n')]:
+            with open(os.path.join(self.tree, name), 'w') as f:
+                f.write(content)
+
+    def _manifest(self, run_id):
+        return archive.Manifest(
+            run_id, os.path.join(self.tempdir, 'manifests', run_id + '.json'),
+            self.store)
+
+    def _objects(self):
+        objects = []
+        for root, _, files in os.walk(self.store.path):
+            objects.extend(files)
+        return objects
+
+    def test_identical_content_is_stored_once(self):
+        m = self._manifest('run1')
+        m.archive_tree('tree', self.tree)
+        self.assertEqual(2, len(self._objects()))
+
+        entries = m.entries()
+        self.assertEqual(['tree/a.yml', 'tree/conf.d/b.yml',
+                          'tree/conf.d/c.yml'], sorted(entries))
+        self.assertEqual(entries['tree/a.yml']['sha256'],
+                         entries['tree/conf.d/b.yml']['sha256'])
+
+        # Another run archiving the same files stores nothing new
+        self._manifest('run2').archive_tree('tree', self.tree)
+        self.assertEqual(2, len(self._objects()))
+
+    def test_archive_is_not_changed_by_later_writes(self):
+        path = os.path.join(self.tree, 'a.yml')
+        digest = self._manifest('run1').archive('a', path)
+        with open(path, 'w') as f:
+            f.write('changed\n')
+
+        with open(self.store.object_path(digest)) as f:
+            self.assertEqual('same\n', f.read())
+
+    def test_manifests_merge(self):
+        self._manifest('run1').archive('a', os.path.join(self.tree, 'a.yml'))
+        self._manifest('run1').archive(
+            'c', os.path.join(self.tree, 'conf.d/c.yml'))
+        self.assertEqual(['a', 'c'], sorted(self._manifest('run1').entries()))
+
+    def test_checkout(self):
+        m = self._manifest('run1')
+        m.archive_tree('tree', self.tree)
+
+        dest = os.path.join(self.tempdir, 'checkout')
+        m.checkout('tree', dest)
+        with open(os.path.join(dest, 'conf.d/c.yml')) as f:
+            self.assertEqual('different\n', f.read())
+
+        # Editing the checkout leaves the archive alone
+        path = os.path.join(dest, 'a.yml')
+        digest = m.entries()['tree/a.yml']['sha256']
+        self.assertNotEqual(os.stat(self.store.object_path(digest)).st_ino,
+                            os.stat(path).st_ino)
+        with open(path, 'w') as f:
+            f.write('changed\n')
+        with open(self.store.object_path(digest)) as f:
+            self.assertEqual('same\n', f.read())
+
+        # Checking out again replaces the copies
+        m.checkout('tree', dest)
+        with open(path) as f:
+            self.assertEqual('same\n', f.read())
+
+    def test_prune(self):
+        manifests = os.path.join(self.tempdir, 'manifests')
+        for run_id in ['run1', 'run2', 'run3']:
+            self._manifest(run_id).archive(
+                'a', os.path.join(self.tree, 'a.yml'))
+        self._manifest('run1').archive(
+            'c', os.path.join(self.tree, 'conf.d/c.yml'))
+        self.assertEqual(2, len(self._objects()))
+
+        # Objects are only removed once they are old enough
+        self.assertEqual((1, 0), archive.prune(2, manifests, self.store))
+        self.assertEqual(['run2.json', 'run3.json'],
+                         sorted(os.listdir(manifests)))
+        self.assertEqual(2, len(self._objects()))
+
+        with mock.patch.object(archive, 'PRUNE_GRACE', -60):
+            self.assertEqual((0, 1), archive.prune(2, manifests, self.store))
+        self.assertEqual(1, len(self._objects()))
+        self.assertTrue(os.path.exists(self.store.object_path(
+            self._manifest('run3').entries()['a']['sha256'])))
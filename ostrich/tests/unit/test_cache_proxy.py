@@ -0,0 +1,220 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import BaseHTTPServer
+import hashlib
+import mock
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import urllib2
+
+from oslotest import base
+
+from ostrich import cache_proxy
+
+
+CONTENT = ''.join(['%04d\n' % i for i in range(1000)])
+
+
+class Upstream(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(
+            (self.path, self.headers.getheader('If-None-Match')))
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if self.headers.getheader('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(CONTENT)))
+        self.send_header('ETag', '"v1"')
+        digest = hashlib.sha256(CONTENT).digest()
+        if self.path == '/corrupt':
+            digest = hashlib.sha256('something else').digest()
+        self.send_header('Digest', 'SHA-256=%s' % base64.b64encode(digest))
+        self.end_headers()
+        self.wfile.write(CONTENT)
+
+
+class CacheProxyTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(CacheProxyTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+        self.upstream = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Upstream)
+        self.upstream.requests = []
+        self._serve(self.upstream)
+
+        # Requests go direct, whatever proxy the environment has
+        self.opener = urllib2.build_opener(urllib2.ProxyHandler({}))
+
+        self.store = cache_proxy.ArtifactStore(self.tempdir)
+        self.proxy = cache_proxy.CacheProxy(('127.0.0.1', 0), self.store,
+                                            opener=self.opener,
+                                            allowed_hosts=['127.0.0.1'])
+        self._serve(self.proxy)
+
+    def _serve(self, server):
+        t = threading.Thread(target=server.serve_forever, args=(0.05,))
+        t.daemon = True
+        t.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def _get(self, path, headers=None):
+        # As a forward proxy
+        opener = urllib2.build_opener(urllib2.ProxyHandler(
+            {'http': 'http://127.0.0.1:%d' % self.proxy.server_address[1]}))
+        request = urllib2.Request(
+            'http://127.0.0.1:%d%s' % (self.upstream.server_address[1], path),
+            headers=headers or {})
+        return opener.open(request)
+
+    def test_upstream_url(self):
+        self.assertEqual(
+            'https://rpc-repo.rackspace.com/os-releases/x.whl',
+            cache_proxy.upstream_url('/rpc-repo.rackspace.com/os-releases/'
+                                     'x.whl'))
+        self.assertEqual('https://bootstrap.pypa.io/get-pip.py',
+                         cache_proxy.upstream_url('/pip/get-pip.py'))
+        self.assertEqual('http://example.com/a?b=c',
+                         cache_proxy.upstream_url('http://example.com/a?b=c',
+                                                  ['example.com']))
+
+        # Only the hosts the install uses are allowed
+        for path in ['http://example.com/a', '/example.com/a',
+                     'http://169.254.169.254/latest/meta-data/',
+                     '/169.254.169.254/latest', '//etc/passwd']:
+            self.assertIsNone(cache_proxy.upstream_url(path), path)
+
+    def test_parse_range(self):
+        self.assertIsNone(cache_proxy.parse_range(None, 100))
+        self.assertEqual((0, 9), cache_proxy.parse_range('bytes=0-9', 100))
+        self.assertEqual((90, 99), cache_proxy.parse_range('bytes=90-', 100))
+        self.assertEqual((90, 99), cache_proxy.parse_range('bytes=-10', 100))
+        self.assertEqual((90, 99), cache_proxy.parse_range('bytes=90-200',
+                                                           100))
+        self.assertIsNone(cache_proxy.parse_range('bytes=0-1,5-6', 100))
+        self.assertRaises(ValueError, cache_proxy.parse_range,
+                          'bytes=100-', 100)
+
+    def test_cached(self):
+        self.assertEqual(CONTENT, self._get('/a').read())
+        self.assertEqual(CONTENT, self._get('/a').read())
+        self.assertEqual([('/a', None)], self.upstream.requests)
+
+        # Another URL with the same content shares its object
+        self._get('/b').read()
+        self.assertEqual(1, len(self.store._objects()))
+
+    def test_streamed_in_chunks(self):
+        with mock.patch.object(cache_proxy, 'CHUNK', 7):
+            self.assertEqual(CONTENT, self._get('/a').read())
+        self.assertEqual(CONTENT, self._get('/a').read())
+        self.assertEqual(1, len(self.upstream.requests))
+
+    def test_range(self):
+        response = self._get('/a', {'Range': 'bytes=5-9'})
+        self.assertEqual(206, response.getcode())
+        self.assertEqual('0001\n', response.read())
+        self.assertEqual('bytes 5-9/%d' % len(CONTENT),
+                         response.info().getheader('Content-Range'))
+
+        e = self.assertRaises(urllib2.HTTPError, self._get, '/a',
+                              {'Range': 'bytes=100000-'})
+        self.assertEqual(416, e.code)
+
+    def test_errors_are_not_cached(self):
+        e = self.assertRaises(urllib2.HTTPError, self._get, '/missing')
+        self.assertEqual(404, e.code)
+        self.assertRaises(urllib2.HTTPError, self._get, '/missing')
+        self.assertEqual([('/missing', None), ('/missing', None)],
+                         self.upstream.requests)
+
+    def test_forbidden_host(self):
+        opener = urllib2.build_opener(urllib2.ProxyHandler(
+            {'http': 'http://127.0.0.1:%d' % self.proxy.server_address[1]}))
+        e = self.assertRaises(urllib2.HTTPError, opener.open,
+                              'http://169.254.169.254/latest/meta-data/')
+        self.assertEqual(403, e.code)
+        self.assertEqual([], self.upstream.requests)
+
+    def test_revalidate(self):
+        self._get('/a').read()
+        self.store.max_age = -1
+        self.assertEqual(CONTENT, self._get('/a').read())
+        self.assertEqual([('/a', None), ('/a', '"v1"')],
+                         self.upstream.requests)
+
+        # Upstream said it was current, so it is fresh again
+        self.store.max_age = 3600
+        self._get('/a').read()
+        self.assertEqual(2, len(self.upstream.requests))
+
+    def test_stale_entry_served_when_upstream_is_down(self):
+        self._get('/a').read()
+        self.store.max_age = -1
+        self.upstream.shutdown()
+        self.upstream.server_close()
+        self.assertEqual(CONTENT, self._get('/a').read())
+
+    def test_checksum_mismatch(self):
+        # Downloads are streamed, so the client gets less than it was told
+        # to expect
+        response = self._get('/corrupt')
+        self.assertLess(len(response.read()),
+                        int(response.info().getheader('Content-Length')))
+        self.assertEqual([], self.store._objects())
+
+        e = self.assertRaises(urllib2.HTTPError, self._get, '/corrupt',
+                              {'Range': 'bytes=0-9'})
+        self.assertEqual(502, e.code)
+        self.assertEqual([], self.store._objects())
+
+    def test_eviction(self):
+        self.store.max_bytes = len(CONTENT) * 2
+        for i in range(3):
+            with open(os.path.join(self.tempdir, 'objects', str(i)),
+                      'w') as f:
+                f.write(CONTENT)
+            os.utime(os.path.join(self.tempdir, 'objects', str(i)),
+                     (i, i))
+        self.store.evict()
+        self.assertEqual(['1', '2'],
+                         sorted([name for _, _, name in
+                                 self.store._objects()]))
+
+    def test_verify(self):
+        self._get('/a').read()
+        digest = hashlib.sha256(CONTENT).hexdigest()
+        self.assertEqual([], self.store.verify())
+
+        os.chmod(self.store.object_path(digest), 0o644)
+        with open(self.store.object_path(digest), 'w') as f:
+            f.write('corrupt')
+        self.assertEqual([digest], self.store.verify())
+        self.assertIsNone(self.store.lookup(
+            'http://127.0.0.1:%d/a' % self.upstream.server_address[1]))
+
+    def test_local_address(self):
+        socket.inet_aton(cache_proxy.local_address())
@@ -0,0 +1,62 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import sys
+import threading
+
+from oslotest import base
+
+from ostrich import emitters
+
+
+class EmitterTestCase(base.BaseTestCase):
+    @mock.patch.object(emitters, 'INPUT_POLL_INTERVAL', 0.01)
+    def test_getstr_polls_and_defers_other_output(self):
+        output = mock.Mock()
+        output.getmaxyx.return_value = (24, 80)
+        other = emitters.Emitter('tests', output)
+        other.log = mock.Mock()
+        drawn = []
+        output.addstr.side_effect = lambda y, x, s: drawn.append(s)
+
+        keys = [ord('k'), ord('v'), ord('x'), 127, ord('m'), 10]
+        owned = []
+        emitted = threading.Event()
+
+        def emit():
+            other.emit('from another step')
+            emitted.set()
+
+        def getch():
+            # Keys are read with the lock held, and another step writing
+            # while the question is open isn't drawn until it is answered
+            owned.append(emitters.OUTPUT_LOCK._is_owned())
+            if len(owned) == 1:
+                threading.Thread(target=emit).start()
+            if not emitted.is_set():
+                return -1
+            self.assertNotIn('from another step', drawn)
+            return keys.pop(0)
+
+        output.getch.side_effect = getch
+        fake_curses = mock.Mock(KEY_ENTER=343, KEY_BACKSPACE=263)
+        with mock.patch.dict(sys.modules, {'curses': fake_curses}):
+            e = emitters.Emitter('tests', output)
+            self.assertEqual('kvm', e.getstr('Hypervisor?'))
+
+        self.assertEqual([True] * len(owned), owned)
+        self.assertFalse(output.getstr.called)
+        other.log.assert_called_once_with('from another step')
+        self.assertIn('from another step', drawn)
+        self.assertEqual([], emitters._ASKING)
+        self.assertEqual([], emitters._DEFERRED)
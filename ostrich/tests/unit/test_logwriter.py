@@ -0,0 +1,92 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import mock
+import os
+import shutil
+import tempfile
+import zlib
+
+from oslotest import base
+
+from ostrich import logwriter
+
+
+class LogWriterTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(LogWriterTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.path = os.path.join(self.tempdir, 'log.gz')
+
+    def _flushed(self):
+        # Decompress what is on disk so far, which need not be a complete
+        # gzip stream
+        with open(self.path) as f:
+            return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(
+                f.read())
+
+    def _lines(self):
+        with gzip.open(self.path) as f:
+            return f.read()
+
+    def test_close_writes_everything(self):
+        for background in [False, True]:
+            w = logwriter.LogWriter(self.path, background=background)
+            for i in range(1000):
+                w.write('line %d\n' % i)
+            w.close()
+            self.assertEqual(''.join(['line %d\n' % i for i in range(1000)]),
+                             self._lines())
+
+    def test_lines_are_buffered(self):
+        w = logwriter.LogWriter(self.path, flush_interval=3600)
+        self.addCleanup(w.close)
+        w.write('hello\n')
+        self.assertEqual('', self._flushed())
+
+        w.flush()
+        self.assertEqual('hello\n', self._flushed())
+
+    def test_size_boundary(self):
+        w = logwriter.LogWriter(self.path, flush_bytes=10,
+                                flush_interval=3600)
+        self.addCleanup(w.close)
+        with mock.patch.object(w._gz, 'write') as write:
+            w.write('12345\n')
+            self.assertFalse(write.called)
+            w.write('67890\n')
+            write.assert_called_once_with('12345\n67890\n')
+
+    def test_time_boundary(self):
+        w = logwriter.LogWriter(self.path, flush_interval=3600)
+        self.addCleanup(w.close)
+        w.write('first\n')
+        w._last_flush -= 3600
+        w.write('second\n')
+        self.assertEqual('first\nsecond\n', self._flushed())
+
+    def test_background_flush(self):
+        w = logwriter.LogWriter(self.path, background=True,
+                                flush_interval=3600)
+        self.addCleanup(w.close)
+        w.write('hello\n')
+        w.flush()
+        self.assertEqual('hello\n', self._flushed())
+
+    def test_closed_at_exit(self):
+        w = logwriter.LogWriter(self.path, background=True)
+        w.write('hello\n')
+        logwriter._close_all()
+        self.assertEqual('hello\n', self._lines())
+        self.assertNotIn(w, logwriter._OPEN_WRITERS)
@@ -0,0 +1,171 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from oslotest import base
+
+from ostrich import patcher
+
+
+ORIGINAL = ''.join(['line %d\n' % i for i in range(1, 21)])
+
+PATCH = """--- /etc/example.conf\t2017-06-13 18:35:54.428566725 +1000
++++ /etc/example.conf\t2017-06-13 18:36:54.428566725 +1000
+@@ -2,3 +2,4 @@
+ line 2
+-line 3
++line three
++line 3.5
+ line 4
+@@ -15,3 +16,3 @@
+ line 15
+-line 16
++line sixteen
+ line 17
+"""
+
+PATCHED = ORIGINAL.replace(
+    'line 3\n', 'line three\nline 3.5\n').replace(
+    'line 16\n', 'line sixteen\n')
+
+
+class PatcherTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(PatcherTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+        os.makedirs(os.path.join(self.tempdir, 'etc'))
+        self.target = os.path.join(self.tempdir, 'etc/example.conf')
+        self.patch = os.path.join(self.tempdir, 'example.patch')
+        with open(self.patch, 'w') as f:
+            f.write(PATCH)
+
+    def _write(self, content):
+        with open(self.target, 'w') as f:
+            f.write(content)
+
+    def _read(self):
+        with open(self.target) as f:
+            return f.read()
+
+    def _states(self, outcome):
+        return [r.state for _, results in outcome for r in results]
+
+    def test_parse(self):
+        fps = patcher.parse(PATCH)
+        self.assertEqual(1, len(fps))
+        self.assertEqual('/etc/example.conf', fps[0].target())
+        self.assertEqual('/tmp/etc/example.conf', fps[0].target('/tmp'))
+        self.assertEqual(2, len(fps[0].hunks))
+        self.assertEqual(['line 2\n', 'line 3\n', 'line 4\n'],
+                         fps[0].hunks[0].old)
+        self.assertEqual(['line 2\n', 'line three\n', 'line 3.5\n',
+                          'line 4\n'],
+                         fps[0].hunks[0].new)
+
+    def test_parse_no_newline(self):
+        fps = patcher.parse('--- /a\n+++ /a\n@@ -1 +1 @@\n-old\n'
+                            '\\ No newline at end of file\n+new\n')
+        self.assertEqual(['old'], fps[0].hunks[0].old)
+        self.assertEqual(['new\n'], fps[0].hunks[0].new)
+
+    def test_parse_truncated(self):
+        self.assertRaises(patcher.PatchError, patcher.parse,
+                          '--- /a\n+++ /a\n@@ -1,3 +1,3 @@\n a\n')
+
+    def test_shipped_patches_parse(self):
+        patches = os.path.join(os.path.dirname(__file__),
+                               '../../../patches')
+        for name in os.listdir(patches):
+            fps = patcher.load(os.path.join(patches, name))
+            self.assertTrue(fps, name)
+            for fp in fps:
+                self.assertTrue(fp.target().startswith('/'), name)
+                self.assertNotIn(' ', fp.target(), name)
+
+    def test_apply(self):
+        self._write(ORIGINAL)
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual([patcher.APPLIED, patcher.APPLIED],
+                         self._states(outcome))
+        self.assertEqual(PATCHED, self._read())
+
+    def test_apply_with_offset(self):
+        self._write('extra\nextra\n' + ORIGINAL)
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual([2, 2], [r.offset for r in outcome[0][1]])
+        self.assertEqual('extra\nextra\n' + PATCHED, self._read())
+
+    def test_already_applied(self):
+        self._write(PATCHED)
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual([patcher.ALREADY_APPLIED, patcher.ALREADY_APPLIED],
+                         self._states(outcome))
+        self.assertTrue(patcher.already_applied(outcome))
+        self.assertEqual(PATCHED, self._read())
+
+    def test_partly_applied(self):
+        self._write(ORIGINAL.replace('line 16\n', 'line sixteen\n'))
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual([patcher.APPLIED, patcher.ALREADY_APPLIED],
+                         self._states(outcome))
+        self.assertEqual(PATCHED, self._read())
+
+    def test_failed_hunk_changes_nothing(self):
+        content = ORIGINAL.replace('line 16\n', 'something else\n')
+        self._write(content)
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual([patcher.APPLIED, patcher.FAILED],
+                         self._states(outcome))
+        self.assertEqual(1, len(patcher.failed(outcome)))
+        self.assertEqual(content, self._read())
+
+    def test_missing_target(self):
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual([patcher.FAILED, patcher.FAILED],
+                         self._states(outcome))
+
+    def test_dry_run(self):
+        self._write(ORIGINAL)
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir,
+                                      dry_run=True)
+        self.assertEqual([patcher.APPLIED, patcher.APPLIED],
+                         self._states(outcome))
+        self.assertEqual(ORIGINAL, self._read())
+
+    def test_no_newline_at_end_of_file(self):
+        self._write('a\nb')
+        with open(self.patch, 'w') as f:
+            f.write('--- /etc/example.conf\n+++ /etc/example.conf\n'
+                    '@@ -1,2 +1,2 @@\n a\n-b\n'
+                    '\\ No newline at end of file\n+c\n')
+        patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual('a\nc\n', self._read())
+
+    def test_addition_without_context(self):
+        self._write('a\nb\n')
+        with open(self.patch, 'w') as f:
+            f.write('--- /etc/example.conf\n+++ /etc/example.conf\n'
+                    '@@ -1,0 +2,2 @@\n+x\n+y\n')
+
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual([patcher.APPLIED], self._states(outcome))
+        self.assertEqual('a\nx\ny\nb\n', self._read())
+
+        # Applying it again doesn't add the lines twice
+        outcome = patcher.apply_patch(self.patch, root=self.tempdir)
+        self.assertEqual([patcher.ALREADY_APPLIED], self._states(outcome))
+        self.assertEqual('a\nx\ny\nb\n', self._read())
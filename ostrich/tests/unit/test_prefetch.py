@@ -0,0 +1,75 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import shutil
+import tempfile
+
+from oslotest import base
+
+from ostrich import prefetch
+from ostrich.stages import stage_05_prefetch
+from ostrich import steps
+from ostrich.tests.unit import test_steps_command
+from ostrich.tests.unit import utils as test_utils
+
+
+class PrefetchTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(PrefetchTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.prefetcher = prefetch.Prefetcher(self.tempdir)
+
+    def test_jobs(self):
+        self.prefetcher.start(prefetch.Job('ok', 'echo $GREETING',
+                                           env={'GREETING': 'hello'}))
+        self.prefetcher.start(prefetch.Job('fails', 'exit 3'))
+
+        self.assertEqual(0, self.prefetcher.wait('ok'))
+        self.assertEqual(3, self.prefetcher.wait('fails'))
+        self.assertIsNone(self.prefetcher.wait('never-started'))
+        with open(self.prefetcher.log_path('ok')) as f:
+            self.assertEqual('hello\n', f.read())
+
+    def test_wait_step(self):
+        emit = test_steps_command.RecordingEmitter('tests', None)
+        with mock.patch.object(prefetch, 'PREFETCHER', self.prefetcher):
+            steps.PrefetchStartStep(
+                'start', [prefetch.Job('fails', 'exit 3')])._run(emit, None)
+
+            # Failing to prefetch isn't a failure
+            s = steps.PrefetchWaitStep('wait', 'fails')
+            self.assertTrue(s._run(emit, None))
+            self.assertTrue(steps.PrefetchWaitStep('wait', 'other')._run(
+                emit, None))
+        self.assertTrue([line for line in emit.lines
+                         if 'exit code 3' in line])
+
+    def test_stage_jobs(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.kwargs['env'] = {}
+        self.assertEqual([], stage_05_prefetch.get_steps(r))
+
+        r.kwargs['prefetch'] = True
+        r.kwargs['git_reference'] = True
+        r.complete.pop('apt-useful', None)
+        r.complete.pop('git-clone-osa', None)
+        jobs = stage_05_prefetch.get_steps(r)[0].jobs
+        self.assertEqual(['apt', 'git'], [job.name for job in jobs])
+        self.assertIn('--download-only', jobs[0].command)
+        self.assertIn(r.complete['git-mirror-openstack'], jobs[1].command)
+
+        # Jobs for steps which have already run are skipped
+        r.complete['apt-useful'] = True
+        r.complete['git-clone-osa'] = True
+        self.assertEqual([], stage_05_prefetch.get_steps(r))
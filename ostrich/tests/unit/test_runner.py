@@ -0,0 +1,296 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+
+from oslotest import base
+
+from ostrich import emitters
+from ostrich import events
+from ostrich import runner
+from ostrich import steps
+from ostrich.tests.unit import utils as test_utils
+
+
+class RecordingStep(steps.Step):
+    def __init__(self, name, log, outcomes=None, **kwargs):
+        super(RecordingStep, self).__init__(name, **kwargs)
+        self.log = log
+        self.outcomes = outcomes or [True]
+
+    def _run(self, emit, screen):
+        self.log.append(self.name)
+        return self.outcomes.pop(0)
+
+
+class BarrierStep(steps.Step):
+    """A step which only succeeds if its siblings run at the same time."""
+
+    def __init__(self, name, barrier, **kwargs):
+        super(BarrierStep, self).__init__(name, **kwargs)
+        self.barrier = barrier
+
+    def _run(self, emit, screen):
+        self.barrier['lock'].acquire()
+        self.barrier['waiting'] += 1
+        self.barrier['lock'].release()
+
+        return self.barrier['event'].wait(5) or False
+
+
+class TempStateRunner(runner.Runner):
+    def __init__(self, screen, path):
+        self._sp = os.path.join(path, 'state.json')
+        super(TempStateRunner, self).__init__(screen)
+
+    def _get_state_path(self):
+        return self._sp
+
+
+class RunnerTestCase(base.BaseTestCase):
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_chain_runs_in_order(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        log = []
+        r.load_dependancy_chain([RecordingStep('zz', log),
+                                 RecordingStep('yy', log),
+                                 RecordingStep('xx', log)])
+        r.resolve_steps(use_curses=False)
+        self.assertEqual(['zz', 'yy', 'xx'], log)
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_group_dependencies(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        log = []
+        first = RecordingStep('first', log)
+        a = RecordingStep('a', log)
+        b = RecordingStep('b', log)
+        last = RecordingStep('last', log)
+        r.load_dependancy_chain([first, [a, b], last])
+
+        self.assertEqual('first', a.depends)
+        self.assertEqual('first', b.depends)
+        self.assertEqual(['a', 'b'], last.dependencies())
+
+        r.resolve_steps(use_curses=False)
+        self.assertEqual('first', log[0])
+        self.assertEqual(['a', 'b'], sorted(log[1:3]))
+        self.assertEqual('last', log[3])
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_group_runs_in_parallel(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.max_workers = 3
+
+        barrier = {'lock': threading.Lock(),
+                   'event': threading.Event(),
+                   'waiting': 0}
+
+        class ReleaseStep(steps.Step):
+            def _run(self, emit, screen):
+                while barrier['waiting'] < 2:
+                    threading.Event().wait(0.01)
+                barrier['event'].set()
+                return True
+
+        r.load_dependancy_chain([[BarrierStep('a', barrier),
+                                  BarrierStep('b', barrier),
+                                  ReleaseStep('c')]])
+        r.resolve_steps(use_curses=False)
+        for name in ['a', 'b', 'c']:
+            self.assertTrue(r.complete[name])
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_on_failure_runs_before_retry(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.max_workers = 2
+        log = []
+        handler = RecordingStep('handler', log)
+        flaky = RecordingStep('flaky', log, outcomes=[False, True],
+                              on_failure=handler, failing_step_delay=0)
+        r.load_dependancy_chain([flaky])
+        r.resolve_steps(use_curses=False)
+        self.assertEqual(['flaky', 'handler', 'flaky'], log)
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_shared_resources_do_not_overlap(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.max_workers = 4
+        active = []
+        overlaps = []
+
+        class ResourceStep(steps.Step):
+            def _run(self, emit, screen):
+                active.append(self.name)
+                if len(active) > 1:
+                    overlaps.append(list(active))
+                threading.Event().wait(0.05)
+                active.remove(self.name)
+                return True
+
+        r.load_dependancy_chain([[ResourceStep('a', resources=['host']),
+                                  ResourceStep('b', resources=['host']),
+                                  ResourceStep('c', resources=['host'])]])
+        r.resolve_steps(use_curses=False)
+        self.assertEqual([], overlaps)
+        for name in ['a', 'b', 'c']:
+            self.assertTrue(r.complete[name])
+
+    def test_clear_only_when_idle(self):
+        cleared = []
+
+        class ClearingEmitter(emitters.NoopEmitter):
+            def clear(self):
+                cleared.append(True)
+
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.max_workers = 3
+        barrier = {'lock': threading.Lock(),
+                   'event': threading.Event(),
+                   'waiting': 0}
+
+        class ReleaseStep(steps.Step):
+            def _run(self, emit, screen):
+                while barrier['waiting'] < 2:
+                    threading.Event().wait(0.01)
+                barrier['event'].set()
+                return True
+
+        r.load_dependancy_chain([[BarrierStep('a', barrier),
+                                  BarrierStep('b', barrier),
+                                  ReleaseStep('c')],
+                                 ReleaseStep('d')])
+        with mock.patch('ostrich.emitters.SimpleEmitter', ClearingEmitter):
+            r.resolve_steps(use_curses=False)
+
+        # Once for the group as it starts, and once for the step after it
+        self.assertEqual(2, len(cleared))
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_ready_queue_follows_dependencies_not_names(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        log = []
+        r.load_dependancy_chain([RecordingStep('step-%02d' % (10 - i), log)
+                                 for i in range(10)])
+        r.resolve_steps(use_curses=False)
+        self.assertEqual(['step-%02d' % (10 - i) for i in range(10)], log)
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_unsatisfiable_dependency(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        log = []
+        r.load_step(RecordingStep('orphan', log, depends='missing'))
+        self.assertRaises(SystemExit, r.resolve_steps, use_curses=False)
+        self.assertEqual([], log)
+
+
+class JournalTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(JournalTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_resume_from_journal(self):
+        r = TempStateRunner(None, self.tempdir)
+        r.kwargs['cwd'] = '/tmp'
+        log = []
+        r.load_dependancy_chain([RecordingStep('a', log),
+                                 RecordingStep('b', log)])
+        r.resolve_steps(use_curses=False)
+
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tempdir, 'state.journal')))
+
+        r = TempStateRunner(None, self.tempdir)
+        self.assertTrue(r.complete['a'])
+        self.assertTrue(r.complete['b'])
+        self.assertEqual(2, r.counter)
+        self.assertEqual('/tmp', r.kwargs['cwd'])
+
+        # Replay folds the journal into a new snapshot
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tempdir, 'state.journal')))
+        with open(os.path.join(self.tempdir, 'state.json')) as f:
+            self.assertTrue(json.loads(f.read())['complete']['b'])
+
+    def test_truncated_record_is_ignored(self):
+        with open(os.path.join(self.tempdir, 'state.journal'), 'w') as f:
+            f.write(json.dumps({'step': 'a', 'outcome': True,
+                                'counter': 1}) + '\n')
+            f.write('{"step": "b", "outc')
+
+        r = TempStateRunner(None, self.tempdir)
+        self.assertTrue(r.complete['a'])
+        self.assertNotIn('b', r.complete)
+        self.assertEqual(1, r.counter)
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    @mock.patch.object(runner, 'JOURNAL_COMPACTION_RECORDS', 2)
+    def test_periodic_compaction(self):
+        r = TempStateRunner(None, self.tempdir)
+        log = []
+        r.load_dependancy_chain([RecordingStep('a', log),
+                                 RecordingStep('b', log),
+                                 RecordingStep('c', log)])
+        r.resolve_steps(use_curses=False)
+
+        with open(os.path.join(self.tempdir, 'state.json')) as f:
+            state = json.loads(f.read())
+        self.assertEqual(['a', 'b'], sorted(state['complete'].keys()))
+
+        with open(os.path.join(self.tempdir, 'state.journal')) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(['c'], [record['step'] for record in records])
+
+
+class EventLogTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(EventLogTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.LoggingEmitter)
+    @mock.patch('os.path.expanduser')
+    def test_step_events(self, mock_expanduser):
+        mock_expanduser.side_effect = lambda p: p.replace('~', self.tempdir)
+        os.mkdir(os.path.join(self.tempdir, '.ostrich'))
+
+        r = TempStateRunner(None, self.tempdir)
+        log = []
+        r.load_dependancy_chain([
+            RecordingStep('a', log, outcomes=[False, True],
+                          failing_step_delay=0),
+            steps.SimpleCommandStep('b', 'exit 0', env={})])
+        r.resolve_steps(use_curses=False)
+
+        records = events.read(os.path.join(self.tempdir, 'events',
+                                           '%s.jsonl' % r.run_id))
+        self.assertEqual(
+            [('run-start', None),
+             ('step-start', 'a'), ('step-end', 'a'), ('step-retry', 'a'),
+             ('step-start', 'a'), ('step-end', 'a'),
+             ('step-start', 'b'), ('exit', 'b'), ('step-end', 'b')],
+            [(e['event'], e.get('step')) for e in records])
+
+        self.assertEqual(r.run_id, records[0]['run'])
+        self.assertEqual([1, 2], [e['attempt'] for e in records
+                                  if e['event'] == 'step-start' and
+                                  e['step'] == 'a'])
+        self.assertEqual(0, records[7]['code'])
+        self.assertEqual(sorted([e['t'] for e in records]),
+                         [e['t'] for e in records])
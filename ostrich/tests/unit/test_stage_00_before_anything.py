@@ -11,6 +11,12 @@
 # limitations under the License.
 
 import mock
+import os
+import psutil
+import shutil
+import subprocess
+import sys
+import tempfile
 import time
 
 from oslotest import base
@@ -18,24 +24,23 @@ from oslotest import base
 from ostrich import emitters
 from ostrich import runner
 from ostrich.stages import stage_00_before_anything
-from ostrich import steps
 
 
 class FakeProcess(object):
-    def __init__(self, cmdline):
+    def __init__(self, pid, cmdline):
+        self.pid = pid
         self._cmdline = cmdline
 
     def cmdline(self):
         return self._cmdline
 
 
-PROCESS_ITER_RESULTS = None
-
-
 def fake_process_iter():
-    results = PROCESS_ITER_RESULTS.pop(0)
-    for item in results:
-        yield FakeProcess(item)
+    for pid, cmdline in [(10, ['/usr/bin/foo', 'apt.systemd.daily']),
+                         (11, ['/bin/ls']),
+                         (12, ['/bin/sh', '/usr/lib/apt/apt.systemd.daily']),
+                         (13, ['/bin/true'])]:
+        yield FakeProcess(pid, cmdline)
 
 
 class Stage00TestCase(base.BaseTestCase):
@@ -47,27 +52,66 @@ class Stage00TestCase(base.BaseTestCase):
                         stage_00_before_anything.AptDailyStep)
 
     @mock.patch('psutil.process_iter', fake_process_iter)
-    @mock.patch.object(time, 'sleep', return_value=None)
-    def test_apt_daily_step(self, mock_time):
-        global PROCESS_ITER_RESULTS
-        PROCESS_ITER_RESULTS = [
-            [
-                ['/usr/bin/foo', 'apt.systemd.daily'],
-                ['/bin/ls'],
-                ['/bin/true']
-                ],
-            [
-                ['/bin/ls'],
-                ['/usr/bin/foo', 'apt.systemd.daily'],
-                ['/bin/true']
-                ],
-            [
-                ['/bin/ls'],
-                ['/bin/true']
-                ]
-            ]
-
+    @mock.patch.object(stage_00_before_anything, 'DPKG_LOCKS', [])
+    @mock.patch.object(stage_00_before_anything, 'wait_for_exit')
+    def test_apt_daily_step(self, mock_wait):
         emit = emitters.NoopEmitter('tests', None)
         s = stage_00_before_anything.AptDailyStep('apt-daily')
         self.assertTrue(s._run(emit, None))
-        self.assertEqual(2, mock_time.call_count)
+
+        # The processes are looked for once, and then waited for
+        self.assertEqual(1, mock_wait.call_count)
+        self.assertEqual([10, 12], [p.pid for p in mock_wait.call_args[0][0]])
+
+    @mock.patch('psutil.process_iter', lambda: iter([]))
+    @mock.patch.object(stage_00_before_anything, 'wait_for_exit')
+    def test_apt_daily_not_running(self, mock_wait):
+        emit = emitters.NoopEmitter('tests', None)
+        s = stage_00_before_anything.AptDailyStep('apt-daily')
+        with mock.patch.object(stage_00_before_anything, 'DPKG_LOCKS', []):
+            self.assertTrue(s._run(emit, None))
+        self.assertEqual(0, mock_wait.call_count)
+
+    def test_wait_for_exit(self):
+        child = subprocess.Popen(['sleep', '0.5'])
+        self.addCleanup(child.wait)
+
+        start = time.time()
+        stage_00_before_anything.wait_for_exit(
+            [FakeProcess(child.pid, ['sleep', '0.5'])])
+        self.assertGreater(time.time() - start, 0.4)
+        self.assertIsNotNone(child.poll())
+
+    @mock.patch.object(stage_00_before_anything, 'pidfd_open',
+                       return_value=None)
+    def test_wait_for_exit_without_pidfds(self, mock_pidfd_open):
+        child = subprocess.Popen(['sleep', '0.2'])
+        self.addCleanup(child.wait)
+        stage_00_before_anything.wait_for_exit([psutil.Process(child.pid)])
+        self.assertIsNotNone(child.poll())
+
+    def test_wait_for_lock(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        lock = os.path.join(tempdir, 'lock')
+        open(lock, 'w').close()
+
+        # Another process holds the lock for a while
+        holder = subprocess.Popen(
+            [sys.executable, '-c',
+             'import fcntl, sys, time\n'
+             'f = open(sys.argv[1], "w")\n'
+             'fcntl.lockf(f, fcntl.LOCK_EX)\n'
+             'print("locked")\n'
+             'sys.stdout.flush()\n'
+             'time.sleep(0.5)\n', lock],
+            stdout=subprocess.PIPE)
+        self.addCleanup(holder.wait)
+        holder.stdout.readline()
+
+        start = time.time()
+        self.assertTrue(stage_00_before_anything.wait_for_lock(lock))
+        self.assertGreater(time.time() - start, 0.3)
+
+        self.assertFalse(stage_00_before_anything.wait_for_lock(
+            os.path.join(tempdir, 'missing')))
@@ -0,0 +1,104 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from oslotest import base
+
+from ostrich.stages import stage_30_clone_osa
+from ostrich.tests.unit import utils as test_utils
+
+
+HELPER = os.path.join(os.path.dirname(__file__), '../../../helpers',
+                      'git-reference-clone')
+
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'tests',
+    'GIT_AUTHOR_EMAIL': 'tests@example.com',
+    'GIT_COMMITTER_NAME': 'tests',
+    'GIT_COMMITTER_EMAIL': 'tests@example.com'
+    }
+
+
+class Stage30TestCase(base.BaseTestCase):
+    def setUp(self):
+        super(Stage30TestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+        self.env = dict(os.environ)
+        self.env.update(GIT_ENV)
+
+        self.remote = os.path.join(self.tempdir, 'remote')
+        self.reference = os.path.join(self.tempdir, 'git/reference.git')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        self._git(self.tempdir, 'init', '-q', self.remote)
+
+    def _git(self, cwd, *args):
+        return subprocess.check_output(('git',) + args, cwd=cwd,
+                                       env=self.env).strip()
+
+    def _commit(self, message):
+        self._git(self.remote, 'commit', '-q', '--allow-empty', '-m', message)
+        return self._git(self.remote, 'rev-parse', 'HEAD')
+
+    def _clone(self, remote, bundle=None):
+        args = [HELPER, remote, self.reference, self.dest]
+        if bundle:
+            args.append(bundle)
+        # Run from outside any git repository, as an installed ostrich is
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(args, env=self.env, cwd=self.tempdir,
+                                  stdout=devnull, stderr=devnull)
+
+    def test_command(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.kwargs['env'] = {}
+        self.assertTrue(stage_30_clone_osa.get_steps(r)[0].command
+                        .startswith('git clone '))
+
+        r.kwargs['git_reference'] = True
+        r.kwargs['git_bundle'] = '/srv/osa.bundle'
+        command = stage_30_clone_osa.get_steps(r)[0].command
+        self.assertTrue(command.startswith('./helpers/git-reference-clone '))
+        self.assertTrue(command.endswith(' /srv/osa.bundle'))
+
+    def test_reference_clone(self):
+        first = self._commit('first')
+        self._clone(self.remote)
+        self.assertEqual(first, self._git(self.dest, 'rev-parse', first))
+        self.assertEqual(self.remote,
+                         self._git(self.dest, 'remote', 'get-url', 'origin'))
+        self.assertEqual(self.remote, self._git(self.reference, 'config',
+                                                'ostrich.remote'))
+
+        # Later runs fetch into the reference, and from there to the clone
+        second = self._commit('second')
+        self._clone(self.remote)
+        self.assertEqual(second, self._git(self.reference, 'rev-parse',
+                                           second))
+        self.assertEqual(second, self._git(self.dest, 'rev-parse', second))
+
+    def test_bundle_without_remote(self):
+        first = self._commit('first')
+        bundle = os.path.join(self.tempdir, 'osa.bundle')
+        self._git(self.remote, 'bundle', 'create', bundle, '--all')
+
+        self._clone(os.path.join(self.tempdir, 'unreachable'), bundle)
+        self.assertEqual(first, self._git(self.dest, 'rev-parse', first))
+
+    def test_unreachable_remote_fails(self):
+        self.assertRaises(subprocess.CalledProcessError, self._clone,
+                          os.path.join(self.tempdir, 'unreachable'))
@@ -0,0 +1,54 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from oslotest import base
+
+from ostrich import cache_proxy
+from ostrich import utils
+from ostrich.stages import stage_50_configure_osa
+from ostrich.tests.unit import utils as test_utils
+
+
+class Stage50TestCase(base.BaseTestCase):
+    def _steps(self, local_cache):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.kwargs['env'] = {}
+        r.complete['local-cache'] = local_cache
+        found = {}
+        for group in utils.step_groups(stage_50_configure_osa.get_steps(r)):
+            for step in group:
+                found[step.name] = step
+        return found
+
+    def test_downloads_use_local_cache(self):
+        found = self._steps('192.168.50.1:8642')
+        self.assertEqual('wget_wrapper -T 30 -q --no-hsts '
+                         'http://192.168.50.1:8642/',
+                         found['lxc-cachable-downloads'].replace)
+
+        command = found['archive-upper-constraints'].command
+        self.assertTrue(command.startswith(
+            'curl http://192.168.50.1:8642/git.openstack.org/cgit/'))
+
+        # Which the cache fetches from upstream
+        for path in ['/images.linuxcontainers.org/meta/1.0/index-user',
+                     '/git.openstack.org/cgit/openstack/requirements/'
+                     'plain/upper-constraints.txt?id=1']:
+            self.assertEqual('https:/' + path,
+                             cache_proxy.upstream_url(path))
+
+    def test_downloads_without_local_cache(self):
+        found = self._steps('none')
+        self.assertEqual('wget_wrapper -T 30 -q --no-hsts http://',
+                         found['lxc-cachable-downloads'].replace)
+        self.assertTrue(found['archive-upper-constraints'].command
+                        .startswith('curl https://git.openstack.org/cgit/'))
@@ -0,0 +1,73 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from oslotest import base
+
+from ostrich.stages import stage_91_install
+from ostrich.tests.unit import utils as test_utils
+
+
+class Stage91TestCase(base.BaseTestCase):
+    def _runner(self, parallel):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.kwargs['env'] = {}
+        r.kwargs['parallel_plays'] = parallel
+        return r
+
+    def test_plays_are_chained_by_default(self):
+        r = self._runner(False)
+        r.load_dependancy_chain(stage_91_install.get_steps(r))
+
+        self.assertEqual(['os-keystone-install'],
+                         r.steps['os-glance-install'].dependencies())
+        self.assertEqual(['os-neutron-install'],
+                         r.steps['os-heat-install'].dependencies())
+        self.assertEqual([], r.steps['os-heat-install'].resources)
+        self.assertNotIn('static-inventory', r.steps)
+        self.assertNotIn('ANSIBLE_INVENTORY',
+                         r.steps['os-heat-install'].env)
+
+    def test_parallel_plays(self):
+        r = self._runner(True)
+        r.load_dependancy_chain(stage_91_install.get_steps(r))
+
+        for play in ['os-heat-install', 'os-horizon-install',
+                     'os-aodh-install', 'os-ceilometer-install',
+                     'os-swift-install']:
+            self.assertEqual(['os-keystone-install'],
+                             r.steps[play].dependencies())
+        self.assertEqual(['host'], r.steps['os-nova-install'].resources)
+        self.assertIn('ansible-os-heat-install.log',
+                      r.steps['os-heat-install'].env['ANSIBLE_LOG_PATH'])
+
+        # Plays share an inventory generated before any of them run, rather
+        # than each regenerating it at the same time
+        self.assertEqual(['static-inventory'],
+                         r.steps['openstack-hosts-setup'].dependencies())
+        self.assertIsNone(r.steps['static-inventory'].cwd)
+        for play in stage_91_install.PLAYS:
+            self.assertEqual(
+                os.path.join(stage_91_install.INVENTORY_DIR, 'inventory'),
+                r.steps[play[0]].env['ANSIBLE_INVENTORY'])
+
+        tail = r.steps['kwargs-return-to-ostrich-dir'].dependencies()
+        self.assertIn('os-ironic-install', tail)
+        self.assertIn('os-aodh-install', tail)
+
+    def test_lxc_containers_create_recovery(self):
+        r = self._runner(False)
+        plays = stage_91_install.get_play_steps(r)
+        on_failure = [p.on_failure for p in plays
+                      if p.name == 'lxc-containers-create'][0]
+        self.assertEqual('lxc-containers-create-on-error', on_failure.name)
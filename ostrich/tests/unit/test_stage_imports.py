@@ -12,9 +12,14 @@
 
 
 import importlib
+import mock
+import os
+import shutil
+import tempfile
 
 from oslotest import base
 from ostrich import stage_loader
+from ostrich import steps
 from ostrich.tests.unit import utils as test_utils
 
 
@@ -33,3 +38,95 @@ class StageImportsTestCase(base.BaseTestCase):
             module = importlib.import_module(
                 'ostrich.stages.%s' % name)
             module.get_steps(r)
+
+    def test_debug_output_archives_deploy_config(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.kwargs['env'] = {}
+        module = importlib.import_module(
+            'ostrich.stages.stage_93_debug_output')
+        r.load_dependancy_chain(module.get_steps(r))
+        self.assertEqual(['archive-openstack-deploy'],
+                         r.steps['openstack-details'].dependencies())
+
+    def test_discover_patches(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        patches = stage_loader.discover_patches(r)
+        self.assertNotEqual(0, len(patches))
+        for patch in patches:
+            self.assertTrue(os.path.exists(steps._patch_path(patch)), patch)
+
+    def test_discover_stage_modules(self):
+        builtin = stage_loader.discover_stage_modules()
+        self.assertEqual(len(stage_loader.discover_stages()), len(builtin))
+        self.assertEqual(('stage_00_before_anything',
+                          'ostrich.stages.stage_00_before_anything'),
+                         builtin[0])
+
+        site = mock.Mock(module_name='site_stages.config')
+        site.name = 'stage_45_site_config'
+        clash = mock.Mock(module_name='site_stages.apt')
+        clash.name = 'stage_20_apt'
+        with mock.patch.object(stage_loader.pkg_resources,
+                               'iter_entry_points',
+                               return_value=[site, clash]):
+            stages = stage_loader.discover_stage_modules()
+
+        self.assertEqual(len(builtin) + 1, len(stages))
+        self.assertIn(('stage_20_apt', 'ostrich.stages.stage_20_apt'),
+                      stages)
+        names = [name for name, _ in stages]
+        self.assertEqual(sorted(names), names)
+        self.assertEqual('site_stages.config',
+                         dict(stages)['stage_45_site_config'])
+
+    def test_stage_manifest(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'stage-manifest.json')
+
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.kwargs['env'] = {}
+        name = 'stage_20_apt'
+        module_name = 'ostrich.stages.stage_20_apt'
+        module = importlib.import_module(module_name)
+
+        manifest = stage_loader.StageManifest(path)
+        self.assertFalse(manifest.complete(name, module_name, r))
+        stage_steps = module.get_steps(r)
+        manifest.record(name, module_name, r, stage_steps)
+
+        # Not until all of its steps are
+        manifest = stage_loader.StageManifest(path)
+        self.assertFalse(manifest.complete(name, module_name, r))
+        for step in stage_steps:
+            r.complete[step.name] = True
+        self.assertTrue(manifest.complete(name, module_name, r))
+
+        # Different answers, or kwargs, might mean different steps
+        r.kwargs['prefetch'] = True
+        self.assertFalse(manifest.complete(name, module_name, r))
+        r.kwargs['prefetch'] = False
+        r.complete['osa-branch'] = 'stable/ocata'
+        self.assertFalse(manifest.complete(name, module_name, r))
+
+    def test_stage_manifest_every_stage(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        manifest = stage_loader.StageManifest(
+            os.path.join(tempdir, 'stage-manifest.json'))
+
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.kwargs['env'] = {}
+        for name, module_name in stage_loader.discover_stage_modules():
+            module = importlib.import_module(module_name)
+            stage_steps = module.get_steps(r)
+            manifest.record(name, module_name, r, stage_steps)
+
+            # Stages may return groups of steps which run in parallel
+            names = []
+            for entry in stage_steps:
+                if isinstance(entry, list):
+                    names.extend([step.name for step in entry])
+                else:
+                    names.append(entry.name)
+            self.assertEqual(names, manifest.stages[name]['steps'], name)
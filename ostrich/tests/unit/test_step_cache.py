@@ -0,0 +1,137 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+
+from oslotest import base
+
+from ostrich import emitters
+from ostrich import step_cache
+from ostrich import steps
+from ostrich.tests.unit import utils as test_utils
+
+
+class StepCacheTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(StepCacheTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.cache = step_cache.StepCache(
+            os.path.join(self.tempdir, 'cache'))
+
+    def _runner(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.step_cache = self.cache
+        return r
+
+    def test_uncacheable_steps(self):
+        r = self._runner()
+        s = steps.KwargsStep('kwargs', r, {})
+        self.assertEqual(None, self.cache.key(s))
+
+        s = steps.AnsibleTimingSimpleCommandStep(
+            'play', 'openstack-ansible foo.yml',
+            os.path.join(self.tempdir, 'timings.json'), env={})
+        self.assertEqual(None, self.cache.key(s))
+
+        # Commands are only cached when they say what they change
+        s = steps.SimpleCommandStep('checkout', 'git checkout abc', env={})
+        self.assertEqual(None, self.cache.key(s))
+
+    def test_command_key_follows_inputs(self):
+        a = steps.SimpleCommandStep('cmd', '/bin/true', env={'A': '1'},
+                                    cache_outputs=['/etc/hosts'])
+        b = steps.SimpleCommandStep('cmd', '/bin/true', env={'A': '1'},
+                                    cache_outputs=['/etc/hosts'])
+        c = steps.SimpleCommandStep('cmd', '/bin/true', env={'A': '2'},
+                                    cache_outputs=['/etc/hosts'])
+        self.assertEqual(self.cache.key(a), self.cache.key(b))
+        self.assertNotEqual(self.cache.key(a), self.cache.key(c))
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_cache_hit_skips_step(self):
+        path = os.path.join(self.tempdir, 'runs')
+        uncached = os.path.join(self.tempdir, 'uncached')
+
+        for i in range(2):
+            # A fresh runner each time, as if state.json had been removed
+            r = self._runner()
+            r.load_step(steps.SimpleCommandStep(
+                'count', 'echo run >> %s' % path, cache_outputs=[path],
+                env={}))
+            r.load_step(steps.SimpleCommandStep(
+                'uncached', 'echo run >> %s' % uncached, env={}))
+            r.resolve_steps(use_curses=False)
+            self.assertTrue(r.complete['count'])
+
+        with open(path) as f:
+            self.assertEqual(['run\n'], f.readlines())
+        with open(uncached) as f:
+            self.assertEqual(['run\n', 'run\n'], f.readlines())
+
+    def test_entry_without_outputs_never_hits(self):
+        s = steps.SimpleCommandStep('cmd', '/bin/true', env={},
+                                    cache_outputs=['/etc/hosts'])
+        key = self.cache.key(s)
+        s.kwargs['cache_outputs'] = []
+        self.cache.record(key, s, True)
+        self.assertFalse(os.path.exists(self.cache._entry_path(key)))
+
+        # Nor do entries recorded before outputs were required
+        with open(self.cache._entry_path(key), 'w') as f:
+            f.write(json.dumps({'step': 'cmd', 'outcome': True,
+                                'outputs': {}}))
+        self.assertEqual(None, self.cache.lookup(key))
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_edited_file_is_a_miss(self):
+        path = os.path.join(self.tempdir, 'foo.ini')
+        with open(path, 'w') as f:
+            f.write('url = https://github.com/foo')
+
+        s = steps.RegexpEditorStep(
+            'edit', path, 'github.com', 'mirror.example.com')
+        key = self.cache.key(s)
+        r = self._runner()
+        r.load_step(s)
+        r.resolve_steps(use_curses=False)
+        self.assertEqual('Changed 1 lines', self.cache.lookup(key))
+
+        # The same edit of the edited file is a hit
+        s = steps.RegexpEditorStep(
+            'edit', path, 'github.com', 'mirror.example.com')
+        self.assertEqual(key, self.cache.key(s))
+        self.assertEqual('Changed 1 lines', self.cache.lookup(key))
+
+        # The recorded output no longer matches, so this is a miss
+        with open(path, 'w') as f:
+            f.write('url = https://github.com/foo')
+        self.assertEqual(None, self.cache.lookup(key))
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_changed_output_is_a_miss(self):
+        path = os.path.join(self.tempdir, 'output')
+        s = steps.SimpleCommandStep('touch', 'echo 1 > %s' % path,
+                                    cache_outputs=[path], env={})
+
+        r = self._runner()
+        r.load_step(s)
+        r.resolve_steps(use_curses=False)
+        self.assertTrue(self.cache.lookup(self.cache.key(s)))
+
+        with open(path, 'w') as f:
+            f.write('2')
+        self.assertEqual(None, self.cache.lookup(self.cache.key(s)))
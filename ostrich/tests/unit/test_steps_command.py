@@ -0,0 +1,222 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import mock
+import os
+import Queue
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from oslotest import base
+
+from ostrich import emitters
+from ostrich import steps
+
+
+class RecordingEmitter(emitters.NoopEmitter):
+    def __init__(self, progname, output):
+        super(RecordingEmitter, self).__init__(progname, output)
+        self.lines = []
+
+        self.logged = []
+        self.events = []
+
+    def emit(self, s):
+        self.log(s)
+        self.display(s)
+
+    def log(self, s):
+        self.logged.append(s)
+
+    def display(self, s):
+        self.lines.extend(s.split('\n'))
+
+    def event(self, event, **fields):
+        fields['event'] = event
+        self.events.append(fields)
+
+
+class SimpleCommandStepTestCase(base.BaseTestCase):
+    def test_output_and_exit_code(self):
+        emit = RecordingEmitter('tests', None)
+        s = steps.SimpleCommandStep(
+            'echo', 'echo out; echo err 1>&2; exit 3', env={},
+            acceptable_exit_codes=[3])
+        self.assertTrue(s._run(emit, None))
+        self.assertIn('out', emit.lines)
+        self.assertIn('err', emit.lines)
+        self.assertIn('... exit code 3', emit.lines)
+
+    def test_unacceptable_exit_code(self):
+        emit = RecordingEmitter('tests', None)
+        s = steps.SimpleCommandStep('false', '/bin/false', env={})
+        self.assertFalse(s._run(emit, None))
+
+    def test_daemonized_child_does_not_block(self):
+        emit = RecordingEmitter('tests', None)
+        s = steps.SimpleCommandStep(
+            'daemon', '(sleep 30 &) ; echo parent done', env={})
+        self.assertTrue(s._run(emit, None))
+        self.assertIn('parent done', emit.lines)
+
+    @mock.patch.object(steps, 'OUTPUT_QUEUE_DEPTH', 1)
+    @mock.patch.object(steps, 'DISPLAY_TAIL_LINES', 5)
+    def test_backlog_is_logged_but_not_all_displayed(self):
+        emit = RecordingEmitter('tests', None)
+        s = steps.SimpleCommandStep('seq', 'seq 1 20000', env={})
+
+        # A slow screen lets output back up behind the reader
+        display = emit.display
+
+        def slow_display(d):
+            threading.Event().wait(0.01)
+            display(d)
+
+        emit.display = slow_display
+        self.assertTrue(s._run(emit, None))
+
+        # Reads don't end on line boundaries, but nothing may go missing
+        self.assertIn(''.join(['%d\n' % i for i in range(1, 20001)]),
+                      ''.join(emit.logged))
+        self.assertIn('20000', emit.lines)
+        self.assertTrue([line for line in emit.lines
+                         if line.endswith('are in the log')])
+        self.assertLess(len(emit.lines), 20000)
+
+    def test_reader_waits_for_consumer(self):
+        s = steps.SimpleCommandStep('zeros', 'head -c 10000000 /dev/zero',
+                                    env={})
+        obj = subprocess.Popen(s.command, shell=True, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+        items = Queue.Queue(1)
+        reader = threading.Thread(target=s._drain, args=(obj, items))
+        reader.daemon = True
+        reader.start()
+
+        # With nothing consuming, the reader holds no more than fits in the
+        # queue, and the child waits on its pipe
+        threading.Event().wait(0.3)
+        self.assertTrue(reader.is_alive())
+        self.assertIsNone(obj.poll())
+        self.assertEqual(1, items.qsize())
+
+        size = 0
+        while True:
+            kind, d = items.get(True, 10)
+            if kind == 'done':
+                break
+            size += len(d)
+        reader.join()
+        self.assertEqual(10000000, size)
+
+    def test_process_tracing(self):
+        emit = RecordingEmitter('tests', None)
+        s = steps.SimpleCommandStep(
+            'trace', '/bin/sleep 0.5; /bin/true', env={},
+            trace_processes=True, trace_interval=0.1)
+        self.assertTrue(s._run(emit, None))
+
+        started = [line for line in emit.lines
+                   if line.startswith('*** process started ***')]
+        ended = [line for line in emit.lines
+                 if line.startswith('*** process ended ***')]
+        self.assertTrue([line for line in started if 'sleep' in line])
+        self.assertTrue([line for line in ended if 'sleep' in line])
+
+        self.assertTrue([e for e in emit.events
+                         if e['event'] == 'process-started' and
+                         'sleep' in e['cmdline']])
+
+
+class AnsibleTimingSimpleCommandStepTestCase(base.BaseTestCase):
+    def test_ansible_events(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+
+        emit = RecordingEmitter('tests', None)
+        s = steps.AnsibleTimingSimpleCommandStep(
+            'play', 'cat', os.path.join(tempdir, 'timings.json'), env={})
+        s._output_analysis(emit, '\n'.join([
+            '[Executing "setup-hosts.yml" playbook]',
+            '',
+            'PLAY [Basic host setup] ' + '*' * 20,
+            '',
+            'TASK [openstack_hosts : Install host packages] ' + '*' * 20,
+            'ok: [aio1]',
+            'Run Time = 42 seconds',
+            '']))
+
+        self.assertEqual(
+            [{'event': 'ansible-playbook', 'playbook': 'setup-hosts.yml'},
+             {'event': 'ansible-play', 'playbook': 'setup-hosts.yml',
+              'play': 'Basic host setup'},
+             {'event': 'ansible-task', 'playbook': 'setup-hosts.yml',
+              'task': 'openstack_hosts : Install host packages'}],
+            emit.events)
+        self.assertEqual([('setup-hosts.yml', '42')], s.timings)
+
+    def test_lines_split_across_reads(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+
+        emit = RecordingEmitter('tests', None)
+        s = steps.AnsibleTimingSimpleCommandStep(
+            'play', 'cat', os.path.join(tempdir, 'timings.json'), env={})
+        s._output_analysis(emit, '[Executing "setup-hosts.yml" pla')
+        s._output_analysis(emit, 'ybook]\nRun Time = ')
+        s._output_analysis(emit, '42 seconds')
+        self.assertEqual([], s.timings)
+        s._output_analysis(emit, '\n')
+        self.assertEqual([('setup-hosts.yml', '42')], s.timings)
+
+    def test_task_timings(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+
+        # Stands in for openstack-ansible with the callback plugin enabled
+        records = [
+            {'event': 'playbook-start', 'playbook': 'setup-hosts.yml',
+             'time': 100.0},
+            {'event': 'task-start', 'playbook': 'setup-hosts.yml',
+             'play': 'Basic host setup', 'task': 'apt', 'uuid': 'u1',
+             'time': 100.0},
+            {'event': 'host-end', 'host': 'aio1', 'task': 'apt',
+             'uuid': 'u1', 'status': 'ok', 'time': 160.0},
+            {'event': 'host-start', 'host': 'aio2', 'task': 'apt',
+             'uuid': 'u1', 'time': 101.0},
+            {'event': 'host-end', 'host': 'aio2', 'task': 'apt',
+             'uuid': 'u1', 'status': 'failed', 'time': 102.5}]
+        command = ('cat > $OSTRICH_TIMING_PATH <<EOF\n%s\nEOF'
+                   % '\n'.join([json.dumps(r) for r in records]))
+
+        emit = RecordingEmitter('tests', None)
+        s = steps.AnsibleTimingSimpleCommandStep(
+            'play', command, os.path.join(tempdir, 'timings-play.json'),
+            env={})
+        self.assertTrue(s._run(emit, None))
+
+        with open(os.path.join(tempdir, 'task-timings-play.json')) as f:
+            timings = json.loads(f.read())
+        self.assertEqual(
+            [('aio1', 'ok', 100.0, 60.0), ('aio2', 'failed', 101.0, 1.5)],
+            [(t['host'], t['status'], t['start'], t['duration'])
+             for t in timings])
+        self.assertEqual('Basic host setup', timings[0]['play'])
+        self.assertIn('        60.0s apt on aio1', emit.lines)
+
+        # Another attempt adds to the timings already recorded
+        s._run(emit, None)
+        with open(os.path.join(tempdir, 'task-timings-play.json')) as f:
+            self.assertEqual(4, len(json.loads(f.read())))
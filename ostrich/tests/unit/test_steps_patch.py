@@ -0,0 +1,90 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+
+from oslotest import base
+
+from ostrich import steps
+from ostrich.tests.unit import test_steps_command
+
+
+class PatchStepTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(PatchStepTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+        self.patches = os.path.join(self.tempdir, 'patches')
+        os.makedirs(self.patches)
+        patch_dir = mock.patch.object(steps, 'PATCH_DIR', self.patches)
+        patch_dir.start()
+        self.addCleanup(patch_dir.stop)
+
+        self.target = os.path.join(self.tempdir, 'example.conf')
+        with open(self.target, 'w') as f:
+            f.write('a\nb\nc\n')
+
+        self._patch('good', 'b', 'B')
+        self._patch('bad', 'x', 'X')
+        self._patch('later', 'b', 'B', os.path.join(self.tempdir, 'missing'))
+
+    def _patch(self, name, old, new, target=None):
+        target = target or self.target
+        with open(os.path.join(self.patches, name), 'w') as f:
+            f.write('--- %(t)s\n+++ %(t)s\n@@ -1,3 +1,3 @@\n a\n-%(old)s\n'
+                    '+%(new)s\n c\n' % {'t': target, 'old': old, 'new': new})
+
+    def test_patch(self):
+        emit = test_steps_command.RecordingEmitter('tests', None)
+        s = steps.PatchStep('good')
+        self.assertEqual([self.target], s.cache_outputs())
+
+        with mock.patch.object(s, '_archive_files'):
+            self.assertTrue(s._run(emit, None))
+            self.assertEqual('Already applied', s._run(emit, None))
+        with open(self.target) as f:
+            self.assertEqual('a\nB\nc\n', f.read())
+        self.assertEqual(['applied', 'already applied'],
+                         [e['state'] for e in emit.events])
+
+    def test_patch_fails(self):
+        emit = test_steps_command.RecordingEmitter('tests', None)
+        s = steps.PatchStep('bad')
+        with mock.patch.object(s, '_archive_files'):
+            self.assertFalse(s._run(emit, None))
+        with open(self.target) as f:
+            self.assertEqual('a\nb\nc\n', f.read())
+
+    def test_preflight(self):
+        emit = test_steps_command.RecordingEmitter('tests', None)
+        s = steps.PatchPreflightStep('preflight', ['good', 'later'])
+        self.assertTrue(s._run(emit, None))
+        self.assertIn('good: applies', emit.lines)
+        self.assertTrue([line for line in emit.lines
+                         if line.startswith('later: deferred')])
+
+        # Nothing was changed
+        with open(self.target) as f:
+            self.assertEqual('a\nb\nc\n', f.read())
+
+    def test_preflight_reports_every_failure(self):
+        emit = test_steps_command.RecordingEmitter('tests', None)
+        s = steps.PatchPreflightStep('preflight',
+                                     ['good', 'bad', 'later', 'absent'],
+                                     require_targets=True)
+        self.assertFalse(s._run(emit, None))
+        self.assertIn('3 of 4 patches will not apply: bad, later, absent',
+                      emit.lines)
@@ -0,0 +1,127 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+
+from oslotest import base
+
+from ostrich import emitters
+from ostrich import steps
+
+
+REPLACEMENTS = [
+    ('(http|https|git)://github.com', 'http://mirror/github'),
+    ('(http|https|git)://git.openstack.org', 'http://mirror/openstack'),
+    (' +checksum:.*', ''),
+    ]
+
+
+class BulkRegexpEditorStepTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(BulkRegexpEditorStepTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tempdir, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def _read(self, name):
+        with open(os.path.join(self.tempdir, name), 'rb') as f:
+            return f.read()
+
+    def test_required_literal(self):
+        self.assertEqual('://github',
+                         steps.required_literal(REPLACEMENTS[0][0]))
+        self.assertEqual('checksum:',
+                         steps.required_literal(REPLACEMENTS[2][0]))
+        self.assertEqual(None, steps.required_literal('foo|bar'))
+        self.assertEqual(None, steps.required_literal('(?i)github'))
+
+    def test_all_replacements_in_one_pass(self):
+        self._write('a.yml', 'src: https://github.com/foo\r\n'
+                             'src: git://git.openstack.org/bar\r\n'
+                             '  checksum: abc\r\n'
+                             'untouched   \r\n')
+        self._write('roles/b.ini', 'url = http://github.com/x')
+        self._write('c.txt', 'https://github.com/filtered')
+
+        s = steps.BulkRegexpEditorStep('bulk', self.tempdir,
+                                       '.*\.(ini|yml)$', REPLACEMENTS)
+        emit = emitters.NoopEmitter('tests', None)
+        with mock.patch('__builtin__.open', side_effect=open) as mock_open:
+            self.assertEqual('Changed 4 lines in 2 files',
+                             s.run(emit, None))
+            self.assertEqual(2, len([c for c in mock_open.call_args_list
+                                     if c[0][1] == 'rb']))
+
+        # Line endings and whitespace are left alone
+        self.assertEqual('src: http://mirror/github/foo\r\n'
+                         'src: http://mirror/openstack/bar\r\n'
+                         '\r\n'
+                         'untouched   \r\n', self._read('a.yml'))
+        self.assertEqual('url = http://mirror/github/x',
+                         self._read('roles/b.ini'))
+        self.assertEqual('https://github.com/filtered', self._read('c.txt'))
+
+    def test_unchanged_files_are_not_written(self):
+        self._write('a.yml', 'nothing to see here\n')
+        self._write('b.yml', 'mentions ://github but does not match\n')
+
+        s = steps.BulkRegexpEditorStep('bulk', self.tempdir, '.*\.yml$',
+                                       REPLACEMENTS)
+        with mock.patch('__builtin__.open', side_effect=open) as mock_open:
+            result = s.run(emitters.NoopEmitter('tests', None), None)
+            self.assertEqual([], [c for c in mock_open.call_args_list
+                                  if c[0][1] == 'wb'])
+
+        # Having nothing to do is still success
+        self.assertEqual('Changed 0 lines in 0 files', result)
+
+    def test_process_pool(self):
+        for i in range(200):
+            self._write('role-%d/tasks/main.yml' % (i % 7),
+                        'src: https://github.com/foo/%d\n' % i)
+            self._write('role-%d/tasks/%d.yml' % (i % 7, i),
+                        'src: https://github.com/bar/%d\n' % i)
+        os.chmod(os.path.join(self.tempdir, 'role-0/tasks/0.yml'), 0o600)
+
+        s = steps.BulkRegexpEditorStep('bulk', self.tempdir, '.*\.yml$',
+                                       REPLACEMENTS, bulk_edit_processes=3)
+        self.assertEqual('Changed 207 lines in 207 files',
+                         s.run(emitters.NoopEmitter('tests', None), None))
+        self.assertEqual('src: http://mirror/github/bar/0\n',
+                         self._read('role-0/tasks/0.yml'))
+        self.assertEqual(0o600, os.stat(os.path.join(
+            self.tempdir, 'role-0/tasks/0.yml')).st_mode & 0o777)
+
+        # No temporary files are left behind
+        self.assertEqual(30, len(os.listdir(os.path.join(
+            self.tempdir, 'role-0/tasks'))))
+
+    def test_failed_edit(self):
+        self._write('a.yml', 'src: https://github.com/foo\n')
+        s = steps.BulkRegexpEditorStep('bulk', self.tempdir, '.*\.yml$',
+                                       REPLACEMENTS)
+        with mock.patch('ostrich.utils.atomic_write',
+                        side_effect=OSError('disk on fire')):
+            self.assertFalse(s.run(emitters.NoopEmitter('tests', None),
+                                   None))
+        self.assertEqual('src: https://github.com/foo\n',
+                         self._read('a.yml'))
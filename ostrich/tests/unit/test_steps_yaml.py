@@ -19,6 +19,7 @@ from oslotest import base
 
 from ostrich import emitters
 from ostrich import steps
+from ostrich import utils
 from ostrich.tests.unit import utils as test_utils
 
 
@@ -77,3 +78,64 @@ class YamlStepTestCase(base.BaseTestCase):
 
             self.assertTrue('name: ironic.yml.aio' in
                             y[0]['vars']['confd_overrides']['aio'])
+
+    def test_yaml_transaction_step(self):
+        tempdir = tempfile.mkdtemp()
+        path = os.path.join(tempdir, 'openstack_user_config.yml')
+        with open(path, 'w') as f:
+            f.write("""cidr_networks:
+  container: 172.29.236.0/22
+global_overrides:
+  external_lb_vip_address: 127.0.0.1
+  provider_networks:
+  - network: {net_name: a}
+  - network: {net_name: b}
+  - network: {net_name: c}
+used_ips:
+- 172.29.236.1,172.29.236.50
+""")
+
+        s = steps.YamlTransactionStep(
+            'transaction', path,
+            [('add', ['global_overrides', 'provider_networks'],
+              {'network': {'net_name': 'ironic'}}),
+             ('delete', ['global_overrides', 'provider_networks'], 2),
+             ('update', ['global_overrides'], 'external_lb_vip_address',
+              '10.0.0.4'),
+             ('merge', ['cidr_networks'], {'ironic': '10.0.0.0/24'}),
+             ('add', ['used_ips'], '10.0.0.1,10.0.0.10')])
+
+        emit = mock.MagicMock()
+        with mock.patch('ostrich.utils.atomic_write',
+                        wraps=utils.atomic_write) as mock_write:
+            self.assertTrue(s.run(emit, None))
+            self.assertEqual(1, mock_write.call_count)
+
+        with open(path) as f:
+            y = yaml.safe_load(f.read())
+        self.assertEqual(['a', 'b', 'ironic'],
+                         [n['network']['net_name'] for n in
+                          y['global_overrides']['provider_networks']])
+        self.assertEqual('10.0.0.4',
+                         y['global_overrides']['external_lb_vip_address'])
+        self.assertEqual({'container': '172.29.236.0/22',
+                          'ironic': '10.0.0.0/24'}, y['cidr_networks'])
+        self.assertEqual(['172.29.236.1,172.29.236.50',
+                          '10.0.0.1,10.0.0.10'], y['used_ips'])
+
+        # The log gets a diff rather than the whole document
+        logged = ''.join([c[0][0] for c in emit.emit.call_args_list])
+        self.assertIn('-  external_lb_vip_address: 127.0.0.1', logged)
+        self.assertIn('+  external_lb_vip_address: 10.0.0.4', logged)
+        self.assertIn('@@ -1,10 +1,13 @@', logged)
+
+    def test_yaml_transaction_unchanged(self):
+        tempdir = tempfile.mkdtemp()
+        path = os.path.join(tempdir, 'foo.yml')
+        with open(path, 'w') as f:
+            f.write('a:\n  b: 1\n')
+
+        s = steps.YamlUpdateElementStep('update', path, ['a'], 'b', 1)
+        with mock.patch('ostrich.utils.atomic_write') as mock_write:
+            self.assertTrue(s.run(mock.MagicMock(), None))
+            self.assertFalse(mock_write.called)
@@ -0,0 +1,118 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+
+from oslotest import base
+
+from ostrich import emitters
+from ostrich import steps
+from ostrich import timings
+from ostrich.tests.unit import utils as test_utils
+
+
+class PlayStep(steps.Step):
+    def _run(self, emit, screen):
+        return True
+
+    def playbook_timings(self):
+        return [('setup-hosts.yml', 40), ('setup-infrastructure.yml', 60)]
+
+
+class TimingStoreTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(TimingStoreTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.store = timings.TimingStore(
+            os.path.join(self.tempdir, 'timings.sqlite'))
+        self.addCleanup(self.store.close)
+
+    def test_percentile(self):
+        self.assertEqual(None, timings.percentile([], 50))
+        self.assertEqual(3, timings.percentile([5, 1, 3], 50))
+        self.assertEqual(2.5, timings.percentile([1, 2, 3, 4], 50))
+        self.assertEqual(96, timings.percentile(range(1, 102), 95))
+
+    def test_report(self):
+        for i in range(10):
+            self.store.record('run-%d' % i, 'sha', 'apt', i + 1, True)
+        self.store.record('run-10', 'sha', 'apt', 1000, False)
+        self.store.record('run-0', 'sha', 'play', 10, True, play='play',
+                          playbook='setup-hosts.yml')
+
+        self.assertEqual([('apt', None, 10, 5.5, 9.55),
+                          ('play', 'setup-hosts.yml', 1, 10, 10)],
+                         self.store.report())
+        self.assertEqual([], self.store.report('other'))
+
+    def test_estimates_prefer_the_same_sha(self):
+        self.store.record('run-1', 'old', 'apt', 100, True)
+        self.store.record('run-1', 'old', 'clone', 30, True)
+        self.store.record('run-2', 'new', 'apt', 10, True)
+        self.assertEqual({'apt': 10, 'clone': 30},
+                         self.store.estimates('new'))
+        self.assertEqual({'apt': 55, 'clone': 30}, self.store.estimates())
+
+    def test_regressions(self):
+        for i in range(6):
+            self.store.record('run-%d' % i, 'sha', 'apt', 10, True)
+            self.store.record('run-%d' % i, 'sha', 'clone', 10, True)
+        self.store.record('run-6', 'sha', 'apt', 11, True)
+        self.store.record('run-6', 'sha', 'clone', 40, True)
+        self.store.record('run-7', 'other', 'clone', 400, True)
+
+        self.assertEqual([('clone', None, 40, 10)],
+                         self.store.regressions('sha', last=3))
+        self.assertEqual([], self.store.regressions('other'))
+
+    @mock.patch('ostrich.emitters.SimpleEmitter', emitters.NoopEmitter)
+    def test_runner_records_steps_and_playbooks(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.timings = self.store
+        r.tested = {'stable/ocata': 'abc123'}
+        r.complete['osa-branch'] = 'stable/ocata'
+        r.load_dependancy_chain([PlayStep('play'),
+                                 steps.SimpleCommandStep('true', 'true',
+                                                         env={})])
+        r.resolve_steps(use_curses=False)
+
+        rows = self.store._query(
+            'SELECT run, sha, step, play, playbook FROM timings '
+            'ORDER BY recorded')
+        self.assertEqual(
+            [(r.run_id, 'abc123', 'play', 'play', None),
+             (r.run_id, 'abc123', 'play', 'play', 'setup-hosts.yml'),
+             (r.run_id, 'abc123', 'play', 'play', 'setup-infrastructure.yml'),
+             (r.run_id, 'abc123', 'true', None, None)],
+            [tuple(row) for row in rows])
+
+    def test_eta(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.load_dependancy_chain([PlayStep('a'), PlayStep('b'),
+                                 PlayStep('c')])
+        with mock.patch('ostrich.utils.monotonic', return_value=1000):
+            self.assertEqual(40, r._eta({'a': 30, 'b': 25, 'c': 5},
+                                        {'b': 980}))
+
+    def test_progress_shows_the_stage_eta(self):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.load_dependancy_chain([PlayStep('a'), PlayStep('b')])
+        progress = mock.Mock()
+        with mock.patch('ostrich.utils.monotonic', return_value=1000):
+            r._update_progress(progress, {'a': 30, 'b': 95}, {'a': 1000})
+        message = progress.addstr.call_args[0][2]
+        self.assertTrue(message.endswith('about 2m05s left in this stage'),
+                        message)
@@ -10,6 +10,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import mock
+import os
+import shutil
+import tempfile
+
 from oslotest import base
 
 from ostrich import utils
@@ -26,6 +31,10 @@ class UtilsTestCase(base.BaseTestCase):
         r.complete['hypervisor'] = 'ironic'
         self.assertTrue(utils.is_ironic(r))
 
+    def test_step_groups(self):
+        self.assertEqual([['a'], ['b', 'c'], ['d']],
+                         list(utils.step_groups(['a', ['b', 'c'], 'd'])))
+
     def test_recursive_dictionary_update_simple(self):
         a = {}
         b = {'a': 1, 'b': 2}
@@ -62,3 +71,54 @@ class UtilsTestCase(base.BaseTestCase):
         b = {'b': {'z': None}}
         c = utils.recursive_dictionary_update(a, b)
         self.assertEquals({'a': 1, 'b': {'a': 1, 'b': 2, 'c': 3}, 'c': 3}, c)
+
+    def test_atomic_write(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'foo.yml')
+        with open(path, 'w') as f:
+            f.write('old')
+        os.chmod(path, 0o640)
+
+        utils.atomic_write(path, 'new')
+        with open(path) as f:
+            self.assertEqual('new', f.read())
+        self.assertEqual(0o640, os.stat(path).st_mode & 0o777)
+
+        # A failure leaves the old content, and nothing else, behind
+        with mock.patch('os.rename', side_effect=OSError('no')):
+            self.assertRaises(OSError, utils.atomic_write, path, 'newer')
+        with open(path) as f:
+            self.assertEqual('new', f.read())
+        self.assertEqual(['foo.yml'], os.listdir(tempdir))
+
+    def _hosts(self, cidr):
+        r = test_utils.QuestionsAnsweredRunner(None)
+        r.complete['ironic-ip-block'] = cidr
+        return utils.expand_ironic_netblock(r)
+
+    def test_expand_ironic_netblock(self):
+        for cidr in ['192.168.52.0/24', '10.0.0.0/30', '10.0.0.0/31',
+                     '10.0.0.0/32', 'fd00::/120']:
+            net, hosts = self._hosts(cidr)
+            expected = [str(h) for h in net.hosts()]
+            self.assertEqual(expected, list(hosts))
+            self.assertEqual(len(expected), len(hosts))
+            for i in [0, 1, -1, -2]:
+                if len(expected) >= 2:
+                    self.assertEqual(expected[i], hosts[i])
+            self.assertEqual(expected[1:-1:3], hosts[1:-1:3])
+            self.assertEqual(expected[-11:], hosts[-11:])
+
+        net, hosts = self._hosts('192.168.52.0/24')
+        self.assertRaises(IndexError, hosts.__getitem__, 254)
+        self.assertRaises(IndexError, hosts.__getitem__, -255)
+
+        # The same range is given back, however big it is
+        net, hosts = self._hosts('10.0.0.0/8')
+        self.assertIs(hosts, self._hosts('10.0.0.0/8')[1])
+        self.assertEqual(2 ** 24 - 2, len(hosts))
+        self.assertEqual('10.0.0.1', hosts[0])
+        self.assertEqual('10.0.0.12', hosts[11])
+        self.assertEqual('10.255.255.244', hosts[-11])
+        self.assertEqual('10.255.255.254', hosts[-1])
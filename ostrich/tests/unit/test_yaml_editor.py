@@ -0,0 +1,141 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from oslotest import base
+
+from ostrich import yaml_editor
+
+
+DOCUMENT = """---
+# Addresses we don't hand out
+used_ips:
+  - "172.29.236.1,172.29.236.50"   # infrastructure
+
+global_overrides:
+  # The VIP
+  external_lb_vip_address: 172.29.236.100
+  tunnel_bridge: "br-vxlan"
+  provider_networks:
+    - network:
+        container_bridge: "br-mgmt"
+        ip_from_q: "container"
+    - network:
+        container_bridge: "br-vxlan"   # tunnels
+        range: "1:1000"
+
+motd: |
+  Welcome
+zebra: last
+"""
+
+
+class YamlEditorTestCase(base.BaseTestCase):
+    def _edit(self, operations, text=DOCUMENT):
+        edited, in_place = yaml_editor.edit(text, operations)
+        self.assertTrue(in_place)
+        return edited
+
+    def test_update_scalar(self):
+        edited = self._edit([('update', ['global_overrides'],
+                              'external_lb_vip_address', '10.0.0.4')])
+        self.assertEqual(DOCUMENT.replace('172.29.236.100', '10.0.0.4'),
+                         edited)
+
+    def test_update_with_block_data(self):
+        edited = self._edit([('update', [], 'zebra', {'a': 1, 'b': [2]})])
+        self.assertEqual(DOCUMENT.replace('zebra: last\n',
+                                          'zebra:\n'
+                                          '  a: 1\n'
+                                          '  b:\n'
+                                          '  - 2\n'), edited)
+
+    def test_add_to_sequence(self):
+        edited = self._edit([('add', ['used_ips'], '10.0.0.1,10.0.0.10')])
+        self.assertEqual(DOCUMENT.replace(
+            '# infrastructure\n',
+            '# infrastructure\n  - 10.0.0.1,10.0.0.10\n'), edited)
+
+    def test_add_mapping_to_sequence(self):
+        edited = self._edit([('add', ['global_overrides',
+                                      'provider_networks'],
+                              {'network': {'net_name': 'ironic'}})])
+        self.assertEqual(DOCUMENT.replace(
+            '        range: "1:1000"\n',
+            '        range: "1:1000"\n'
+            '    - network:\n'
+            '        net_name: ironic\n'), edited)
+
+    def test_new_key_after_block_scalar(self):
+        edited = self._edit([('merge', [], {'aardvark': 'first'})],
+                            text='motd: |\n  Welcome\n# trailing\n')
+        self.assertEqual('motd: |\n  Welcome\naardvark: first\n# trailing\n',
+                         edited)
+
+    def test_delete(self):
+        edited = self._edit([('delete', ['global_overrides',
+                                         'provider_networks'], 1),
+                             ('delete', ['global_overrides'],
+                              'tunnel_bridge')])
+        self.assertEqual(DOCUMENT.replace(
+            '    - network:\n'
+            '        container_bridge: "br-vxlan"   # tunnels\n'
+            '        range: "1:1000"\n', '').replace(
+            '  tunnel_bridge: "br-vxlan"\n', ''), edited)
+
+    def test_merge_keeps_order_and_comments(self):
+        edited = self._edit([('merge', ['global_overrides'],
+                              {'tunnel_bridge': 'br-tun', 'new_key': 1})])
+        self.assertEqual(DOCUMENT.replace(
+            '"br-vxlan"\n  provider', 'br-tun\n  provider').replace(
+            '        range: "1:1000"\n',
+            '        range: "1:1000"\n  new_key: 1\n'), edited)
+
+    def test_operations_see_earlier_edits(self):
+        edited = self._edit([('add', ['used_ips'], 'a'),
+                             ('add', ['used_ips'], 'b'),
+                             ('delete', ['used_ips'], 1),
+                             ('update', [], 'zebra', {'x': 1}),
+                             ('merge', ['zebra'], {'x': 2, 'y': 3}),
+                             ('delete', ['global_overrides'],
+                              'tunnel_bridge')])
+        self.assertEqual(DOCUMENT.replace(
+            '# infrastructure\n',
+            '# infrastructure\n  - b\n').replace(
+            '  tunnel_bridge: "br-vxlan"\n', '').replace(
+            'zebra: last\n', 'zebra:\n  x: 2\n  y: 3\n'), edited)
+
+    def test_composes_once(self):
+        with mock.patch.object(yaml_editor, '_compose',
+                               wraps=yaml_editor._compose) as compose:
+            self._edit([('update', ['global_overrides'], 'tunnel_bridge',
+                         'br-tun'),
+                        ('delete', ['global_overrides',
+                                    'provider_networks'], 0),
+                        ('merge', ['global_overrides'], {'a': 1, 'b': 2})])
+
+        # The document, and then only the text each edit wrote
+        self.assertEqual(DOCUMENT, compose.call_args_list[0][0][0])
+        self.assertEqual(['  tunnel_bridge: br-tun', '  a: 1\n  b: 2\n'],
+                         [c[0][0] for c in compose.call_args_list[1:]])
+
+    def test_unsupported_falls_back_to_dump(self):
+        text = 'a: {b: 1}\n# gone\n'
+        edited, in_place = yaml_editor.edit(text, [('update', ['a'], 'c', 2)])
+        self.assertFalse(in_place)
+        self.assertEqual('a:\n  b: 1\n  c: 2\n', edited)
+
+    def test_no_change(self):
+        self.assertEqual(DOCUMENT, self._edit(
+            [('update', ['global_overrides'], 'external_lb_vip_address',
+              '172.29.236.100')]))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A history of how long steps took, across runs, branches and the versions
+# of openstack-ansible in tested.json.
+#
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS timings (
+    run TEXT NOT NULL,
+    sha TEXT,
+    step TEXT NOT NULL,
+    play TEXT,
+    playbook TEXT,
+    wall REAL NOT NULL,
+    outcome INTEGER NOT NULL,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_step ON timings (step, sha);
+CREATE INDEX IF NOT EXISTS timings_run ON timings (run);
+"""
+
+
+def percentile(values, p):
+    """The p-th percentile of values, by linear interpolation."""
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+class TimingStore(object):
+    """Step timings in a local sqlite database.
+
+    Every step's wall time is recorded. Plays also record how long each of
+    their playbooks took, as rows with the playbook set.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.expanduser('~/.ostrich/timings.sqlite')
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        # Steps finish on worker threads, but are recorded by the runner's
+        # thread. The lock just makes the store safe to share anyway.
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def record(self, run, sha, step, wall, outcome, play=None,
+               playbook=None):
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    'INSERT INTO timings (run, sha, step, play, playbook, '
+                    'wall, outcome, recorded) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (run, sha, step, play, playbook, wall,
+                     1 if outcome else 0, time.time()))
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def step_history(self, sha=None):
+        """Return the wall times of successful steps, by step name.
+
+        With sha set, history for that version of openstack-ansible is used
+        for every step which has some.
+        """
+
+        history = {}
+        for step, row_sha, wall in self._query(
+                'SELECT step, sha, wall FROM timings WHERE outcome = 1 '
+                'AND playbook IS NULL ORDER BY recorded'):
+            history.setdefault(step, {}).setdefault(row_sha, []).append(wall)
+
+        result = {}
+        for step, by_sha in history.items():
+            if sha in by_sha:
+                result[step] = by_sha[sha]
+            else:
+                result[step] = sum(by_sha.values(), [])
+        return result
+
+    def estimates(self, sha=None):
+        """Return the median wall time of each step."""
+
+        return dict([(step, percentile(walls, 50))
+                     for step, walls in self.step_history(sha).items()])
+
+    def report(self, sha=None):
+        """Return (step, playbook, runs, p50, p95) for every step or play."""
+
+        where = ''
+        args = ()
+        if sha:
+            where = 'AND sha = ? '
+            args = (sha,)
+
+        walls = {}
+        for step, playbook, wall in self._query(
+                'SELECT step, playbook, wall FROM timings WHERE outcome = 1 '
+                + where + 'ORDER BY recorded', args):
+            walls.setdefault((step, playbook), []).append(wall)
+
+        report = []
+        for (step, playbook), w in walls.items():
+            report.append((step, playbook, len(w), percentile(w, 50),
+                           percentile(w, 95)))
+        return sorted(report, key=lambda r: (r[0], r[1] or ''))
+
+    def regressions(self, sha, last=5, threshold=1.5):
+        """Compare the latest run at a sha with the last runs before it.
+
+        Returns (step, playbook, wall, p50) for each step or playbook which
+        took more than threshold times its median over those runs.
+        """
+
+        runs = [run for run, in self._query(
+            'SELECT run FROM timings WHERE sha = ? GROUP BY run '
+            'ORDER BY MAX(recorded) DESC LIMIT ?', (sha, last + 1))]
+        if len(runs) < 2:
+            return []
+
+        latest = runs[0]
+        previous = runs[1:]
+
+        history = {}
+        for step, playbook, wall in self._query(
+                'SELECT step, playbook, wall FROM timings WHERE outcome = 1 '
+                'AND run IN (%s)' % ','.join(['?'] * len(previous)),
+                previous):
+            history.setdefault((step, playbook), []).append(wall)
+
+        regressions = []
+        for step, playbook, wall in self._query(
+                'SELECT step, playbook, wall FROM timings WHERE outcome = 1 '
+                'AND run = ? ORDER BY recorded', (latest,)):
+            p50 = percentile(history.get((step, playbook), []), 50)
+            if p50 and wall > p50 * threshold:
+                regressions.append((step, playbook, wall, p50))
+        return regressions
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    return '%dm%02ds' % (seconds // 60, seconds % 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Report on step timings recorded by ostrich')
+    parser.add_argument('--db', dest='db', default=None,
+                        help='The timing database to read')
+    parser.add_argument('--sha', dest='sha', default=None,
+                        help=('Only report on runs of this openstack-ansible '
+                              'sha, and look for regressions in the latest '
+                              'of them'))
+    parser.add_argument('--last', dest='last', default=5, type=int,
+                        help=('The number of earlier runs to compare the '
+                              'latest run with'))
+    parser.add_argument('--threshold', dest='threshold', default=1.5,
+                        type=float,
+                        help=('How many times its median a step must take to '
+                              'be reported as a regression'))
+    args = parser.parse_args()
+
+    store = TimingStore(args.db)
+
+    print('%-50s %6s %10s %10s' % ('step', 'runs', 'p50', 'p95'))
+    for step, playbook, runs, p50, p95 in store.report(args.sha):
+        if playbook:
+            step = '    %s' % playbook
+        print('%-50s %6d %10s %10s' % (step, runs, _format_seconds(p50),
+                                       _format_seconds(p95)))
+
+    if args.sha:
+        regressions = store.regressions(args.sha, args.last, args.threshold)
+        print('')
+        print('%d regressions in the latest run of %s'
+              % (len(regressions), args.sha))
+        for step, playbook, wall, p50 in regressions:
+            print('    %s%s took %s, median %s'
+                  % (step, ' (%s)' % playbook if playbook else '',
+                     _format_seconds(wall), _format_seconds(p50)))
+
+
+if __name__ == '__main__':
+    main()
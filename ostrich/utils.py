@@ -14,13 +14,34 @@
 #
 
 
+import ctypes
+import ctypes.util
+import datetime
+import hashlib
 import ipaddress
+import os
+import stat
+import tempfile
+import time
 
 
 def is_ironic(r):
     return r.complete['hypervisor'] == 'ironic'
 
 
+def step_groups(steps):
+    """Yield each entry of a dependency chain as a list of steps.
+
+    An entry is either a step, or a group of steps which run in parallel.
+    """
+
+    for entry in steps:
+        if isinstance(entry, (list, tuple)):
+            yield list(entry)
+        else:
+            yield [entry]
+
+
 def recursive_dictionary_update(d, updates):
     for key in updates:
         if key in d and type(d[key]) is dict:
@@ -34,10 +55,149 @@ def recursive_dictionary_update(d, updates):
     return d
 
 
+class HostRange(object):
+    """The host addresses of a network, as strings, without listing them.
+
+    This is what list(net.hosts()) would give, but indexing and slicing
+    work out an address rather than building all of them first, which
+    matters for big networks.
+    """
+
+    def __init__(self, net):
+        self.net = net
+
+        # IPv4 networks lose their network and broadcast addresses, IPv6
+        # networks only lose the subnet router anycast address
+        self._first = int(net.network_address) + 1
+        if net.version == 4:
+            self._length = net.num_addresses - 2
+        else:
+            self._length = net.num_addresses - 1
+
+    def __len__(self):
+        return self._length
+
+    def _address(self, i):
+        return str(ipaddress.ip_address(self._first + i))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._address(i)
+                    for i in xrange(*index.indices(self._length))]
+
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError('host index out of range')
+        return self._address(index)
+
+    def __iter__(self):
+        for i in xrange(self._length):
+            yield self._address(i)
+
+    def __repr__(self):
+        return 'HostRange(%s)' % self.net
+
+
+_NETBLOCKS = {}
+
+
 def expand_ironic_netblock(r):
-    net = ipaddress.ip_network(r.complete['ironic-ip-block'])
-    hosts = []
-    for h in net.hosts():
-        hosts.append(str(h))
+    cidr = r.complete['ironic-ip-block']
+    if cidr not in _NETBLOCKS:
+        net = ipaddress.ip_network(u'%s' % cidr)
+        if net.prefixlen >= net.max_prefixlen - 1:
+            # Point to point networks and single addresses have no network
+            # or broadcast address to leave out, and there are few of them
+            hosts = [str(h) for h in net.hosts()]
+        else:
+            hosts = HostRange(net)
+        _NETBLOCKS[cidr] = (net, hosts)
+
+    return _NETBLOCKS[cidr]
+
+
+def atomic_write(path, data):
+    """Replace a file's content, so that readers see all or none of it.
+
+    The file's mode and ownership are kept.
+    """
+
+    st = os.stat(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+        if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+            os.chown(tmp_path, st.st_uid, st.st_gid)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def file_digest(path):
+    """Return a sha256 hex digest for a path, or None if it doesn't exist.
+
+    Files are hashed by content. Directories are hashed by the names they
+    contain, which is enough to notice a checkout being removed or replaced
+    without reading every file in it.
+    """
+
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        for ent in sorted(os.listdir(path)):
+            h.update(ent + '\n')
+    elif os.path.exists(path):
+        with open(path, 'rb') as f:
+            while True:
+                d = f.read(1024 * 1024)
+                if not d:
+                    break
+                h.update(d)
+    else:
+        return None
+    return h.hexdigest()
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+CLOCK_MONOTONIC = 1
+
+try:
+    _librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+                         ctypes.util.find_library('c'), use_errno=True)
+    _clock_gettime = _librt.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+except (OSError, AttributeError):
+    _clock_gettime = None
+
+
+def monotonic():
+    """Seconds from an arbitrary point, unaffected by changes to the clock.
+
+    Falls back to wall clock time where clock_gettime() isn't available.
+    """
+
+    if hasattr(time, 'monotonic'):
+        return time.monotonic()
+
+    if _clock_gettime:
+        t = _Timespec()
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) == 0:
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+    return time.time()
+
+
+def run_id():
+    """A name for this ostrich run, which sorts by start time."""
 
-    return net, hosts
+    return '%s-%d' % (datetime.datetime.now().strftime('%Y%m%d-%H%M%S'),
+                      os.getpid())
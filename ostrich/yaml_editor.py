@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Edit YAML documents in place. Rather than loading a document and dumping
+# it again, which loses comments and key order, only the text of the nodes
+# an edit touches is rewritten. The positions of nodes come from
+# yaml.compose().
+#
+
+import yaml
+
+
+# Use libyaml where it is available, it is much faster
+try:
+    LOADER = yaml.CSafeLoader
+    DUMPER = yaml.CSafeDumper
+except AttributeError:
+    LOADER = yaml.SafeLoader
+    DUMPER = yaml.SafeDumper
+
+
+class UnsupportedEdit(Exception):
+    """An edit which can't be made in place, such as in a flow collection."""
+
+
+def apply_operation(y, operation):
+    """Apply an operation to loaded YAML.
+
+    An operation is a tuple of its name, the path of keys and indexes to the
+    element it applies to, and then its arguments:
+
+        ('add', path, data)          append data to a list
+        ('update', path, key, data)  set key to data
+        ('delete', path, index)      delete an index or key
+        ('merge', path, data)        update a dictionary with data
+    """
+
+    op, element_path = operation[:2]
+    args = operation[2:]
+
+    sub = y
+    for key in element_path:
+        sub = sub[key]
+
+    if op == 'add':
+        sub.append(args[0])
+    elif op == 'update':
+        sub[args[0]] = args[1]
+    elif op == 'delete':
+        del sub[args[0]]
+    elif op == 'merge':
+        sub.update(args[0])
+    else:
+        raise ValueError('Unknown YAML operation %s' % op)
+
+
+def _find(root, element_path):
+    node = root
+    for key in element_path:
+        if isinstance(node, yaml.SequenceNode):
+            node = node.value[key]
+        elif isinstance(node, yaml.MappingNode):
+            node = _lookup(node, key)[1]
+            if node is None:
+                raise KeyError(key)
+        else:
+            raise KeyError(key)
+    return node
+
+
+def _construct(node):
+    """Return the Python data for a composed node."""
+
+    if node is None:
+        return None
+    return yaml.constructor.SafeConstructor().construct_document(node)
+
+
+def _lookup(mapping, key):
+    """Return the (key node, value node) for a key, or (None, None)."""
+
+    for k, v in mapping.value:
+        if _construct(k) == key:
+            return k, v
+    return None, None
+
+
+def _index(nodes, node):
+    for i, n in enumerate(nodes):
+        if n is node or (isinstance(n, tuple) and n[0] is node):
+            return i
+    raise ValueError('node not found')
+
+
+def _end(node):
+    """The index just after the last character of a node's own text.
+
+    The end mark of a block collection is wherever the next token starts,
+    which may be several comments later, so use its last descendant.
+    """
+
+    if isinstance(node, yaml.ScalarNode) or node.flow_style or not node.value:
+        return node.end_mark.index
+
+    last = node.value[-1]
+    if isinstance(node, yaml.MappingNode):
+        last = last[1]
+    return _end(last)
+
+
+def _line_start(text, index):
+    return text.rfind('\n', 0, index) + 1
+
+
+def _line_end(text, index):
+    """The index just after the newline ending the line index is on."""
+
+    if index > 0 and text[index - 1] == '\n':
+        return index
+    end = text.find('\n', index)
+    if end == -1:
+        return len(text)
+    return end + 1
+
+
+def _alone(text, index):
+    """Check nothing but indentation comes before index on its line."""
+
+    if text[_line_start(text, index):index].strip():
+        raise UnsupportedEdit('more than one node on line %d'
+                              % (text.count('\n', 0, index) + 1))
+    return index
+
+
+def _dash(text, item):
+    """Return the index of the dash introducing a block sequence item."""
+
+    return _alone(text, text.rindex('-', 0, item.start_mark.index))
+
+
+def _block(node):
+    if node.flow_style:
+        raise UnsupportedEdit('%s is a flow collection' % node.tag)
+    if not node.value:
+        raise UnsupportedEdit('%s is empty' % node.tag)
+
+
+def _render(data, column):
+    """Render data as YAML, to start at column on an indented line."""
+
+    text = yaml.dump(data, Dumper=DUMPER, default_flow_style=False,
+                     width=1 << 30)
+    if text.endswith('\n...\n'):
+        text = text[:-len('...\n')]
+    lines = text.rstrip('\n').split('\n')
+    return ('\n' + ' ' * column).join(lines)
+
+
+def _insertion(text, end, new):
+    """Return (index, text) to insert new as lines of their own after the
+    node ending at end.
+
+    They go after the rest of the line, which might be a comment.
+    """
+
+    end = _line_end(text, end)
+    if not text[:end].endswith('\n'):
+        return end, '\n' + new + '\n'
+    return end, new + '\n'
+
+
+def _is_block_data(data):
+    return isinstance(data, (dict, list)) and data
+
+
+def _render_value(data, key_column):
+    """Render the text to follow 'key:' for a mapping value."""
+
+    if _is_block_data(data):
+        column = key_column + 2
+        return '\n' + ' ' * column + _render(data, column)
+    return ' ' + _render(data, key_column)
+
+
+def _marks(root):
+    """Return each of the marks in a tree of nodes once.
+
+    Marks can be shared, the end of a block collection is often the start
+    of the node after it, and so can nodes, through aliases.
+    """
+
+    marks = {}
+    seen = set()
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        marks[id(node.start_mark)] = node.start_mark
+        marks[id(node.end_mark)] = node.end_mark
+        if isinstance(node, yaml.MappingNode):
+            for k, v in node.value:
+                nodes.extend((k, v))
+        elif isinstance(node, yaml.SequenceNode):
+            nodes.extend(node.value)
+    return marks.values()
+
+
+class _Document(object):
+    """The text of a document, and its nodes.
+
+    The text is composed once, and then kept in step with the nodes as
+    edits are made: marks after an edit are moved along, and only the text
+    an edit writes is composed, to give the nodes it adds.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.root = _compose(text)
+
+        # Every mark in order, so that those after an edit can be found
+        # without walking the whole tree
+        self._marks = []
+        if self.root is not None:
+            self._track(self.root)
+
+    def _after(self, index):
+        """Return the position of the first mark at or after index."""
+
+        lo, hi = 0, len(self._marks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._marks[mid].index < index:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _track(self, node):
+        """Add the marks of a node, which are in text no others are in."""
+
+        marks = sorted(_marks(node), key=lambda m: m.index)
+        i = self._after(marks[0].index)
+        self._marks[i:i] = marks
+
+    def _splice(self, start, end, new):
+        old = self.text[start:end]
+        self.text = self.text[:start] + new + self.text[end:]
+
+        delta = len(new) - len(old)
+        lines = new.count('\n') - old.count('\n')
+        first = self._after(start)
+        last = self._after(end)
+        for mark in self._marks[last:]:
+            mark.index += delta
+            mark.line += lines
+        del self._marks[first:last]
+
+    def _compose_at(self, start, end):
+        """Compose the text from start to end, with marks into our text.
+
+        Anything before start on its line is treated as indentation.
+        """
+
+        line_start = _line_start(self.text, start)
+        root = _compose(' ' * (start - line_start) + self.text[start:end])
+        line = self.text.count('\n', 0, line_start)
+        for mark in _marks(root):
+            mark.index += line_start
+            mark.line += line
+        return root
+
+    def _insert(self, end, new):
+        """Insert lines after the node ending at end, and compose them."""
+
+        at, new = _insertion(self.text, end, new)
+        self._splice(at, at, new)
+        root = self._compose_at(at + len(new) - len(new.lstrip('\n')),
+                                at + len(new))
+        self._track(root)
+        return root
+
+    def merge(self, element_path, data):
+        mapping = _find(self.root, element_path)
+        if not isinstance(mapping, yaml.MappingNode):
+            raise UnsupportedEdit('%s is not a mapping' % element_path)
+        _block(mapping)
+
+        column = mapping.value[0][0].start_mark.column
+        new_keys = []
+        for key in sorted(data):
+            k, v = _lookup(mapping, key)
+            if k is None:
+                new_keys.append(' ' * column + _render(key, column) + ':' +
+                                _render_value(data[key], column))
+                continue
+
+            colon = self.text.index(':', k.end_mark.index)
+            new = _render_value(data[key], k.start_mark.column)
+            self._splice(colon + 1, _end(v), new)
+            pair = self._compose_at(k.start_mark.index,
+                                    colon + 1 + len(new)).value[0]
+            self._track(pair[1])
+            mapping.value[_index(mapping.value, k)] = (k, pair[1])
+
+        # New keys go after the last one, all in one go
+        if new_keys:
+            added = self._insert(_end(mapping), '\n'.join(new_keys))
+            mapping.value.extend(added.value)
+
+    def add(self, element_path, data):
+        sequence = _find(self.root, element_path)
+        if not isinstance(sequence, yaml.SequenceNode):
+            raise UnsupportedEdit('%s is not a sequence' % element_path)
+        _block(sequence)
+
+        dash = _dash(self.text, sequence.value[0])
+        column = dash - _line_start(self.text, dash)
+        added = self._insert(_end(sequence),
+                             ' ' * column + '- ' +
+                             _render(data, column + 2))
+        sequence.value.append(added.value[0])
+
+    def delete(self, element_path, index):
+        node = _find(self.root, element_path)
+        _block(node)
+
+        if isinstance(node, yaml.SequenceNode):
+            item = node.value[index]
+            first = _dash(self.text, item)
+            end = _end(item)
+        elif isinstance(node, yaml.MappingNode):
+            item, v = _lookup(node, index)
+            if item is None:
+                raise KeyError(index)
+            first = _alone(self.text, item.start_mark.index)
+            end = _end(v)
+        else:
+            raise UnsupportedEdit('%s is a scalar' % element_path)
+
+        del node.value[_index(node.value, item)]
+        self._splice(_line_start(self.text, first),
+                     _line_end(self.text, end), '')
+
+    def apply(self, operation):
+        op, element_path = operation[:2]
+        args = operation[2:]
+
+        if op == 'add':
+            self.add(element_path, args[0])
+        elif op == 'update':
+            self.merge(element_path, {args[0]: args[1]})
+        elif op == 'delete':
+            self.delete(element_path, args[0])
+        elif op == 'merge':
+            self.merge(element_path, args[0])
+        else:
+            raise ValueError('Unknown YAML operation %s' % op)
+
+
+def _compose(text):
+    # The pure Python loader is used here, as its marks are always
+    # character offsets into the text we were given
+    return yaml.compose(text, Loader=yaml.SafeLoader)
+
+
+def edit(text, operations):
+    """Apply operations to a YAML document, returning (text, in place).
+
+    Edits are made to the text of the document, leaving everything they
+    don't touch alone. If the result doesn't load to what the operations
+    should have produced, or an edit can't be made in place, the whole
+    document is dumped instead and in place is False.
+    """
+
+    if isinstance(text, bytes):
+        unicode_text = text.decode('utf-8')
+    else:
+        unicode_text = text
+
+    # The document is composed once, for both what the operations should
+    # produce and the edits themselves
+    document = _Document(unicode_text)
+    expected = _construct(document.root)
+    for operation in operations:
+        apply_operation(expected, operation)
+
+    try:
+        for operation in operations:
+            document.apply(operation)
+        if yaml.load(document.text, Loader=LOADER) == expected:
+            edited = document.text
+            if isinstance(text, bytes):
+                edited = edited.encode('utf-8')
+            return edited, True
+    except (UnsupportedEdit, yaml.YAMLError, ValueError, KeyError,
+            IndexError):
+        pass
+
+    return yaml.dump(expected, Dumper=DUMPER, default_flow_style=False), False